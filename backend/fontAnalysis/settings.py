@@ -40,6 +40,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'mainapp.middleware.ServerTimingMiddleware',
+    'mainapp.middleware.CompressionMiddleware',
+    'mainapp.middleware.QueryProfilingMiddleware',
+    'mainapp.middleware.SamplingProfilerMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -100,6 +104,113 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Формат хранения эмбеддингов в bytea: float32 (по умолчанию) или float16 (вдвое компактнее)
+EMBEDDING_STORAGE_DTYPE = os.environ.get('EMBEDDING_STORAGE_DTYPE', 'float32')
+
+# Активная модель эмбеддингов. Смена имени делает существующие векторы устаревшими
+# для `reembed_associations`, но не удаляет их из хранилища.
+SBERT_MODEL_NAME = os.environ.get('SBERT_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+SBERT_EMBEDDING_DIM = int(os.environ.get('SBERT_EMBEDDING_DIM', '384'))
+# Модель spaCy (ставится из requirements.txt); скачивать её в рантайме, если не найдена, — только явно
+SPACY_MODEL_NAME = os.environ.get('SPACY_MODEL_NAME', 'ru_core_news_sm')
+SPACY_AUTO_DOWNLOAD = os.environ.get('SPACY_AUTO_DOWNLOAD', '0') == '1'
+# Каталог для выгрузок эмбеддингов (.npy), которые открываются через mmap без обращения к БД
+EMBEDDING_STORE_DIR = Path(os.environ.get('EMBEDDING_STORE_DIR', BASE_DIR / 'embedding_store'))
+# Как часто (в секундах) процессный индекс семантического поиска проверяет появление новых векторов
+SEMANTIC_INDEX_CHECK_INTERVAL = int(os.environ.get('SEMANTIC_INDEX_CHECK_INTERVAL', '10'))
+# Окно (в секундах) перед последней записью вектора, которое индекс перечитывает при догрузке:
+# строки, закоммиченные позже соседей с большим id, и перезаписанные векторы
+SEMANTIC_INDEX_SETTLE_SECONDS = int(os.environ.get('SEMANTIC_INDEX_SETTLE_SECONDS', '60'))
+# Как часто профили шрифтов (fonts/similarity/) догружают новые ассоциации
+FONT_SIMILARITY_REFRESH_INTERVAL = int(os.environ.get('FONT_SIMILARITY_REFRESH_INTERVAL', '60'))
+# Как часто таблицы шрифт x лемма (fonts/lemmas/) сверяют версию данных
+LEMMA_STATS_CHECK_INTERVAL = int(os.environ.get('LEMMA_STATS_CHECK_INTERVAL', '30'))
+# Дописывать новые ассоциации в граф Graph/Node/Edge в фоновом потоке воркера после сохранения.
+# По умолчанию выключено: граф обновляет build_graph (периодически — build_graph --every N)
+GRAPH_AUTO_UPDATE = os.environ.get('GRAPH_AUTO_UPDATE', '0') == '1'
+# На сколько секунд ciphers/random/batch/ с reserve=true закрепляет выданные вариации за пользователем
+VARIATION_RESERVATION_TTL = int(os.environ.get('VARIATION_RESERVATION_TTL', '300'))
+# Предельный возраст процессного справочника шрифтов (на случай записей в обход сигналов)
+CIPHER_CATALOGUE_MAX_AGE = int(os.environ.get('CIPHER_CATALOGUE_MAX_AGE', '300'))
+# Окно перекрытия (в секундах) инкрементальной выгрузки датасета (export_dataset --incremental): строки,
+# созданные за это время до водяного знака, перечитываются, уже выгруженные отбрасываются по id.
+# Должно быть больше самой долгой пишущей транзакции (например, чанка import_sas)
+DATASET_EXPORT_SETTLE_SECONDS = int(os.environ.get('DATASET_EXPORT_SETTLE_SECONDS', '3600'))
+# Сколько секунд кэшируется ответ graph/ без prebuilt (0 — считать на каждый запрос)
+GRAPH_VIEW_CACHE_TIMEOUT = int(os.environ.get('GRAPH_VIEW_CACHE_TIMEOUT', '600'))
+# Прогревать при старте воркера не только модели, но и кэши (индекс, граф, частые запросы) — см. warm_caches;
+# сколько самых частых текстов реакций при этом прогонять через кэш поисковых запросов
+WARM_CACHES_ON_START = os.environ.get('WARM_CACHES_ON_START', '1') == '1'
+WARM_CACHES_QUERY_LIMIT = int(os.environ.get('WARM_CACHES_QUERY_LIMIT', '200'))
+# Асинхронные эндпоинты (api/async/...): потоков в пуле инференса на воркер, одновременных вызовов
+# на эндпоинт и сколько секунд запрос ждёт свободный слот, прежде чем получить 503
+INFERENCE_POOL_SIZE = int(os.environ.get('INFERENCE_POOL_SIZE', '2'))
+ASYNC_ENDPOINT_LIMITS = {
+    'search': int(os.environ.get('ASYNC_SEARCH_CONCURRENCY', '2')),
+    'nlp': int(os.environ.get('ASYNC_NLP_CONCURRENCY', '1')),
+    'graph': int(os.environ.get('ASYNC_GRAPH_CONCURRENCY', '1')),
+}
+ASYNC_QUEUE_TIMEOUT = float(os.environ.get('ASYNC_QUEUE_TIMEOUT', '10'))
+# Допуск к тяжёлым NLP-эндпоинтам (mainapp/admission.py), общий для воркеров хоста. SLOTS — сколько таких
+# запросов выполняется одновременно; запрос занимает стоимость / COST_PER_SLOT слотов (стоимость — строки x варианты
+# обработки). QUEUE — сколько запросов может ждать слоты до DEADLINE секунд; сверх этого сразу 429.
+# Ожидающий запрос занимает sync-воркер, поэтому очередь и срок короткие.
+ADMISSION_DIR = os.environ.get('ADMISSION_DIR', '')
+ADMISSION = {
+    'nlp-all': {
+        'SLOTS': int(os.environ.get('ADMISSION_NLP_ALL_SLOTS', '1')),
+        'COST_PER_SLOT': 1000,
+        'QUEUE': int(os.environ.get('ADMISSION_NLP_ALL_QUEUE', '1')),
+        'DEADLINE': float(os.environ.get('ADMISSION_NLP_ALL_DEADLINE', '2')),
+    },
+    'nlp-filtered': {
+        'SLOTS': int(os.environ.get('ADMISSION_NLP_FILTERED_SLOTS', '2')),
+        'COST_PER_SLOT': 1000,
+        'QUEUE': int(os.environ.get('ADMISSION_NLP_FILTERED_QUEUE', '2')),
+        'DEADLINE': float(os.environ.get('ADMISSION_NLP_FILTERED_DEADLINE', '2')),
+    },
+}
+# orjson для больших JSON-ответов (mainapp/renderers.py); 0 — стандартная сериализация DRF/Django
+FAST_JSON_ENABLED = os.environ.get('FAST_JSON_ENABLED', '1') == '1'
+# Сжатие больших JSON-ответов (FastJSONRenderer/FastJsonResponse) от MIN_SIZE байт: Brotli или gzip
+# по Accept-Encoding (CompressionMiddleware). По умолчанию выключено — обычно сжимает обратный прокси
+RESPONSE_COMPRESSION = {
+    'ENABLED': os.environ.get('RESPONSE_COMPRESSION_ENABLED', '0') == '1',
+    'MIN_SIZE': int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', '1024')),
+    'BROTLI_QUALITY': int(os.environ.get('RESPONSE_COMPRESSION_BROTLI_QUALITY', '4')),
+}
+# Заголовок Server-Timing с длительностями этапов NLP в ответах API
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', '0') == '1'
+# Токен для api/metrics/ (заголовок X-Metrics-Token); без него метрики доступны только администраторам
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Профилирование SQL по маршрутам (mainapp/query_profiler.py): доля запросов в выборке (0 — выключено),
+# сколько повторов одного запроса за запрос считать N+1 и сколько последних замеров хранить на маршрут
+QUERY_PROFILING = {
+    'SAMPLE_RATE': float(os.environ.get('QUERY_PROFILING_SAMPLE_RATE', '1.0' if DEBUG else '0.05')),
+    'N_PLUS_ONE_THRESHOLD': int(os.environ.get('QUERY_PROFILING_N_PLUS_ONE', '10')),
+    'WINDOW': int(os.environ.get('QUERY_PROFILING_WINDOW', '500')),
+}
+# Куда профилировщик по запросу (api/profiling/) пишет collapsed stacks и .prof
+PROFILING_DIR = Path(os.environ.get('PROFILING_DIR', BASE_DIR / 'profiles'))
+
+# Кэш Django. По умолчанию локальный для процесса; для общего между воркерами кэша
+# укажите, например, DJANGO_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# и DJANGO_CACHE_LOCATION=/var/tmp/fontanalysis_cache
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'fontanalysis-default'),
+    }
+}
+
+# LRU/TTL-кэш анализа поисковых запросов (леммы + эмбеддинг), см. mainapp/query_cache.py
+QUERY_EMBEDDING_CACHE = {
+    'MAX_SIZE': int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '2048')),
+    'TTL': int(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', '3600')),
+    'SHARED': os.environ.get('QUERY_EMBEDDING_CACHE_SHARED', '0') == '1',
+    'CACHE_ALIAS': 'default',
+}
+
 cors_allowed_origins_env = os.environ.get('CORS_ALLOWED_ORIGINS', '')
 CORS_ALLOWED_ORIGINS = [origin.strip() for origin in cors_allowed_origins_env.split(',') if origin.strip()]
 
@@ -0,0 +1,41 @@
+# Конфигурация gunicorn: gunicorn -c gunicorn.conf.py
+import gc
+import os
+
+# GUNICORN_ASGI=1 — ASGI-приложение под воркерами uvicorn: тяжёлые эндпоинты api/async/...
+# считаются в пуле потоков, не блокируя воркер (см. mainapp/inference_pool.py)
+if os.environ.get('GUNICORN_ASGI', '0') == '1':
+    wsgi_app = 'fontAnalysis.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'fontAnalysis.wsgi:application'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '3'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+# Приложение и модели NLP загружаются в мастере один раз, воркеры получают их через fork (copy-on-write)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    """Мастер, до запуска воркеров: с preload_app загрузить модели здесь, а не в каждом воркере."""
+    if not preload_app:
+        return
+    from mainapp.nlp_models import preload_models
+
+    preload_models()
+    # Всё загруженное выводится из-под сборщика мусора: его проходы в воркерах не пишут
+    # в эти объекты и не превращают общие страницы памяти в копии
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """
+    Воркер: прогрев моделей и кэшей (mainapp/cache_warmup.py) в фоновом потоке, без preload_app
+    модели загружаются там же. До его окончания api/health/ready/ отвечает 503.
+    """
+    from mainapp.cache_warmup import ensure_warm_up_started
+
+    ensure_warm_up_started()
@@ -3,7 +3,8 @@ from django.contrib import admin
 
 # Импортируем ваши модели из models.py
 from .models import (
-    Administrator, Graph, Node, Edge, Reaction, Study, Cipher, Association
+    Administrator, Graph, Node, Edge, Reaction, Study, Cipher, Association,
+    EmbeddingModel, AssociationEmbedding
 )
 
 # Модель User регистрируется автоматически Django,
@@ -18,7 +19,12 @@ admin.site.register(Edge)
 admin.site.register(Reaction)
 admin.site.register(Study)
 admin.site.register(Cipher)
-admin.site.register(Association)
+@admin.register(Association)
+class AssociationAdmin(admin.ModelAdmin):
+    # __str__ ассоциации обращается к user и cipher: без JOIN список давал бы по два запроса на строку
+    list_select_related = ('user', 'cipher')
+admin.site.register(EmbeddingModel)
+admin.site.register(AssociationEmbedding)
 
 # Если в будущем вы захотите КАСТОМИЗИРОВАТЬ админку для User,
 # то вам нужно будет сначала импортировать get_user_model,
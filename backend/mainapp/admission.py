@@ -0,0 +1,206 @@
+import fcntl
+import logging
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from django.conf import settings
+
+from .metrics import metrics
+
+logger = logging.getLogger('mainapp')
+
+# Сколько прогонов NLPProcessingDirector делает NLPAnalysisView._get_processing_variants на одну реакцию
+NLP_VARIANTS_PER_ROW = 5
+# Интервал повторной попытки занять слоты, пока запрос ждёт в очереди, секунды
+POLL_INTERVAL = 0.05
+
+DEFAULT_GATE = {'SLOTS': 1, 'COST_PER_SLOT': 1000, 'QUEUE': 1, 'DEADLINE': 2.0, 'RETRY_AFTER': 30}
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: очередь эндпоинта заполнена (429) или слоты не освободились до срока (503)."""
+
+    def __init__(self, endpoint: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"Эндпоинт '{endpoint}' перегружен ({reason}).")
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def admission_dir() -> Path:
+    configured = getattr(settings, 'ADMISSION_DIR', '')
+    return Path(configured) if configured else Path(tempfile.gettempdir()) / 'fontanalysis-admission'
+
+
+def _try_lock(path: Path):
+    """Открытый файл с эксклюзивной блокировкой или None, если её держит другой запрос."""
+    handle = open(path, 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return None
+    return handle
+
+
+def _release(handles: List) -> None:
+    for handle in handles:
+        handle.close()  # вместе с файлом снимается и flock
+
+
+class AdmissionTicket:
+    """Занятые слоты эндпоинта; release() идемпотентен."""
+
+    def __init__(self, gate: 'EndpointGate', handles: List, cost: int):
+        self.gate = gate
+        self.cost = cost
+        self._handles = handles
+        self._started = time.monotonic()
+        self._released = False
+
+    @property
+    def slots(self) -> int:
+        return len(self._handles)
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        _release(self._handles)
+        self.gate._finished(time.monotonic() - self._started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class EndpointGate:
+    """
+    Допуск к тяжёлому эндпоинту, общий для всех воркеров хоста: SLOTS lock-файлов (flock)
+    в admission_dir(). Запрос занимает ceil(стоимость / COST_PER_SLOT) слотов, но не больше SLOTS,
+    так что дорогой запрос выполняется, только когда эндпоинт свободен. Стоимость — строки x варианты.
+    Пока слотов нет, запрос ждёт до DEADLINE секунд, занимая место в очереди из QUEUE мест;
+    мест нет — сразу 429, срок вышел — 503. Блокировки снимаются ОС, даже если воркер упал.
+    """
+
+    def __init__(self, endpoint: str, config: Optional[dict] = None):
+        self.endpoint = endpoint
+        self.config = {**DEFAULT_GATE, **(config or {})}
+        self._lock = threading.Lock()
+        self._mean_seconds: Optional[float] = None
+
+    @property
+    def directory(self) -> Path:
+        return admission_dir() / self.endpoint
+
+    def slots_for(self, cost: int) -> int:
+        return max(1, min(self.config['SLOTS'], math.ceil(max(cost, 1) / self.config['COST_PER_SLOT'])))
+
+    def retry_after(self) -> int:
+        """Средняя длительность запроса в этом процессе (или RETRY_AFTER, пока замеров нет), секунды."""
+        mean = self._mean_seconds
+        return max(1, math.ceil(mean)) if mean is not None else self.config['RETRY_AFTER']
+
+    def _grab(self, prefix: str, count: int, total: int) -> Optional[List]:
+        handles = []
+        # Начинаем со случайного слота, чтобы конкурирующие запросы реже мешали друг другу
+        start = random.randrange(total)
+        for offset in range(total):
+            handle = _try_lock(self.directory / f"{prefix}-{(start + offset) % total}.lock")
+            if handle is not None:
+                handles.append(handle)
+                if len(handles) == count:
+                    return handles
+        _release(handles)
+        return None
+
+    def admit(self, cost: int) -> AdmissionTicket:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        needed = self.slots_for(cost)
+        handles = self._grab('slot', needed, self.config['SLOTS'])
+        if handles is not None:
+            return self._admitted(handles, cost, waited=0.0)
+
+        queue_place = self._grab('queue', 1, self.config['QUEUE']) if self.config['QUEUE'] > 0 else None
+        if queue_place is None:
+            self._reject(429, 'queue_full')
+        metrics.gauge_add('admission_queue_depth', 1, endpoint=self.endpoint)
+        started = time.monotonic()
+        deadline = started + self.config['DEADLINE']
+        try:
+            while handles is None and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                handles = self._grab('slot', needed, self.config['SLOTS'])
+        finally:
+            _release(queue_place)
+            metrics.gauge_add('admission_queue_depth', -1, endpoint=self.endpoint)
+        if handles is None:
+            self._reject(503, 'deadline')
+        return self._admitted(handles, cost, waited=time.monotonic() - started)
+
+    def _admitted(self, handles: List, cost: int, waited: float) -> AdmissionTicket:
+        metrics.observe('admission_wait_seconds', waited, endpoint=self.endpoint)
+        metrics.gauge_add('admission_in_flight', 1, endpoint=self.endpoint)
+        return AdmissionTicket(self, handles, cost)
+
+    def _reject(self, status_code: int, reason: str):
+        metrics.inc('admission_rejected_total', endpoint=self.endpoint, reason=reason)
+        logger.warning(f"Допуск к '{self.endpoint}': запрос отклонён ({reason}), pid {os.getpid()}.")
+        raise AdmissionRejected(self.endpoint, status_code, self.retry_after(), reason)
+
+    def _finished(self, seconds: float) -> None:
+        metrics.gauge_add('admission_in_flight', -1, endpoint=self.endpoint)
+        with self._lock:
+            # Скользящее среднее: Retry-After следует за текущей нагрузкой, а не за всей историей
+            self._mean_seconds = seconds if self._mean_seconds is None else 0.8 * self._mean_seconds + 0.2 * seconds
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_gate(endpoint: str) -> EndpointGate:
+    with _gates_lock:
+        gate = _gates.get(endpoint)
+        if gate is None:
+            gate = _gates[endpoint] = EndpointGate(endpoint, getattr(settings, 'ADMISSION', {}).get(endpoint))
+        return gate
+
+
+def admit(endpoint: str, rows: Optional[int], variants: int = NLP_VARIANTS_PER_ROW) -> AdmissionTicket:
+    """Допуск запроса, обрабатывающего rows строк по variants вариантов NLP-анализа."""
+    return get_gate(endpoint).admit((rows or 0) * variants)
+
+
+class ReleasingIterator:
+    """
+    Итератор для StreamingHttpResponse, который держит допуск до конца выдачи: Django вызывает
+    close() при закрытии ответа, даже если клиент отключился до первой записи.
+    """
+
+    def __init__(self, iterable, ticket: AdmissionTicket):
+        self._iterator = iter(iterable)
+        self._ticket = ticket
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self) -> None:
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._ticket.release()
@@ -0,0 +1,4 @@
+"""
+Воспроизводимые бенчмарки горячих путей (NLP, поиск, граф, агрегации, сохранение исследований)
+на синтетическом корпусе с фиксированным seed. Запуск: manage.py benchmark.
+"""
@@ -0,0 +1,174 @@
+import itertools
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+from django.test import override_settings
+from django.urls import reverse
+
+from ..synthetic_corpus import query_vector, reaction_texts
+from .corpus import BENCH_CIPHERS
+from .harness import SkipBenchmark
+
+NLP_BATCH_SIZE = 64
+STUDY_BATCH_SIZE = 20
+
+
+@dataclass
+class Benchmark:
+    name: str
+    # setup(context) -> (operation, items_per_op); SkipBenchmark, если сценарий недоступен
+    setup: Callable[[dict], Tuple[Callable[[], object], int]]
+    # False — не зависит от размера корпуса и выполняется один раз
+    per_size: bool = True
+    iterations: int = 20
+
+
+def _director():
+    try:
+        from ..nlp_processor import AdvancedTextProcessorBuilder, NLPProcessingDirector
+    except ImportError as e:
+        raise SkipBenchmark(f"NLP-зависимости не установлены: {e}")
+    return NLPProcessingDirector(builder=AdvancedTextProcessorBuilder())
+
+
+def _require_views():
+    try:
+        from .. import views  # noqa: F401 — views тянут spaCy/SBERT при импорте
+    except ImportError as e:
+        raise SkipBenchmark(f"views недоступны: {e}")
+
+
+def _expect_ok(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {str(getattr(response, 'data', response.content))[:200]}")
+    return response
+
+
+# --- NLP ---
+
+def nlp_single(context):
+    director = _director()
+    text = "Строгий, немного старомодный шрифт — как в официальных документах"
+    return (lambda: director.construct_custom_analysis(text=text, gen_text_emb=False)), 1
+
+
+def nlp_batch(context):
+    director = _director()
+    texts = reaction_texts(NLP_BATCH_SIZE, context['seed'])
+
+    def operation():
+        for text in texts:
+            director.construct_custom_analysis(text=text, gen_text_emb=False)
+    return operation, NLP_BATCH_SIZE
+
+
+def embed_batch(context):
+    from ..embeddings import embed_texts
+
+    texts = reaction_texts(NLP_BATCH_SIZE, context['seed'])
+    try:
+        if embed_texts(texts[:1]) is None:
+            raise SkipBenchmark("модель SentenceTransformer не загружена")
+    except ImportError as e:
+        raise SkipBenchmark(f"NLP-зависимости не установлены: {e}")
+    return (lambda: embed_texts(texts, batch_size=NLP_BATCH_SIZE)), NLP_BATCH_SIZE
+
+
+# --- Поиск ---
+
+def search_lexical(context):
+    _require_views()
+    url = reverse('association-search')
+    payload = {'reaction_description': 'строгий весёлый', 'search_use_embeddings': 'false', 'match_exact_variation': 'false'}
+    return (lambda: _expect_ok(context['client'].post(url, payload, format='json'))), 1
+
+
+def search_semantic_index(context):
+    from ..vector_index import get_semantic_index
+
+    index = get_semantic_index()
+    if not len(index):
+        raise SkipBenchmark("семантический индекс пуст")
+    query = query_vector('строгий деловой', seed=context['seed'], dim=index.matrix.shape[1])
+    filters = {'font_weight': [400, 700]}
+    return (lambda: index.search(query, k=200, filters=filters, min_score=0.3)), 1
+
+
+def search_semantic_view(context):
+    _require_views()
+    from ..nlp_processor import get_sentence_transformer
+
+    if get_sentence_transformer() is None:
+        raise SkipBenchmark("модель SentenceTransformer не загружена")
+    url = reverse('association-search')
+    payload = {'reaction_description': 'строгий деловой', 'search_use_embeddings': 'true'}
+    return (lambda: _expect_ok(context['client'].post(url, payload, format='json'))), 1
+
+
+# --- Граф и агрегации ---
+
+def graph_live(context):
+    _require_views()
+    url = reverse('graph-data')
+
+    def operation():
+        # Мимо кэша ответа (cached_live_graph_data): замеряется расчёт графа, а не попадание в кэш после прогрева
+        with override_settings(GRAPH_VIEW_CACHE_TIMEOUT=0):
+            return _expect_ok(context['client'].get(url))
+    return operation, 1
+
+
+def graph_prebuilt(context):
+    _require_views()
+    from ..graph_builder import rebuild_graph
+
+    rebuild_graph()
+    url = reverse('graph-data')
+    return (lambda: _expect_ok(context['client'].get(url, {'prebuilt': 'true'}))), 1
+
+
+def fast_grouped(context):
+    _require_views()
+    url = reverse('fast_grouped_associations')
+    return (lambda: _expect_ok(context['client'].get(url, {'limit': 50}))), 1
+
+
+# --- Запись ---
+
+def study_bulk_save(context):
+    _require_views()
+    from ..cipher_catalogue import get_cipher_catalogue
+    from ..variation_space import decode_variation
+
+    url = reverse('study-save')
+    cipher_ids = [cipher.id for cipher in get_cipher_catalogue().ciphers][:BENCH_CIPHERS]
+    texts = reaction_texts(STUDY_BATCH_SIZE, context['seed'] + 1)
+    # Каждый вызов сохраняет новые вариации пользователя, иначе StudyView отвечал бы «повторная реакция»
+    variations = itertools.count()
+
+    def operation():
+        items = []
+        for text in texts:
+            j = next(variations)
+            _, weight, style, spacing, size, line_height = decode_variation(j // len(cipher_ids))
+            items.append({
+                'cipher_id': cipher_ids[j % len(cipher_ids)], 'reaction_description': text,
+                'font_weight': weight, 'font_style': style, 'letter_spacing': spacing,
+                'font_size': size, 'line_height': line_height,
+            })
+        return _expect_ok(context['study_client'].post(url, items, format='json'))
+    return operation, STUDY_BATCH_SIZE
+
+
+BENCHMARKS = (
+    Benchmark('nlp_single', nlp_single, per_size=False, iterations=50),
+    Benchmark('nlp_batch', nlp_batch, per_size=False, iterations=5),
+    Benchmark('embed_batch', embed_batch, per_size=False, iterations=10),
+    Benchmark('search_lexical', search_lexical),
+    Benchmark('search_semantic_index', search_semantic_index, iterations=50),
+    Benchmark('search_semantic_view', search_semantic_view),
+    Benchmark('graph_live', graph_live, iterations=3),
+    Benchmark('graph_prebuilt', graph_prebuilt),
+    Benchmark('fast_grouped', fast_grouped, iterations=10),
+    Benchmark('study_bulk_save', study_bulk_save, iterations=5),
+)
@@ -0,0 +1,21 @@
+from typing import Dict
+
+from ..synthetic_corpus import SyntheticCorpusGenerator
+
+BENCH_USER_PREFIX = 'bench_user_'
+BENCH_CIPHERS = 20
+
+
+def build_synthetic_corpus(size: int, seed: int = 1234, users: int = 0) -> Dict[str, int]:
+    """
+    Корпус для бенчмарков из SyntheticCorpusGenerator (как у generate_corpus): предыдущий корпус
+    пользователей bench_user_* удаляется, новый — BENCH_CIPHERS шрифтов, леммы из словаря
+    и эмбеддинги-суммы векторов лемм (запросы строит synthetic_corpus.query_vector).
+    """
+    generator = SyntheticCorpusGenerator(
+        size, users=users or max(10, size // 50), ciphers=BENCH_CIPHERS, seed=seed,
+        user_prefix=BENCH_USER_PREFIX, lemmas='dictionary', embeddings='random',
+    )
+    generator.clear()
+    summary = generator.generate()
+    return {'associations': summary['associations'], 'users': summary['users'], 'ciphers': summary['ciphers']}
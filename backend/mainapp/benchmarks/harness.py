@@ -0,0 +1,150 @@
+import json
+import logging
+import platform
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import psutil
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger('mainapp')
+
+# Метрики, по которым сравнение с базовой линией ищет регрессии (больше — хуже)
+REGRESSION_METRICS = ('p50_ms', 'p95_ms', 'queries_per_op')
+
+
+class SkipBenchmark(Exception):
+    """Сценарий нельзя выполнить в этом окружении (нет модели, RuWordNet и т.п.)."""
+
+
+@dataclass
+class CaseResult:
+    name: str
+    size: int
+    iterations: int = 0
+    items_per_op: int = 1
+    ops_per_sec: float = 0.0
+    items_per_sec: float = 0.0
+    mean_ms: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    p99_ms: float = 0.0
+    queries_per_op: float = 0.0
+    peak_rss_mb: float = 0.0
+    skipped: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.size}"
+
+
+class _RssSampler(threading.Thread):
+    """Пиковый RSS процесса за время сценария (опрос каждые interval секунд)."""
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.process.memory_info().rss
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, self.process.memory_info().rss)
+
+
+def run_case(name: str, size: int, operation: Callable[[], object], iterations: int = 20,
+             warmup: int = 2, items_per_op: int = 1) -> CaseResult:
+    """
+    Выполняет operation warmup + iterations раз: латентность каждого вызова,
+    число SQL-запросов на вызов и пиковый RSS за время замеров.
+    """
+    for _ in range(warmup):
+        operation()
+
+    latencies = np.empty(iterations, dtype=np.float64)
+    sampler = _RssSampler()
+    sampler.start()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for i in range(iterations):
+            call_started = time.perf_counter()
+            operation()
+            latencies[i] = time.perf_counter() - call_started
+        total = time.perf_counter() - started
+    peak_rss = sampler.stop()
+
+    latencies_ms = latencies * 1000.0
+    return CaseResult(
+        name=name, size=size, iterations=iterations, items_per_op=items_per_op,
+        ops_per_sec=round(iterations / total, 3),
+        items_per_sec=round(iterations * items_per_op / total, 3),
+        mean_ms=round(float(latencies_ms.mean()), 3),
+        p50_ms=round(float(np.percentile(latencies_ms, 50)), 3),
+        p95_ms=round(float(np.percentile(latencies_ms, 95)), 3),
+        p99_ms=round(float(np.percentile(latencies_ms, 99)), 3),
+        queries_per_op=round(len(queries.captured_queries) / iterations, 2),
+        peak_rss_mb=round(peak_rss / 2 ** 20, 1),
+    )
+
+
+# --- Файл результатов и сравнение с базовой линией ---
+
+def environment_info() -> dict:
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': psutil.cpu_count(),
+        'database': connection.vendor,
+    }
+
+
+def save_results(path, results: List[CaseResult], seed: int) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        'created_at': time.time(),
+        'seed': seed,
+        'environment': environment_info(),
+        'results': {result.key: asdict(result) for result in results},
+    }
+    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+def load_results(path) -> Dict[str, dict]:
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding='utf-8')).get('results', {})
+
+
+def compare_with_baseline(results: List[CaseResult], baseline: Dict[str, dict], threshold: float = 0.10) -> List[dict]:
+    """
+    Сравнение с базовой линией: изменение каждой метрики REGRESSION_METRICS в долях.
+    regression=True — метрика выросла больше чем на threshold.
+    """
+    rows = []
+    for result in results:
+        previous = baseline.get(result.key)
+        if result.skipped or not previous or previous.get('skipped'):
+            continue
+        for metric in REGRESSION_METRICS:
+            before, after = float(previous.get(metric, 0.0)), float(getattr(result, metric))
+            change = (after - before) / before if before else (0.0 if after == before else float('inf'))
+            rows.append({
+                'case': result.key, 'metric': metric, 'baseline': before, 'current': after,
+                'change': change, 'regression': change > threshold,
+            })
+    return rows
@@ -0,0 +1,337 @@
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger('mainapp')
+
+STAGING_TABLE = 'association_import_staging'
+STAGING_COLUMNS = (
+    'user_id', 'cipher_id', 'reaction_description', 'font_weight', 'font_style',
+    'letter_spacing', 'font_size', 'line_height',
+)
+# Параметры вариации, которых может не быть в CSV: берутся значения по умолчанию модели
+VARIATION_DEFAULTS = {'font_weight': 400, 'font_style': 'normal', 'letter_spacing': 0, 'font_size': 16, 'line_height': 1.5}
+
+
+# --- Чтение CSV с отслеживанием байтового смещения (для продолжения после сбоя) ---
+
+class _OffsetLines:
+    """Строки бинарного файла как str; offset — байт, до которого csv.reader уже дочитал."""
+
+    def __init__(self, handle, offset: int = 0):
+        self.handle = handle
+        self.offset = offset
+        handle.seek(offset)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.handle.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode('utf-8-sig' if self.offset == len(line) else 'utf-8')
+
+
+def read_header(path) -> List[str]:
+    with open(path, 'r', encoding='utf-8-sig', newline='') as handle:
+        return next(csv.reader(handle), [])
+
+
+def iter_csv_rows(path, header: List[str], offset: int = 0) -> Iterator[Tuple[dict, int]]:
+    """(строка как dict, смещение конца строки). offset=0 — с начала, заголовок пропускается."""
+    with open(path, 'rb') as handle:
+        lines = _OffsetLines(handle, offset)
+        reader = csv.reader(lines)
+        if offset == 0:
+            next(reader, None)
+        for values in reader:
+            yield dict(zip(header, values)), lines.offset
+
+
+# --- Прогресс импорта: JSON рядом с файлом ассоциаций ---
+
+@dataclass
+class ImportProgress:
+    path: str
+    size: int
+    mtime: float
+    offset: int = 0
+    rows: int = 0
+    imported: int = 0
+    skipped: int = 0
+    enriched: int = 0
+    finished: bool = False
+    errors: List[str] = field(default_factory=list)
+
+    @staticmethod
+    def state_path(path) -> Path:
+        return Path(str(path) + '.progress.json')
+
+    @classmethod
+    def load_or_start(cls, path, resume: bool = True) -> 'ImportProgress':
+        stat = os.stat(path)
+        fresh = cls(path=str(Path(path).resolve()), size=stat.st_size, mtime=stat.st_mtime)
+        state_path = cls.state_path(path)
+        if not resume or not state_path.exists():
+            return fresh
+        saved = cls(**json.loads(state_path.read_text(encoding='utf-8')))
+        if (saved.size, saved.mtime) != (fresh.size, fresh.mtime):
+            logger.warning(f"Файл {path} изменился после прошлого запуска импорта — импорт начнётся сначала.")
+            return fresh
+        return saved
+
+    def save(self) -> None:
+        state_path = self.state_path(self.path)
+        tmp_path = state_path.with_name(state_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(asdict(self), ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, state_path)
+
+
+# --- NLP-обогащение в пуле процессов ---
+
+_worker_director = None
+
+
+def _init_nlp_worker():
+    global _worker_director
+    from .nlp_processor import AdvancedTextProcessorBuilder, NLPProcessingDirector
+    _worker_director = NLPProcessingDirector(builder=AdvancedTextProcessorBuilder())
+
+
+def analyze_reaction(text: str) -> Tuple[str, str]:
+    """(reaction_lemmas, grouping_key_lemmas) — те же шаги, что и при сохранении в StudyView."""
+    if _worker_director is None:
+        _init_nlp_worker()
+    result = _worker_director.construct_custom_analysis(
+        text=text, preprocess=True, tokenize_step=True, remove_stops=True,
+        lemmatize_step=True, group_syns=False, gen_text_emb=False, grouping_strategy='lemmas',
+    )
+    return " ".join(result.lemmas), result.grouping_key or ""
+
+
+class AssociationImporter:
+    """
+    Потоковый импорт ассоциаций из CSV: файл читается один раз, каждая пачка строк
+    загружается через COPY во временную таблицу и сливается в mainapp_association
+    через INSERT ... ON CONFLICT DO NOTHING. Пачка коммитится вместе с обогащением
+    (леммы, ключ группировки, эмбеддинги), после коммита сохраняется прогресс —
+    повторный запуск продолжает с последней закоммиченной пачки.
+
+    Колонки CSV: user_id или username, cipher_id или cipher (название), reaction_description;
+    параметры вариации необязательны (см. VARIATION_DEFAULTS).
+    """
+
+    def __init__(self, chunk_size: int = 5000, user_prefix: str = 'sas_user_', enrich: bool = False,
+                 workers: int = 0, embed_batch_size: int = 256, log=None):
+        self.chunk_size = chunk_size
+        self.user_prefix = user_prefix
+        self.enrich = enrich
+        self.workers = workers
+        self.embed_batch_size = embed_batch_size
+        self.log = log or logger.info
+        self._user_ids: Dict[str, int] = {}
+        self._cipher_ids: Dict[str, int] = {}
+        self._pool = None
+        self._embedding_model = None
+
+    # --- Шрифты ---
+
+    def import_ciphers(self, path) -> int:
+        from .cipher_catalogue import invalidate_cipher_catalogue
+        from .models import Cipher
+
+        with open(path, 'r', encoding='utf-8-sig', newline='') as handle:
+            ciphers = [Cipher(id=int(row['id']), result=row['result']) for row in csv.DictReader(handle)]
+        with transaction.atomic():
+            Cipher.objects.bulk_create(ciphers, ignore_conflicts=True, batch_size=self.chunk_size)
+            # Явные id не двигают последовательность: без сброса следующий Cipher.objects.create упадёт
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Cipher]):
+                    cursor.execute(sql)
+        invalidate_cipher_catalogue()  # bulk_create не шлёт сигналы
+        return len(ciphers)
+
+    def _resolve_cipher_names(self, names) -> None:
+        from .cipher_catalogue import get_cipher_catalogue, invalidate_cipher_catalogue
+        from .models import Cipher
+
+        missing = [name for name in names if name not in self._cipher_ids]
+        if not missing:
+            return
+        catalogue = get_cipher_catalogue()
+        unknown = [name for name in missing if name not in catalogue.id_by_name]
+        if unknown:
+            Cipher.objects.bulk_create([Cipher(result=name) for name in unknown])
+            invalidate_cipher_catalogue()
+            catalogue = get_cipher_catalogue()
+        self._cipher_ids.update({name: catalogue.id_by_name[name] for name in missing if name in catalogue.id_by_name})
+
+    # --- Пользователи ---
+
+    def _username(self, row: dict) -> Optional[str]:
+        if row.get('username'):
+            return row['username'].strip()
+        try:
+            return f"{self.user_prefix}{int(row['user_id'])}" if row.get('user_id') else None
+        except ValueError:
+            return None
+
+    def _resolve_users(self, usernames) -> None:
+        User = get_user_model()
+        missing = [name for name in usernames if name not in self._user_ids]
+        if not missing:
+            return
+        self._user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        new = [name for name in missing if name not in self._user_ids]
+        if new:
+            User.objects.bulk_create(
+                [User(username=name, email=f"{name}@example.com", is_active=True) for name in new],
+                ignore_conflicts=True,
+            )
+            self._user_ids.update(User.objects.filter(username__in=new).values_list('username', 'id'))
+
+    # --- Пачка: нормализация -> COPY -> слияние -> обогащение ---
+
+    def _normalize(self, rows: List[dict]) -> Tuple[List[tuple], List[str]]:
+        usernames = {self._username(row) for row in rows if self._username(row)}
+        self._resolve_users(usernames)
+        self._resolve_cipher_names({row['cipher'] for row in rows if not row.get('cipher_id') and row.get('cipher')})
+
+        records, errors = [], []
+        for row in rows:
+            try:
+                user_id = self._user_ids.get(self._username(row))
+                cipher_id = int(row['cipher_id']) if row.get('cipher_id') else self._cipher_ids.get(row.get('cipher'))
+                description = (row.get('reaction_description') or '').strip()
+                if user_id is None or cipher_id is None or not description:
+                    raise ValueError("нет пользователя, шрифта или текста реакции")
+                values = {name: row.get(name) or default for name, default in VARIATION_DEFAULTS.items()}
+                records.append((
+                    user_id, cipher_id, description,
+                    int(values['font_weight']), str(values['font_style']), int(values['letter_spacing']),
+                    int(values['font_size']), round(float(values['line_height']), 1),
+                ))
+            except (KeyError, TypeError, ValueError) as e:
+                errors.append(f"{row}: {e}")
+        return records, errors
+
+    def _ensure_staging(self, cursor) -> None:
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ("
+            "user_id integer, cipher_id integer, reaction_description text, font_weight integer, "
+            "font_style varchar(10), letter_spacing integer, font_size integer, line_height numeric(3, 1)"
+            ") ON COMMIT DELETE ROWS"
+        )
+
+    def _copy_and_merge(self, records: List[tuple]) -> List[Tuple[int, str]]:
+        from .models import Association, Cipher
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(records)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            self._ensure_staging(cursor)
+            cursor.copy_expert(f"COPY {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            # Строки с неизвестным шрифтом отсекаются JOIN, дубликаты — уникальным ограничением вариации
+            cursor.execute(
+                f"INSERT INTO {Association._meta.db_table} ({', '.join(STAGING_COLUMNS)}, created_at) "
+                f"SELECT s.{', s.'.join(STAGING_COLUMNS)}, now() FROM {STAGING_TABLE} s "
+                f"JOIN {Cipher._meta.db_table} c ON c.id = s.cipher_id "
+                "ON CONFLICT ON CONSTRAINT unique_user_font_variation_reaction DO NOTHING "
+                "RETURNING id, reaction_description"
+            )
+            return cursor.fetchall()
+
+    def _enrich(self, inserted: List[Tuple[int, str]]) -> int:
+        from .embeddings import association_content_hash, bulk_save_association_embeddings, embed_texts, get_active_embedding_model
+        from .models import Association
+
+        texts = [description for _, description in inserted]
+        if self._pool is not None:
+            analyses = self._pool.map(analyze_reaction, texts, chunksize=max(1, len(texts) // (self.workers * 4)))
+        else:
+            analyses = [analyze_reaction(text) for text in texts]
+        with connection.cursor() as cursor:
+            execute_values(
+                cursor,
+                f"UPDATE {Association._meta.db_table} AS a SET reaction_lemmas = v.lemmas, grouping_key_lemmas = v.grouping_key "
+                "FROM (VALUES %s) AS v (id, lemmas, grouping_key) WHERE a.id = v.id",
+                [(assoc_id, lemmas, key) for (assoc_id, _), (lemmas, key) in zip(inserted, analyses)],
+                page_size=1000,
+            )
+        # Эмбеддинг строится по строке лемм, как в StudyView и reembed_associations
+        pairs = [
+            (assoc_id, lemmas, association_content_hash(description, lemmas))
+            for (assoc_id, description), (lemmas, _) in zip(inserted, analyses) if lemmas.strip()
+        ]
+        if not pairs:
+            return len(inserted)
+        self._embedding_model = self._embedding_model or get_active_embedding_model()
+        vectors = embed_texts([lemmas for _, lemmas, _ in pairs], batch_size=self.embed_batch_size)
+        if vectors is not None:
+            bulk_save_association_embeddings(
+                ((assoc_id, vector, content_hash) for (assoc_id, _, content_hash), vector in zip(pairs, vectors)),
+                model=self._embedding_model,
+            )
+        return len(inserted)
+
+    def _commit_chunk(self, rows: List[dict], offset: int, progress: ImportProgress) -> None:
+        records, errors = self._normalize(rows)
+        with transaction.atomic():
+            inserted = self._copy_and_merge(records) if records else []
+            enriched = self._enrich(inserted) if self.enrich and inserted else 0
+        progress.offset = offset
+        progress.rows += len(rows)
+        progress.imported += len(inserted)
+        progress.skipped += len(rows) - len(inserted)
+        progress.enriched += enriched
+        progress.errors = (progress.errors + errors)[-100:]
+        progress.save()
+
+    def import_associations(self, path, resume: bool = True) -> ImportProgress:
+        progress = ImportProgress.load_or_start(path, resume=resume)
+        if progress.finished:
+            self.log(f"Файл {path} уже импортирован ({progress.imported} ассоциаций).")
+            return progress
+        if progress.offset:
+            self.log(f"Продолжение импорта с байта {progress.offset} (строк обработано: {progress.rows}).")
+
+        header = read_header(path)
+        if self.enrich and self.workers > 0:
+            # Дочерние процессы не должны унаследовать открытое соединение с БД
+            connection.close()
+            self._pool = multiprocessing.get_context('fork').Pool(self.workers, initializer=_init_nlp_worker)
+        started, rows_before = time.monotonic(), progress.rows
+        try:
+            batch, offset = [], progress.offset
+            for row, offset in iter_csv_rows(path, header, progress.offset):
+                batch.append(row)
+                if len(batch) >= self.chunk_size:
+                    self._commit_chunk(batch, offset, progress)
+                    batch = []
+                    rate = (progress.rows - rows_before) / max(time.monotonic() - started, 1e-9)
+                    self.log(f"Обработано строк: {progress.rows}, добавлено: {progress.imported} ({rate:.0f} строк/с)")
+            if batch:
+                self._commit_chunk(batch, offset, progress)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+        progress.finished = True
+        progress.save()
+        return progress
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+from django.conf import settings
+from django.db.models import Count
+
+from .nlp_models import preload_models, readiness as models_readiness, warm_up
+
+logger = logging.getLogger('mainapp')
+
+# Сколько самых частых текстов реакций прогонять через кэш анализа поисковых запросов
+DEFAULT_QUERY_LIMIT = 200
+
+
+def _step_models(options: dict) -> str:
+    preload_models()
+    state = warm_up()
+    if state['error']:
+        raise RuntimeError(state['error'])
+    models = models_readiness()['models']
+    return "загружены: " + (", ".join(name for name, status in models.items() if status['loaded']) or "нет")
+
+
+def _step_ciphers(options: dict) -> str:
+    from .cipher_catalogue import get_cipher_catalogue
+    return f"{len(get_cipher_catalogue())} шрифтов"
+
+
+def _step_semantic_index(options: dict) -> str:
+    from .embeddings import export_embedding_matrix
+    from .vector_index import get_semantic_index
+
+    if options.get('export_index'):
+        # Выгрузка .npy: следующие воркеры открывают матрицу через mmap вместо чтения из БД
+        meta = export_embedding_matrix()
+        logger.info(f"Эмбеддинги выгружены: {meta['count']} векторов модели '{meta['model']}'.")
+    return f"{len(get_semantic_index())} векторов"
+
+
+def _step_graph(options: dict) -> str:
+    from .graph_builder import cached_live_graph_data
+    from .views import get_nlp_params_from_request
+
+    # Параметры, с которыми graph/ запрашивают без query-параметров
+    return f"{len(cached_live_graph_data(get_nlp_params_from_request({})))} пар шрифт — реакция"
+
+
+def frequent_reaction_texts(limit: int) -> List[str]:
+    from .models import Association
+
+    return list(
+        Association.objects.filter(reaction_description__isnull=False)
+        .exclude(reaction_description__exact='')
+        .values('reaction_description').annotate(n=Count('id')).order_by('-n')
+        .values_list('reaction_description', flat=True)[:limit]
+    )
+
+
+def _step_query_cache(options: dict) -> str:
+    from .nlp_models import get_sentence_transformer
+    from .query_cache import cached_search_analysis, query_embedding_cache, search_nlp_params
+
+    if get_sentence_transformer() is None:
+        return "SentenceTransformer не загружен, пропущено"
+    texts = frequent_reaction_texts(options.get('query_limit', DEFAULT_QUERY_LIMIT))
+    params = search_nlp_params()
+    for text in texts:
+        cached_search_analysis(text.strip(), params)
+    return f"{len(texts)} запросов, в кэше {query_embedding_cache.stats()['size']}"
+
+
+# (имя, описание, функция) в порядке выполнения: модели нужны всем остальным шагам
+WARMUP_STEPS = (
+    ('models', "Загрузка и прогрев моделей NLP", _step_models),
+    ('ciphers', "Справочник шрифтов", _step_ciphers),
+    ('semantic_index', "Индекс семантического поиска", _step_semantic_index),
+    ('graph', "Граф на лету для параметров по умолчанию", _step_graph),
+    ('query_cache', "Кэш анализа частых поисковых запросов", _step_query_cache),
+)
+STEP_NAMES = tuple(name for name, _, _ in WARMUP_STEPS)
+
+
+def warm_caches(steps: Optional[Iterable[str]] = None, options: Optional[dict] = None,
+                report: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Выполняет шаги прогрева по порядку (steps — подмножество STEP_NAMES, по умолчанию все).
+    Ошибка шага записывается в его результат и не останавливает следующие.
+    report вызывается после каждого шага с {'step', 'title', 'seconds', 'detail', 'error'}.
+    """
+    selected = set(STEP_NAMES if steps is None else steps)
+    unknown = selected - set(STEP_NAMES)
+    if unknown:
+        raise ValueError(f"Неизвестные шаги прогрева: {', '.join(sorted(unknown))}.")
+    options = options or {}
+
+    results = []
+    for name, title, step in WARMUP_STEPS:
+        if name not in selected:
+            continue
+        started = time.monotonic()
+        result = {'step': name, 'title': title, 'detail': None, 'error': None}
+        try:
+            result['detail'] = step(options)
+        except Exception as e:
+            result['error'] = str(e)
+            logger.error(f"Прогрев: шаг '{name}' завершился ошибкой: {e}", exc_info=True)
+        result['seconds'] = round(time.monotonic() - started, 3)
+        if result['error'] is None:
+            logger.info(f"Прогрев: {title} — {result['detail']} за {result['seconds']} с.")
+        results.append(result)
+        if report is not None:
+            report(result)
+    return results
+
+
+# --- Прогрев воркера и готовность к приёму трафика ---
+
+_state = {'finished_at': None, 'steps': []}
+_state_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def _worker_steps() -> tuple:
+    return STEP_NAMES if getattr(settings, 'WARM_CACHES_ON_START', True) else ('models',)
+
+
+def _warm_worker(steps: tuple) -> None:
+    results = warm_caches(steps, options={'query_limit': getattr(settings, 'WARM_CACHES_QUERY_LIMIT', DEFAULT_QUERY_LIMIT)})
+    with _state_lock:
+        rerun = {result['step'] for result in results}
+        merged = [result for result in _state['steps'] if result['step'] not in rerun] + results
+        _state['steps'] = sorted(merged, key=lambda result: STEP_NAMES.index(result['step']))
+        _state['finished_at'] = time.time()
+
+
+def ensure_warm_up_started() -> None:
+    """
+    Запускает прогрев воркера в фоновом потоке, если он ещё не завершён и не идёт.
+    Поток, а не вызов в post_worker_init: долгий прогрев не должен упираться в таймаут
+    gunicorn, а трафик до его окончания не приходит — readiness отвечает 503.
+    После прогрева повторяется только загрузка моделей, если она не удалась: без них воркер
+    не готов. Шаги кэшей с ошибкой не повторяются — кэши заполнятся первыми запросами.
+    """
+    global _thread
+    with _state_lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        if _state['finished_at'] is None:
+            steps = _worker_steps()
+        elif not models_readiness()['warm']:
+            steps = ('models',)
+        else:
+            return
+        _thread = threading.Thread(target=_warm_worker, args=(steps,), name='warm-caches', daemon=True)
+        _thread.start()
+
+
+def readiness() -> dict:
+    """
+    Готовность моделей NLP (nlp_models.readiness) и завершённый прогрев кэшей воркера.
+    Шаг кэшей, завершившийся ошибкой (нет данных графа, нет RuWordNet), не делает воркер
+    неготовым: он попадает в caches.failed_steps, а caches.warm остаётся false.
+    """
+    state = models_readiness()
+    with _state_lock:
+        finished = _state['finished_at'] is not None
+        steps = list(_state['steps'])
+    failed = [result['step'] for result in steps if result['error'] is not None]
+    state['caches'] = {'warm': finished and not failed, 'finished': finished, 'failed_steps': failed, 'steps': steps}
+    state['warm'] = state['warm'] and finished
+    state['ready'] = state['ready'] and finished
+    return state
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('mainapp')
+
+CATALOGUE_VERSION_KEY = 'cipher_catalogue_version'
+# Не чаще, чем раз в столько секунд, перечитывать справочник из-за промаха по id/имени
+MISS_RELOAD_INTERVAL = 1.0
+
+
+class CipherCatalogue:
+    """
+    Снимок таблицы Cipher: id <-> название и сами экземпляры (только для чтения —
+    они общие для всех запросов процесса).
+    """
+
+    def __init__(self, ciphers: Iterable, version: Optional[str]):
+        self.ciphers: List = list(ciphers)
+        self.by_id: Dict[int, object] = {c.id: c for c in self.ciphers}
+        self.id_by_name: Dict[str, int] = {c.result: c.id for c in self.ciphers}
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ciphers)
+
+    def __contains__(self, cipher_id) -> bool:
+        return cipher_id in self.by_id
+
+    def name_of(self, cipher_id) -> Optional[str]:
+        cipher = self.by_id.get(cipher_id)
+        return cipher.result if cipher is not None else None
+
+    def names(self) -> Dict[int, str]:
+        return {cipher_id: cipher.result for cipher_id, cipher in self.by_id.items()}
+
+
+_catalogue: Optional[CipherCatalogue] = None
+_catalogue_lock = threading.Lock()
+_last_miss_reload = 0.0
+
+
+def _shared_version() -> Optional[str]:
+    return cache.get(CATALOGUE_VERSION_KEY)
+
+
+def _load(version: Optional[str]) -> CipherCatalogue:
+    from .models import Cipher
+
+    catalogue = CipherCatalogue(Cipher.objects.all(), version)
+    logger.info(f"Справочник шрифтов загружен: {len(catalogue)} записей (версия {version}).")
+    return catalogue
+
+
+def get_cipher_catalogue() -> CipherCatalogue:
+    """
+    Справочник шрифтов процесса. Актуальность сверяется с версией в кэше Django,
+    которую сигналы Cipher меняют при любой записи — так изменения в одном воркере
+    видят остальные (при общем бэкенде кэша). Записи в обход сигналов (queryset.update,
+    сырой SQL) подхватываются не позже settings.CIPHER_CATALOGUE_MAX_AGE секунд.
+    """
+    global _catalogue
+    max_age = getattr(settings, 'CIPHER_CATALOGUE_MAX_AGE', 300)
+    version = _shared_version()
+
+    def fresh(catalogue):
+        return (catalogue is not None and catalogue.version == version
+                and time.monotonic() - catalogue.loaded_at < max_age)
+
+    catalogue = _catalogue
+    if fresh(catalogue):
+        return catalogue
+    with _catalogue_lock:
+        if not fresh(_catalogue):
+            _catalogue = _load(version)
+        return _catalogue
+
+
+def resolve_cipher(cipher_id=None, name: Optional[str] = None):
+    """
+    Экземпляр Cipher по id или названию; None, если такого нет. При промахе справочник
+    один раз перечитывается (шрифт мог появиться в обход сигналов), но не чаще MISS_RELOAD_INTERVAL.
+    """
+    global _catalogue, _last_miss_reload
+
+    def lookup(catalogue):
+        if cipher_id is not None:
+            return catalogue.by_id.get(cipher_id)
+        found = catalogue.id_by_name.get(name)
+        return catalogue.by_id.get(found) if found is not None else None
+
+    cipher = lookup(get_cipher_catalogue())
+    if cipher is None and time.monotonic() - _last_miss_reload >= MISS_RELOAD_INTERVAL:
+        with _catalogue_lock:
+            _last_miss_reload = time.monotonic()
+            _catalogue = _load(_shared_version())
+            cipher = lookup(_catalogue)
+    return cipher
+
+
+def attach_ciphers(associations: Iterable) -> list:
+    """
+    Подставляет шрифты из справочника в уже загруженные ассоциации вместо JOIN/запроса на строку.
+    """
+    associations = list(associations)
+    catalogue = get_cipher_catalogue()
+    field = associations[0]._meta.get_field('cipher') if associations else None
+    for assoc in associations:
+        cipher = catalogue.by_id.get(assoc.cipher_id) or resolve_cipher(assoc.cipher_id)
+        if cipher is not None:
+            field.set_cached_value(assoc, cipher)
+    return associations
+
+
+def iter_with_ciphers(associations: Iterable, chunk_size: int = 500) -> Iterator:
+    """attach_ciphers для потоковых выборок (queryset.iterator()): шрифты подставляются пачками."""
+    batch = []
+    for assoc in associations:
+        batch.append(assoc)
+        if len(batch) >= chunk_size:
+            yield from attach_ciphers(batch)
+            batch = []
+    if batch:
+        yield from attach_ciphers(batch)
+
+
+def invalidate_cipher_catalogue() -> None:
+    """Новая версия справочника для всех воркеров и сброс локальной копии."""
+    global _catalogue
+    cache.set(CATALOGUE_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    with _catalogue_lock:
+        _catalogue = None
@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import FilteredRelation, Max, Q
+
+from .embeddings import decode_embedding, get_active_embedding_model
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet необязателен: без pyarrow выгрузка идёт в .npz
+    pa = pq = None
+
+logger = logging.getLogger('mainapp')
+
+EXPORT_FORMATS = ('parquet', 'npz')
+# Значение age, если возраст не указан (числовая колонка без null)
+MISSING_AGE = -1
+
+_ROW_FIELDS = (
+    'id', 'created_at', 'user_id', 'cipher_id', 'font_weight', 'font_style', 'letter_spacing',
+    'font_size', 'line_height', 'reaction_description', 'reaction_lemmas', 'grouping_key_lemmas',
+    'user__profile__gender', 'user__profile__age', 'user__profile__education_level',
+    'user__profile__specialty', 'active_embedding__vector',
+)
+STRING_COLUMNS = (
+    'cipher_name', 'font_style', 'reaction_description', 'reaction_lemmas', 'grouping_key_lemmas',
+    'gender', 'education_level', 'specialty',
+)
+
+
+def default_format() -> str:
+    return 'parquet' if pa is not None else 'npz'
+
+
+def _settle_window() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'DATASET_EXPORT_SETTLE_SECONDS', 3600))
+
+
+def _export_queryset(since: Optional[dict], until: datetime):
+    """
+    Ассоциации с created_at <= until; для догрузки — созданные позже since['created_at'] минус окно
+    DATASET_EXPORT_SETTLE_SECONDS, кроме уже выгруженных из этого окна (since['exported_ids']).
+    Окно перекрытия подхватывает строки, закоммиченные позже соседей с большим created_at/id.
+    """
+    from .models import Association
+
+    qs = Association.objects.filter(created_at__lte=until)
+    if since and since.get('created_at'):
+        qs = qs.filter(created_at__gt=datetime.fromisoformat(since['created_at']) - _settle_window())
+        qs = qs.exclude(id__in=since.get('exported_ids', []))
+    return qs
+
+
+def _export_rows(model, qs, chunk_size: int):
+    return qs.order_by('created_at', 'id').annotate(
+        active_embedding=FilteredRelation('embeddings', condition=Q(embeddings__model=model))
+    ).values_list(*_ROW_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def _chunk_columns(rows: list, cipher_names: dict, dim: int) -> dict:
+    """Пачка строк выборки -> {колонка: ndarray или список строк}; эмбеддинги — матрица len x dim."""
+    embedding = np.full((len(rows), dim), np.nan, dtype=np.float32)
+    has_embedding = np.zeros(len(rows), dtype=bool)
+    for pos, row in enumerate(rows):
+        if row[16]:
+            embedding[pos] = decode_embedding(row[16], dim=dim)
+            has_embedding[pos] = True
+    created_at = [row[1].astimezone(dt_timezone.utc).replace(tzinfo=None) for row in rows]
+    return {
+        'id': np.array([row[0] for row in rows], dtype=np.int64),
+        'created_at': np.array(created_at, dtype='datetime64[us]'),
+        'user_id': np.array([row[2] for row in rows], dtype=np.int64),
+        'cipher_id': np.array([row[3] for row in rows], dtype=np.int64),
+        'cipher_name': [cipher_names.get(row[3]) for row in rows],
+        'font_weight': np.array([row[4] for row in rows], dtype=np.int16),
+        'font_style': [row[5] for row in rows],
+        'letter_spacing': np.array([row[6] for row in rows], dtype=np.int16),
+        'font_size': np.array([row[7] for row in rows], dtype=np.int16),
+        'line_height': np.array([float(row[8]) for row in rows], dtype=np.float32),
+        'reaction_description': [row[9] for row in rows],
+        'reaction_lemmas': [row[10] for row in rows],
+        'grouping_key_lemmas': [row[11] for row in rows],
+        'gender': [row[12] for row in rows],
+        'age': np.array([MISSING_AGE if row[13] is None else row[13] for row in rows], dtype=np.int16),
+        'education_level': [row[14] for row in rows],
+        'specialty': [row[15] for row in rows],
+        'has_embedding': has_embedding,
+        'embedding': embedding,
+    }
+
+
+class _ParquetSink:
+    """Каждая пачка — отдельная row group; эмбеддинг — FixedSizeList<float32>[dim]."""
+
+    def __init__(self, path: Path, dim: int, metadata: dict):
+        self.path, self.dim = path, dim
+        self.metadata = metadata
+        self.writer = None
+
+    def _column(self, name: str, values):
+        if name == 'embedding':
+            return pa.FixedSizeListArray.from_arrays(pa.array(values.ravel(), type=pa.float32()), self.dim)
+        if name == 'created_at':
+            return pa.array(values, type=pa.timestamp('us', tz='UTC'))
+        if name in STRING_COLUMNS:
+            # Явный тип: пачка из одних None иначе получила бы тип null
+            return pa.array(values, type=pa.string())
+        return pa.array(values, type=pa.from_numpy_dtype(values.dtype))
+
+    def write(self, columns: dict) -> None:
+        table = pa.Table.from_arrays([self._column(name, values) for name, values in columns.items()], names=list(columns))
+        if self.writer is None:
+            schema = table.schema.with_metadata({'export': json.dumps(self.metadata, ensure_ascii=False)})
+            self.writer = pq.ParquetWriter(self.path, schema, compression='zstd')
+        self.writer.write_table(table.replace_schema_metadata(self.writer.schema.metadata))
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class _NpzSink:
+    """
+    .npz из колонок: эмбеддинги пишутся пачками в memmap-файл, строки и мелкие колонки
+    копятся в памяти. Строки хранятся как unicode-массивы (np.load без allow_pickle).
+    """
+
+    def __init__(self, path: Path, dim: int, capacity: int, metadata: dict):
+        self.path, self.dim = path, dim
+        self.metadata = metadata
+        self.rows = 0
+        self.columns = {}
+        self.tmp_dir = tempfile.TemporaryDirectory(dir=path.parent)
+        self.embedding = np.lib.format.open_memmap(
+            Path(self.tmp_dir.name) / 'embedding.npy', mode='w+', dtype=np.float32, shape=(max(capacity, 1), dim)
+        )
+
+    def write(self, columns: dict) -> None:
+        size = len(columns['id'])
+        if self.rows + size > len(self.embedding):
+            self._grow(self.rows + size)
+        self.embedding[self.rows:self.rows + size] = columns['embedding']
+        self.rows += size
+        for name, values in columns.items():
+            if name != 'embedding':
+                self.columns.setdefault(name, []).append(values)
+
+    def _grow(self, needed: int) -> None:
+        # Строки, закоммиченные между count() и чтением, не помещаются в исходный размер
+        path = Path(self.tmp_dir.name) / f'embedding-{needed}.npy'
+        grown = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(max(needed, 2 * len(self.embedding)), self.dim))
+        grown[:self.rows] = self.embedding[:self.rows]
+        self.embedding = grown
+
+    def close(self) -> None:
+        with zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, parts in self.columns.items():
+                if name in STRING_COLUMNS:
+                    array = np.array(['' if value is None else value for part in parts for value in part], dtype=np.str_)
+                else:
+                    array = np.concatenate(parts)
+                with archive.open(f'{name}.npy', 'w', force_zip64=True) as fp:
+                    np.lib.format.write_array(fp, array, allow_pickle=False)
+            with archive.open('embedding.npy', 'w', force_zip64=True) as fp:
+                np.lib.format.write_array(fp, self.embedding[:self.rows], allow_pickle=False)
+            archive.writestr('meta.json', json.dumps(self.metadata, ensure_ascii=False))
+        del self.embedding
+        self.tmp_dir.cleanup()
+
+
+def export_dataset(path, fmt: Optional[str] = None, since: Optional[dict] = None, chunk_size: int = 5000,
+                   model=None) -> dict:
+    """
+    Колоночная выгрузка ассоциаций: шрифт, параметры вариации, леммы, ключи группировки, демография
+    профиля и эмбеддинг активной модели (float32 x dim, NaN и has_embedding=false, если его нет).
+    since — водяной знак прошлой выгрузки (last_watermark) или None для полной выгрузки.
+    Строки читаются серверным курсором пачками по chunk_size. Файл пишется во временный и атомарно
+    подменяется; рядом кладётся <path>.json с водяным знаком для следующей догрузки: max created_at
+    и id строк, выгруженных в пределах окна перекрытия.
+    """
+    from .cipher_catalogue import get_cipher_catalogue
+    from .models import Association
+
+    fmt = fmt or default_format()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки '{fmt}'.")
+    if fmt == 'parquet' and pa is None:
+        raise ValueError("Для формата parquet нужен пакет pyarrow.")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    model = model or get_active_embedding_model()
+    started = time.monotonic()
+    # Снимок верхней границы: строки, добавленные во время выгрузки, попадут в следующую
+    until = Association.objects.aggregate(max_created_at=Max('created_at'))['max_created_at']
+    previous_until = datetime.fromisoformat(since['created_at']) if since and since.get('created_at') else None
+    if until is None or (previous_until is not None and until < previous_until):
+        until = previous_until or datetime.now(dt_timezone.utc)
+    qs = _export_queryset(since, until)
+    metadata = {
+        'format': fmt, 'since': since['created_at'] if since else None, 'embedding_model': model.name,
+        'dimension': model.dimension, 'missing_age': MISSING_AGE,
+    }
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    if fmt == 'parquet':
+        sink = _ParquetSink(tmp_path, model.dimension, metadata)
+    else:
+        sink = _NpzSink(tmp_path, model.dimension, qs.count(), metadata)
+
+    cipher_names = get_cipher_catalogue().names()
+    window_start = until - _settle_window()
+    count, max_association_id, batch, recent_ids = 0, 0, [], []
+    try:
+        for row in _export_rows(model, qs, chunk_size):
+            if row[1] > window_start:
+                recent_ids.append(row[0])
+            max_association_id = max(max_association_id, row[0])
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                sink.write(_chunk_columns(batch, cipher_names, model.dimension))
+                count, batch = count + len(batch), []
+        if batch or not count:
+            # Пустая выгрузка всё равно получает полный набор колонок
+            sink.write(_chunk_columns(batch, cipher_names, model.dimension))
+            count += len(batch)
+        if since and since.get('exported_ids'):
+            # Выгруженные раньше строки, ещё попадающие в окно перекрытия, тоже не должны повториться
+            recent_ids += list(Association.objects.filter(
+                id__in=since['exported_ids'], created_at__gt=window_start
+            ).values_list('id', flat=True))
+        metadata.update({
+            'count': count, 'max_association_id': max_association_id, 'created_at': until.isoformat(),
+            'exported_ids': sorted(recent_ids), 'exported_at': time.time(),
+        })
+        sink.close()
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+
+    Path(str(path) + '.json').write_text(json.dumps(metadata, ensure_ascii=False, indent=2), encoding='utf-8')
+    logger.info(
+        f"Выгрузка датасета ({fmt}): {count} ассоциаций, созданных после {metadata['since'] or 'начала'} -> {path} "
+        f"за {time.monotonic() - started:.2f} с."
+    )
+    return metadata
+
+
+def last_watermark(path) -> Optional[dict]:
+    """Водяной знак предыдущей выгрузки в path: {'created_at', 'exported_ids'} или None, если её нет."""
+    meta_path = Path(str(path) + '.json')
+    if not meta_path.exists():
+        return None
+    meta = json.loads(meta_path.read_text(encoding='utf-8'))
+    if not meta.get('created_at'):
+        return None
+    return {'created_at': meta['created_at'], 'exported_ids': meta.get('exported_ids', [])}
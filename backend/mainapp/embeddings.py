@@ -0,0 +1,300 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, TextField, Value
+from django.db.models.functions import MD5, Coalesce, Concat
+
+from .metrics import metrics, stage_timer
+
+logger = logging.getLogger('mainapp')
+
+EMBEDDING_DIM = 384
+
+_STORAGE_DTYPES = {
+    'float32': np.dtype('<f4'),
+    'float16': np.dtype('<f2'),
+}
+_DTYPES_BY_ITEMSIZE = {dt.itemsize: dt for dt in _STORAGE_DTYPES.values()}
+
+
+def get_storage_dtype() -> np.dtype:
+    """
+    Тип, в котором эмбеддинги пишутся в bytea-колонку (settings.EMBEDDING_STORAGE_DTYPE).
+    """
+    name = getattr(settings, 'EMBEDDING_STORAGE_DTYPE', 'float32')
+    if name not in _STORAGE_DTYPES:
+        logger.warning(f"Неизвестный EMBEDDING_STORAGE_DTYPE '{name}', используется float32.")
+        name = 'float32'
+    return _STORAGE_DTYPES[name]
+
+
+def encode_embedding(vector) -> Optional[bytes]:
+    """
+    Упаковывает вектор (ndarray или список) в little-endian bytes для BinaryField.
+    """
+    if vector is None:
+        return None
+    array = np.asarray(vector, dtype=get_storage_dtype())
+    if array.ndim != 1 or array.size == 0:
+        raise ValueError(f"Ожидался одномерный непустой вектор, получена форма {array.shape}")
+    return array.tobytes()
+
+
+def decode_embedding(buffer, dim: int = EMBEDDING_DIM) -> Optional[np.ndarray]:
+    """
+    Возвращает read-only ndarray поверх буфера без копирования.
+    Тип (float32/float16) определяется по длине буфера и размерности модели.
+    """
+    if buffer is None:
+        return None
+    view = memoryview(buffer)
+    if view.nbytes == 0:
+        return None
+    itemsize, remainder = divmod(view.nbytes, dim)
+    dtype = _DTYPES_BY_ITEMSIZE.get(itemsize)
+    if remainder or dtype is None:
+        raise ValueError(f"Размер буфера {view.nbytes} байт не соответствует размерности {dim}")
+    return np.frombuffer(view, dtype=dtype)
+
+
+def embedding_to_list(buffer, dim: int = EMBEDDING_DIM) -> Optional[list]:
+    """
+    Для JSON-ответов: список float из сохранённого буфера.
+    """
+    vector = decode_embedding(buffer, dim=dim)
+    return vector.astype(np.float32, copy=False).tolist() if vector is not None else None
+
+
+def stack_embeddings(buffers: Iterable, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Собирает буферы в одну непрерывную float32-матрицу (N x dim).
+    Пустые буферы недопустимы — фильтруйте их до вызова.
+    """
+    buffers = list(buffers)
+    matrix = np.empty((len(buffers), dim), dtype=np.float32)
+    for row, buffer in enumerate(buffers):
+        matrix[row] = decode_embedding(buffer, dim=dim)
+    return matrix
+
+
+# --- Хранилище эмбеддингов с версионированием по модели ---
+
+_CONTENT_SEPARATOR = '\x1f'
+
+
+def association_content_hash(reaction_description: Optional[str], reaction_lemmas: Optional[str]) -> str:
+    """
+    MD5 текста реакции и её лемм, по которым строился вектор. Хранится рядом с вектором:
+    расхождение с текущим текстом ассоциации делает вектор устаревшим (stale_associations).
+    """
+    content = f"{reaction_description or ''}{_CONTENT_SEPARATOR}{reaction_lemmas or ''}"
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def association_content_hash_expression():
+    """То же, что association_content_hash, но выражением в БД над полями Association."""
+    return MD5(Concat(
+        Coalesce(F('reaction_description'), Value('')), Value(_CONTENT_SEPARATOR),
+        Coalesce(F('reaction_lemmas'), Value('')), output_field=TextField(),
+    ))
+
+
+def get_active_embedding_model():
+    """
+    Запись реестра для модели из settings.SBERT_MODEL_NAME (создаётся при первом обращении).
+    """
+    from .models import EmbeddingModel
+
+    name = getattr(settings, 'SBERT_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+    model, created = EmbeddingModel.objects.get_or_create(
+        name=name,
+        defaults={'dimension': getattr(settings, 'SBERT_EMBEDDING_DIM', EMBEDDING_DIM)}
+    )
+    if created:
+        logger.info(f"Зарегистрирована новая модель эмбеддингов '{name}' ({model.dimension}d).")
+    return model
+
+
+def save_association_embedding(association_id: int, vector, content_hash: str, model=None):
+    """
+    Записывает (или перезаписывает) вектор ассоциации для модели; None — ничего не делает.
+    content_hash — association_content_hash текста, по которому построен вектор.
+    """
+    from .models import AssociationEmbedding
+
+    if vector is None:
+        return None
+    model = model or get_active_embedding_model()
+    obj, _ = AssociationEmbedding.objects.update_or_create(
+        association_id=association_id, model=model,
+        defaults={'vector': encode_embedding(vector), 'content_hash': content_hash}
+    )
+    return obj
+
+
+def bulk_save_association_embeddings(rows, model=None, batch_size: int = 1000) -> int:
+    """
+    rows — итерируемое (association_id, vector, content_hash). Существующие векторы модели перезаписываются.
+    """
+    from .models import AssociationEmbedding
+
+    model = model or get_active_embedding_model()
+    objs = [
+        AssociationEmbedding(association_id=assoc_id, model=model, vector=encode_embedding(vector), content_hash=content_hash)
+        for assoc_id, vector, content_hash in rows if vector is not None
+    ]
+    if not objs:
+        return 0
+    AssociationEmbedding.objects.bulk_create(
+        objs, batch_size=batch_size,
+        update_conflicts=True, unique_fields=['association', 'model'], update_fields=['vector', 'content_hash', 'updated_at']
+    )
+    return len(objs)
+
+
+def get_embeddings_for(association_ids, model=None) -> dict:
+    """
+    {association_id: ndarray} для указанных ассоциаций и модели (по умолчанию активной).
+    """
+    from .models import AssociationEmbedding
+
+    model = model or get_active_embedding_model()
+    rows = AssociationEmbedding.objects.filter(
+        model=model, association_id__in=list(association_ids)
+    ).values_list('association_id', 'vector')
+    return {assoc_id: decode_embedding(buffer, dim=model.dimension) for assoc_id, buffer in rows}
+
+
+def stale_associations(model=None):
+    """
+    Ассоциации с непустой реакцией, у которых нет вектора модели или вектор построен по
+    другому тексту (реакция или леммы изменились после записи — content_hash не совпадает).
+    """
+    from .models import Association, AssociationEmbedding
+
+    model = model or get_active_embedding_model()
+    fresh_vector = AssociationEmbedding.objects.filter(
+        model=model, association_id=OuterRef('pk'), content_hash=OuterRef('content_hash')
+    )
+    return Association.objects.filter(
+        reaction_description__isnull=False
+    ).exclude(reaction_description__exact='').annotate(
+        content_hash=association_content_hash_expression()
+    ).filter(~Exists(fresh_vector))
+
+
+def embed_texts(texts, batch_size: int = 64) -> Optional[np.ndarray]:
+    """
+    Пакетное кодирование активной моделью SentenceTransformer; None, если модель не загружена.
+    """
+    from .nlp_processor import get_sentence_transformer
+
+    sbert_model = get_sentence_transformer()
+    if sbert_model is None:
+        return None
+    texts = list(texts)
+    if not texts:
+        return np.empty((0, get_active_embedding_model().dimension), dtype=np.float32)
+    metrics.inc('embedding_texts_total', len(texts))
+    with stage_timer('embed_batch'):
+        return sbert_model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+
+# --- Выгрузка в непрерывные .npy для открытия через mmap ---
+
+def _store_paths(model_name: str, directory=None):
+    from django.utils.text import slugify
+
+    directory = Path(directory or getattr(settings, 'EMBEDDING_STORE_DIR'))
+    stem = slugify(model_name) or 'model'
+    return directory, directory / f"{stem}.npy", directory / f"{stem}.ids.npy", directory / f"{stem}.json"
+
+
+def export_embedding_matrix(model=None, directory=None, chunk_size: int = 5000) -> dict:
+    """
+    Пишет все векторы модели в <dir>/<model>.npy (float32, N x dim, порядок по association_id)
+    и <dir>/<model>.ids.npy. Файлы сначала пишутся во временные и затем атомарно подменяются.
+    """
+    from .models import AssociationEmbedding
+
+    model = model or get_active_embedding_model()
+    directory, matrix_path, ids_path, meta_path = _store_paths(model.name, directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    qs = AssociationEmbedding.objects.filter(model=model).order_by('association_id')
+    total = qs.count()
+    if total == 0:
+        # open_memmap не умеет нулевой размер
+        np.save(matrix_path, np.empty((0, model.dimension), dtype=np.float32))
+        np.save(ids_path, np.empty((0,), dtype=np.int64))
+        meta = {'model': model.name, 'dimension': model.dimension, 'count': 0,
+                'max_association_id': 0, 'max_embedding_id': 0, 'max_updated_at': 0.0, 'exported_at': time.time()}
+        meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding='utf-8')
+        return meta
+
+    tmp_matrix_path = _tmp_path(matrix_path)
+    tmp_ids_path = _tmp_path(ids_path)
+    matrix = np.lib.format.open_memmap(tmp_matrix_path, mode='w+', dtype=np.float32, shape=(total, model.dimension))
+    ids = np.lib.format.open_memmap(tmp_ids_path, mode='w+', dtype=np.int64, shape=(total,))
+
+    row, last_id, max_embedding_id, max_updated_at = 0, 0, 0, 0.0
+    rows = qs.values_list('id', 'association_id', 'vector', 'updated_at').iterator(chunk_size=chunk_size)
+    for embedding_id, assoc_id, buffer, updated_at in rows:
+        if row >= total:
+            break  # строки, добавленные после count(), попадут в следующую выгрузку
+        ids[row] = last_id = assoc_id
+        max_embedding_id = max(max_embedding_id, embedding_id)
+        max_updated_at = max(max_updated_at, updated_at.timestamp())
+        matrix[row] = decode_embedding(buffer, dim=model.dimension)
+        row += 1
+    matrix.flush(); ids.flush()
+    del matrix, ids
+
+    for tmp_path, final_path in ((tmp_matrix_path, matrix_path), (tmp_ids_path, ids_path)):
+        if row < total:
+            # Часть строк удалили во время выгрузки — обрезаем до фактически записанных.
+            trimmed_path = _tmp_path(final_path, '.trim')
+            np.save(trimmed_path, np.load(tmp_path, mmap_mode='r')[:row])
+            os.remove(tmp_path)
+            tmp_path = trimmed_path
+        os.replace(tmp_path, final_path)
+
+    meta = {
+        'model': model.name,
+        'dimension': model.dimension,
+        'count': row,
+        'max_association_id': last_id,
+        # Водяной знак для догрузки векторов, появившихся после выгрузки
+        'max_embedding_id': max_embedding_id,
+        'max_updated_at': max_updated_at,
+        'exported_at': time.time(),
+    }
+    meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding='utf-8')
+    logger.info(f"Эмбеддинги модели '{model.name}' выгружены: {row} векторов -> {matrix_path}")
+    return meta
+
+
+def _tmp_path(path: Path, marker: str = '.tmp') -> Path:
+    # np.save дописывает .npy, если имя на него не оканчивается
+    return path.with_name(path.name[:-len('.npy')] + marker + '.npy')
+
+
+def load_embedding_matrix(model_name: Optional[str] = None, directory=None):
+    """
+    Открывает выгрузку через mmap: (ids, matrix, meta) или None, если файлов нет.
+    """
+    model_name = model_name or getattr(settings, 'SBERT_MODEL_NAME', '')
+    _, matrix_path, ids_path, meta_path = _store_paths(model_name, directory)
+    if not (matrix_path.exists() and ids_path.exists()):
+        return None
+    meta = json.loads(meta_path.read_text(encoding='utf-8')) if meta_path.exists() else {}
+    if meta.get('count') == 0:
+        return np.load(ids_path), np.load(matrix_path), meta
+    return np.load(ids_path, mmap_mode='r'), np.load(matrix_path, mmap_mode='r'), meta
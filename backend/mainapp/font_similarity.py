@@ -0,0 +1,402 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .embeddings import decode_embedding, get_active_embedding_model
+
+logger = logging.getLogger('mainapp')
+
+SIMILARITY_KINDS = ('embedding', 'distribution')
+
+# Порядок значений фиксирован, чтобы коды стиля в артефакте не зависели от данных.
+FONT_STYLE_VALUES = ('normal', 'italic', 'oblique')
+_STYLE_CODES = {value: code for code, value in enumerate(FONT_STYLE_VALUES)}
+
+
+def variation_key(cipher_id, font_weight, font_style, letter_spacing, font_size, line_height) -> tuple:
+    """Вариация как кортеж целых: (cipher_id, weight, код стиля, spacing, size, line_height * 10)."""
+    return (
+        int(cipher_id), int(font_weight), _STYLE_CODES.get(font_style, -1),
+        int(letter_spacing), int(font_size), int(round(float(line_height) * 10)),
+    )
+
+
+def decode_variation_key(key) -> dict:
+    """Обратное к variation_key: параметры вариации в том виде, в каком они хранятся в Association."""
+    cipher_id, font_weight, style_code, letter_spacing, font_size, line_height = (int(v) for v in key)
+    return {
+        'cipher_id': cipher_id, 'font_weight': font_weight,
+        'font_style': FONT_STYLE_VALUES[style_code] if 0 <= style_code < len(FONT_STYLE_VALUES) else None,
+        'letter_spacing': letter_spacing, 'font_size': font_size, 'line_height': line_height / 10,
+    }
+
+
+def _group_sums(keys: np.ndarray, vectors: np.ndarray):
+    """
+    Суммы векторов по ключам одной сортировкой: (уникальные ключи, суммы, количества).
+    keys — (N,) или (N, m).
+    """
+    unique_keys, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sums = np.add.reduceat(vectors[order].astype(np.float64, copy=False), starts, axis=0)
+    return unique_keys, sums, counts
+
+
+def _cosine_matrix(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    normalized = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    return normalized @ normalized.T
+
+
+class FontProfiles:
+    """
+    Агрегаты по шрифтам и вариациям: суммы эмбеддингов и их количества (центроид = сумма / n)
+    и распределение реакций шрифта по ключам лемм. Хранятся суммы, а не средние,
+    поэтому новые ассоциации просто прибавляются без пересчёта всего набора.
+    Удаления и перезапись векторов учитываются только полным пересчётом: state() сверяется
+    с data_state() хранилища, и при расхождении после догрузки профили строятся заново.
+    """
+
+    def __init__(self, model_name: str, dimension: int,
+                 cipher_ids=None, cipher_sums=None, cipher_counts=None,
+                 variation_keys=None, variation_sums=None, variation_counts=None,
+                 lemma_vocab=None, cipher_lemma_counts=None,
+                 max_embedding_id: int = 0, max_association_id: int = 0,
+                 max_updated_at: float = 0.0, association_count: int = 0):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.cipher_ids = np.asarray(cipher_ids if cipher_ids is not None else [], dtype=np.int64)
+        self.cipher_sums = cipher_sums if cipher_sums is not None else np.zeros((0, dimension))
+        self.cipher_counts = np.asarray(cipher_counts if cipher_counts is not None else [], dtype=np.int64)
+        self.variation_keys = variation_keys if variation_keys is not None else np.zeros((0, 6), dtype=np.int64)
+        self.variation_sums = variation_sums if variation_sums is not None else np.zeros((0, dimension))
+        self.variation_counts = np.asarray(variation_counts if variation_counts is not None else [], dtype=np.int64)
+        self.lemma_vocab: List[str] = list(lemma_vocab) if lemma_vocab is not None else []
+        # Строки — шрифты в порядке cipher_ids; строк может быть меньше, если у шрифта нет реакций
+        self.cipher_lemma_counts = cipher_lemma_counts if cipher_lemma_counts is not None else np.zeros((0, 0), dtype=np.int64)
+        self.max_embedding_id = int(max_embedding_id)
+        self.max_association_id = int(max_association_id)
+        # max(updated_at) учтённых векторов и число просмотренных ассоциаций — для сверки с БД
+        self.max_updated_at = float(max_updated_at)
+        self.association_count = int(association_count)
+        self._similarity: Dict[str, np.ndarray] = {}
+
+    def copy(self) -> 'FontProfiles':
+        return FontProfiles(
+            self.model_name, self.dimension,
+            self.cipher_ids.copy(), self.cipher_sums.copy(), self.cipher_counts.copy(),
+            self.variation_keys.copy(), self.variation_sums.copy(), self.variation_counts.copy(),
+            list(self.lemma_vocab), self.cipher_lemma_counts.copy(),
+            self.max_embedding_id, self.max_association_id, self.max_updated_at, self.association_count,
+        )
+
+    def state(self) -> tuple:
+        """То же, что data_state() для данных, из которых собраны профили."""
+        return (
+            int(self.cipher_counts.sum()), self.max_embedding_id, self.max_updated_at,
+            self.association_count, self.max_association_id,
+        )
+
+    # --- Инкрементальное накопление ---
+
+    def _cipher_rows(self, cipher_ids: np.ndarray) -> np.ndarray:
+        """Номера строк для шрифтов; неизвестные шрифты добавляются в конец."""
+        row_of = {int(c): row for row, c in enumerate(self.cipher_ids)}
+        fresh = [int(c) for c in np.unique(cipher_ids) if int(c) not in row_of]
+        if fresh:
+            for cipher_id in fresh:
+                row_of[cipher_id] = len(row_of)
+            self.cipher_ids = np.concatenate([self.cipher_ids, np.asarray(fresh, dtype=np.int64)])
+            self.cipher_sums = np.vstack([self.cipher_sums, np.zeros((len(fresh), self.dimension))])
+            self.cipher_counts = np.concatenate([self.cipher_counts, np.zeros(len(fresh), dtype=np.int64)])
+        return np.fromiter((row_of[int(c)] for c in cipher_ids), dtype=np.int64, count=len(cipher_ids))
+
+    def add_embeddings(self, cipher_ids: np.ndarray, variation_keys: np.ndarray, vectors: np.ndarray) -> None:
+        if not len(vectors):
+            return
+        unique_ciphers, sums, counts = _group_sums(cipher_ids, vectors)
+        rows = self._cipher_rows(unique_ciphers)
+        self.cipher_sums[rows] += sums
+        self.cipher_counts[rows] += counts
+
+        unique_variations, sums, counts = _group_sums(variation_keys, vectors)
+        row_of = {tuple(key): row for row, key in enumerate(self.variation_keys.tolist())}
+        fresh = [tuple(key) for key in unique_variations.tolist() if tuple(key) not in row_of]
+        if fresh:
+            for key in fresh:
+                row_of[key] = len(row_of)
+            self.variation_keys = np.vstack([self.variation_keys, np.asarray(fresh, dtype=np.int64)])
+            self.variation_sums = np.vstack([self.variation_sums, np.zeros((len(fresh), self.dimension))])
+            self.variation_counts = np.concatenate([self.variation_counts, np.zeros(len(fresh), dtype=np.int64)])
+        rows = np.fromiter((row_of[tuple(key)] for key in unique_variations.tolist()), dtype=np.int64, count=len(unique_variations))
+        self.variation_sums[rows] += sums
+        self.variation_counts[rows] += counts
+        self._similarity.clear()
+
+    def add_reactions(self, cipher_ids: np.ndarray, lemma_keys: List[str]) -> None:
+        if not len(cipher_ids):
+            return
+        column_of = {lemma: col for col, lemma in enumerate(self.lemma_vocab)}
+        for lemma in lemma_keys:
+            if lemma not in column_of:
+                column_of[lemma] = len(self.lemma_vocab)
+                self.lemma_vocab.append(lemma)
+        rows = self._cipher_rows(np.asarray(cipher_ids, dtype=np.int64))
+        columns = np.fromiter((column_of[lemma] for lemma in lemma_keys), dtype=np.int64, count=len(lemma_keys))
+
+        pad_rows = len(self.cipher_ids) - self.cipher_lemma_counts.shape[0]
+        pad_cols = len(self.lemma_vocab) - self.cipher_lemma_counts.shape[1]
+        if pad_rows or pad_cols:
+            self.cipher_lemma_counts = np.pad(self.cipher_lemma_counts, ((0, pad_rows), (0, pad_cols)))
+        np.add.at(self.cipher_lemma_counts, (rows, columns), 1)
+        self._similarity.clear()
+
+    # --- Похожесть ---
+
+    def cipher_centroids(self) -> np.ndarray:
+        counts = np.maximum(self.cipher_counts, 1)[:, None]
+        return self.cipher_sums / counts
+
+    def similarity_matrix(self, kind: str = 'embedding') -> np.ndarray:
+        """
+        embedding — косинус центроидов эмбеддингов шрифтов;
+        distribution — коэффициент Бхаттачарьи распределений реакций (sqrt(p) @ sqrt(q)).
+        """
+        if kind not in self._similarity:
+            if kind == 'embedding':
+                matrix = _cosine_matrix(self.cipher_centroids())
+            elif kind == 'distribution':
+                counts = self.cipher_lemma_counts.astype(np.float64)
+                counts = np.pad(counts, ((0, len(self.cipher_ids) - counts.shape[0]), (0, 0)))
+                totals = counts.sum(axis=1, keepdims=True)
+                roots = np.sqrt(np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0))
+                matrix = roots @ roots.T
+            else:
+                raise ValueError(f"Неизвестный вид похожести '{kind}'. Допустимо: {', '.join(SIMILARITY_KINDS)}.")
+            self._similarity[kind] = matrix
+        return self._similarity[kind]
+
+    def top_k_ciphers(self, cipher_id: int, k: int = 5, kind: str = 'embedding') -> Optional[list]:
+        """[(cipher_id, similarity), ...] без самого шрифта; None, если шрифта нет в профилях."""
+        rows = np.flatnonzero(self.cipher_ids == cipher_id)
+        if not len(rows):
+            return None
+        scores = self.similarity_matrix(kind)[rows[0]].copy()
+        scores[rows[0]] = -np.inf
+        order = np.argsort(-scores, kind='stable')[:k]
+        return [(int(self.cipher_ids[row]), float(scores[row])) for row in order if np.isfinite(scores[row])]
+
+    def top_k_variations(self, key: tuple, k: int = 5) -> Optional[list]:
+        """[(ключ вариации, косинус центроидов), ...] для вариации key."""
+        matches = np.flatnonzero((self.variation_keys == np.asarray(key)).all(axis=1)) if len(self.variation_keys) else []
+        if not len(matches):
+            return None
+        centroids = self.variation_sums / np.maximum(self.variation_counts, 1)[:, None]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        normalized = np.divide(centroids, norms, out=np.zeros_like(centroids), where=norms > 0)
+        scores = normalized @ normalized[matches[0]]
+        scores[matches[0]] = -np.inf
+        order = np.argsort(-scores, kind='stable')[:k]
+        return [(tuple(int(v) for v in self.variation_keys[row]), float(scores[row])) for row in order if np.isfinite(scores[row])]
+
+    # --- Сохранение ---
+
+    def save(self, path: Path) -> None:
+        """
+        Атомарная запись: уникальный временный файл в том же каталоге и os.replace,
+        поэтому одновременные сохранения из нескольких воркеров не портят друг другу файл.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.stem + '.', suffix='.tmp', delete=False) as tmp:
+            try:
+                np.savez(
+                    tmp,
+                    model_name=np.array(self.model_name), dimension=np.array(self.dimension),
+                    cipher_ids=self.cipher_ids, cipher_sums=self.cipher_sums, cipher_counts=self.cipher_counts,
+                    variation_keys=self.variation_keys, variation_sums=self.variation_sums, variation_counts=self.variation_counts,
+                    lemma_vocab=np.array(self.lemma_vocab, dtype=str), cipher_lemma_counts=self.cipher_lemma_counts,
+                    watermarks=np.array([self.max_embedding_id, self.max_association_id, self.association_count], dtype=np.int64),
+                    max_updated_at=np.array(self.max_updated_at),
+                )
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        try:
+            os.replace(tmp.name, path)
+        except OSError:
+            os.unlink(tmp.name)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['FontProfiles']:
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            # Файлы старого формата без счётчиков не сойдутся с data_state() и будут пересчитаны
+            max_embedding_id, max_association_id, association_count = (data['watermarks'].tolist() + [0])[:3]
+            max_updated_at = float(data['max_updated_at']) if 'max_updated_at' in data.files else 0.0
+            return cls(
+                model_name=str(data['model_name']), dimension=int(data['dimension']),
+                cipher_ids=data['cipher_ids'], cipher_sums=data['cipher_sums'], cipher_counts=data['cipher_counts'],
+                variation_keys=data['variation_keys'], variation_sums=data['variation_sums'],
+                variation_counts=data['variation_counts'], lemma_vocab=data['lemma_vocab'].tolist(),
+                cipher_lemma_counts=data['cipher_lemma_counts'],
+                max_embedding_id=max_embedding_id, max_association_id=max_association_id,
+                max_updated_at=max_updated_at, association_count=association_count,
+            )
+
+
+def profiles_path(model_name: str, directory=None) -> Path:
+    from django.utils.text import slugify
+
+    directory = Path(directory or getattr(settings, 'EMBEDDING_STORE_DIR'))
+    return directory / f"{slugify(model_name) or 'model'}.fonts.npz"
+
+
+# --- Построение из БД ---
+
+def data_state(model) -> tuple:
+    """
+    (число векторов модели, max id вектора, max updated_at, число ассоциаций, max id ассоциации).
+    Сравнение с FontProfiles.state() ловит то, что догрузка по id пропускает: строки,
+    закоммиченные позже соседей с большим id, перезаписанные векторы и удаления.
+    """
+    from .models import Association, AssociationEmbedding
+
+    vectors = AssociationEmbedding.objects.filter(model=model).aggregate(
+        count=Count('id'), max_id=Max('id'), max_updated=Max('updated_at')
+    )
+    associations = Association.objects.aggregate(count=Count('id'), max_id=Max('id'))
+    return (
+        vectors['count'], vectors['max_id'] or 0,
+        vectors['max_updated'].timestamp() if vectors['max_updated'] else 0.0,
+        associations['count'], associations['max_id'] or 0,
+    )
+
+
+def refresh_font_profiles(profiles: FontProfiles, model=None, chunk_size: int = 5000) -> dict:
+    """
+    Добавляет в профили векторы и реакции, появившиеся после сохранённых водяных знаков.
+    """
+    from .models import Association, AssociationEmbedding
+
+    model = model or get_active_embedding_model()
+    new_vectors = 0
+    qs = AssociationEmbedding.objects.filter(model=model, id__gt=profiles.max_embedding_id).order_by('id').values_list(
+        'id', 'vector', 'updated_at', 'association__cipher_id', 'association__font_weight', 'association__font_style',
+        'association__letter_spacing', 'association__font_size', 'association__line_height',
+    )
+    batch = []
+    for row in qs.iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            new_vectors += _add_embedding_batch(profiles, batch, model.dimension)
+            batch = []
+    new_vectors += _add_embedding_batch(profiles, batch, model.dimension)
+
+    qs = Association.objects.filter(id__gt=profiles.max_association_id).order_by('id').values_list(
+        'id', 'cipher_id', 'grouping_key_lemmas', 'reaction_lemmas', 'reaction_description'
+    )
+    cipher_ids, lemma_keys, last_id = [], [], profiles.max_association_id
+    for assoc_id, cipher_id, grouping_key, lemmas, description in qs.iterator(chunk_size=chunk_size):
+        last_id = assoc_id
+        profiles.association_count += 1
+        key = grouping_key or lemmas or (description or '').strip().lower()
+        if key:
+            cipher_ids.append(cipher_id)
+            lemma_keys.append(key)
+    profiles.add_reactions(np.asarray(cipher_ids, dtype=np.int64), lemma_keys)
+    profiles.max_association_id = last_id
+    return {'vectors': new_vectors, 'reactions': len(lemma_keys)}
+
+
+def _add_embedding_batch(profiles: FontProfiles, rows: list, dimension: int) -> int:
+    if not rows:
+        return 0
+    vectors = np.vstack([decode_embedding(row[1], dim=dimension) for row in rows]).astype(np.float32, copy=False)
+    cipher_ids = np.fromiter((row[3] for row in rows), dtype=np.int64, count=len(rows))
+    variation_keys = np.asarray([variation_key(*row[3:9]) for row in rows], dtype=np.int64)
+    profiles.add_embeddings(cipher_ids, variation_keys, vectors)
+    profiles.max_embedding_id = max(profiles.max_embedding_id, rows[-1][0])
+    profiles.max_updated_at = max(profiles.max_updated_at, max(row[2].timestamp() for row in rows))
+    return len(rows)
+
+
+def build_font_profiles(full: bool = False, directory=None, save: bool = True) -> FontProfiles:
+    """
+    Загружает сохранённые профили и догружает новые данные; full=True — пересчёт с нуля.
+    Результат сохраняется в <EMBEDDING_STORE_DIR>/<model>.fonts.npz (save=False — только в памяти).
+    """
+    model = get_active_embedding_model()
+    path = profiles_path(model.name, directory)
+    profiles = None if full else FontProfiles.load(path)
+    if profiles is None or profiles.model_name != model.name or profiles.dimension != model.dimension:
+        profiles = FontProfiles(model.name, model.dimension)
+    started = time.monotonic()
+    added = refresh_font_profiles(profiles, model)
+    if not full and profiles.state() != data_state(model):
+        logger.info("Профили шрифтов расходятся с БД после догрузки, пересчёт с нуля.")
+        profiles = FontProfiles(model.name, model.dimension)
+        added = refresh_font_profiles(profiles, model)
+    if save:
+        profiles.save(path)
+    logger.info(
+        f"Профили шрифтов: +{added['vectors']} векторов, +{added['reactions']} реакций, "
+        f"{len(profiles.cipher_ids)} шрифтов за {time.monotonic() - started:.2f} с."
+    )
+    return profiles
+
+
+# --- Процессный синглтон ---
+
+def _save_quietly(profiles: FontProfiles) -> None:
+    """Сохранение из запроса: при ошибке записи профили остаются в памяти, ответ не падает."""
+    try:
+        profiles.save(profiles_path(profiles.model_name))
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить профили шрифтов: {e}")
+
+
+_profiles: Optional[FontProfiles] = None
+_profiles_lock = threading.Lock()
+_last_check = 0.0
+
+
+def get_font_profiles() -> FontProfiles:
+    """
+    Профили для активной модели. Не чаще раза в FONT_SIMILARITY_REFRESH_INTERVAL секунд
+    сверяет состояние с БД (data_state) и догружает новые ассоциации; если после догрузки
+    оно не сходится, профили пересчитываются с нуля.
+    """
+    global _profiles, _last_check
+    model = get_active_embedding_model()
+    interval = getattr(settings, 'FONT_SIMILARITY_REFRESH_INTERVAL', 60)
+    with _profiles_lock:
+        now = time.monotonic()
+        if _profiles is None or _profiles.model_name != model.name:
+            _profiles = build_font_profiles(save=False)
+            _save_quietly(_profiles)
+            _last_check = now
+        elif now - _last_check >= interval:
+            _last_check = now
+            if _profiles.state() != data_state(model):
+                # Догружаем в копию: запросы, уже получившие профили, читают их без блокировки.
+                refreshed = _profiles.copy()
+                refresh_font_profiles(refreshed, model)
+                if refreshed.state() != data_state(model):
+                    logger.info("Профили шрифтов расходятся с БД после догрузки, пересчёт с нуля.")
+                    refreshed = build_font_profiles(full=True, save=False)
+                _save_quietly(refreshed)
+                _profiles = refreshed
+        return _profiles
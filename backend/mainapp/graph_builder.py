@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+from itertools import combinations
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger('mainapp')
+
+DEFAULT_GRAPH_NAME = 'reactions'
+# Ограничение на число лемм реакции для рёбер совместной встречаемости (пар растёт квадратично)
+MAX_COOCCURRING_LEMMAS = 30
+
+
+def get_graph(name: str = DEFAULT_GRAPH_NAME):
+    from .models import Graph
+    graph, _ = Graph.objects.get_or_create(name=name)
+    return graph
+
+
+def _count_chunk(rows):
+    """
+    rows — (id, cipher_id, cipher_name, reaction_lemmas).
+    Возвращает веса узлов {(тип, имя): вес}, id шрифтов {(тип, имя): cipher_id}
+    и веса рёбер {(тип1, имя1, тип2, имя2, связь): вес}.
+    """
+    from .models import Node, Edge
+
+    font, lemma = Node.NodeType.FONT.value, Node.NodeType.LEMMA.value
+    font_lemma, cooccurrence = Edge.ConnectionType.FONT_LEMMA.value, Edge.ConnectionType.COOCCURRENCE.value
+    node_weights, node_refs, edge_weights = Counter(), {}, Counter()
+    for _, cipher_id, cipher_name, reaction_lemmas in rows:
+        lemmas = sorted(set((reaction_lemmas or '').split()))
+        if not lemmas or not cipher_name:
+            continue
+        node_weights[(font, cipher_name)] += 1
+        node_refs[(font, cipher_name)] = cipher_id
+        for value in lemmas:
+            node_weights[(lemma, value)] += 1
+            edge_weights[(font, cipher_name, lemma, value, font_lemma)] += 1
+        # Неориентированные пары храним в лексикографическом порядке
+        for first, second in combinations(lemmas[:MAX_COOCCURRING_LEMMAS], 2):
+            edge_weights[(lemma, first, lemma, second, cooccurrence)] += 1
+    return node_weights, node_refs, edge_weights
+
+
+def _upsert_chunk(graph, node_weights, node_refs, edge_weights, page_size: int = 1000) -> int:
+    from .models import Node, Edge
+
+    if not node_weights:
+        return 0
+    node_table, edge_table = Node._meta.db_table, Edge._meta.db_table
+    with connection.cursor() as cursor:
+        node_rows = execute_values(
+            cursor,
+            f"INSERT INTO {node_table} (graph_id, node_type, name, ref_id, weight) VALUES %s "
+            f"ON CONFLICT (graph_id, node_type, name) DO UPDATE SET weight = {node_table}.weight + EXCLUDED.weight "
+            f"RETURNING id, node_type, name",
+            [(graph.id, node_type, name, node_refs.get((node_type, name)), weight)
+             for (node_type, name), weight in node_weights.items()],
+            page_size=page_size, fetch=True,
+        )
+        node_ids = {(node_type, name): node_id for node_id, node_type, name in node_rows}
+        execute_values(
+            cursor,
+            f"INSERT INTO {edge_table} (node1_id, node2_id, connection_type, weight) VALUES %s "
+            f"ON CONFLICT (node1_id, node2_id, connection_type) DO UPDATE SET weight = {edge_table}.weight + EXCLUDED.weight",
+            [(node_ids[(type1, name1)], node_ids[(type2, name2)], connection_type, weight)
+             for (type1, name1, type2, name2, connection_type), weight in edge_weights.items()],
+            page_size=page_size,
+        )
+    return len(edge_weights)
+
+
+def pending_associations():
+    """
+    Ещё не учтённые в графе ассоциации. Строки без лемм (import_sas без --nlp) ждут, пока
+    fill_nlp_cache их заполнит, и не помечаются учтёнными с пустым вкладом.
+    """
+    from .models import Association
+
+    return Association.objects.filter(in_graph=False).exclude(reaction_lemmas__isnull=True).exclude(reaction_lemmas='')
+
+
+def update_graph(name: str = DEFAULT_GRAPH_NAME, chunk_size: int = 2000, wait: bool = True) -> dict:
+    """
+    Добавляет в граф ассоциации из pending_associations(): веса узлов и рёбер увеличиваются через
+    INSERT ... ON CONFLICT DO UPDATE, а учтённые строки помечаются в той же транзакции.
+    Флаг, а не водяной знак по id: ассоциация, закоммиченная позже соседней с большим id,
+    не пропускается. Прерванное обновление продолжается с места остановки.
+    wait=False — если граф уже обновляет другой процесс, ничего не делать.
+    """
+    from .models import Association, Graph, Node
+
+    graph = get_graph(name)
+    processed = edges = 0
+    started = time.monotonic()
+    while True:
+        with transaction.atomic():
+            locked = Graph.objects.select_for_update(skip_locked=not wait).filter(pk=graph.pk).first()
+            if locked is None:
+                break
+            rows = list(
+                pending_associations().order_by('id')
+                .values_list('id', 'cipher_id', 'cipher__result', 'reaction_lemmas')[:chunk_size]
+            )
+            if not rows:
+                break
+            edges += _upsert_chunk(locked, *_count_chunk(rows))
+            Association.objects.filter(id__in=[row[0] for row in rows]).update(in_graph=True)
+            locked.cipher_count = Node.objects.filter(graph=locked, node_type=Node.NodeType.FONT).count()
+            locked.save(update_fields=['cipher_count', 'updated_at'])
+            processed += len(rows)
+    if processed:
+        logger.info(
+            f"Граф '{name}': учтено {processed} ассоциаций, обновлено {edges} рёбер "
+            f"за {time.monotonic() - started:.2f} с."
+        )
+    return {'associations': processed, 'edges': edges}
+
+
+def rebuild_graph(name: str = DEFAULT_GRAPH_NAME, chunk_size: int = 2000) -> dict:
+    """Полная пересборка: нужна после удаления ассоциаций, инкрементальное обновление их не видит."""
+    from .models import Association, Graph
+
+    graph = get_graph(name)
+    with transaction.atomic():
+        Graph.objects.select_for_update().filter(pk=graph.pk).first()
+        graph.nodes.all().delete()
+        Association.objects.filter(in_graph=True).update(in_graph=False)
+        Graph.objects.filter(pk=graph.pk).update(cipher_count=0)
+    return update_graph(name, chunk_size=chunk_size)
+
+
+_update_thread = None
+_update_lock = threading.Lock()
+
+
+def _update_in_background() -> None:
+    from .models import Graph
+
+    try:
+        if Graph.objects.filter(name=DEFAULT_GRAPH_NAME).exists():
+            update_graph(wait=False)
+    except Exception as e:
+        logger.error(f"Не удалось обновить граф после новой ассоциации: {e}")
+    finally:
+        connection.close()  # поток не обслуживается обработчиками конца запроса
+
+
+def schedule_graph_update() -> None:
+    """
+    Обновление графа после коммита новой ассоциации (settings.GRAPH_AUTO_UPDATE, по умолчанию
+    выключено — граф обновляет build_graph, в т.ч. периодически с --every). Обновление идёт
+    в фоновом потоке, не задерживая ответ; пока поток работает, новый не запускается —
+    следующий прогон всё равно подберёт все неучтённые ассоциации.
+    Граф, ещё не построенный командой build_graph, не создаётся.
+    """
+    if not getattr(settings, 'GRAPH_AUTO_UPDATE', False):
+        return
+
+    def start():
+        global _update_thread
+        with _update_lock:
+            if _update_thread is not None and _update_thread.is_alive():
+                return
+            _update_thread = threading.Thread(target=_update_in_background, name='graph-update', daemon=True)
+            _update_thread.start()
+
+    transaction.on_commit(start)
+
+
+# --- Граф на лету (graph/ без prebuilt): реакции группируются ключом NLP-анализа ---
+
+def live_graph_data(nlp_params: dict) -> list:
+    """
+    Пары (шрифт, ключ группировки реакции) с числом ассоциаций. Каждый уникальный
+    текст реакции анализируется один раз; пустой ключ заменяется началом текста.
+    """
+    from .cipher_catalogue import get_cipher_catalogue
+    from .models import Association
+    from .nlp_processor import AdvancedTextProcessorBuilder, NLPProcessingDirector
+
+    qs = Association.objects.filter(
+        reaction_description__isnull=False
+    ).exclude(reaction_description__exact='').values_list('cipher_id', 'reaction_description')
+    cipher_names = get_cipher_catalogue().names()
+
+    nlp_director = NLPProcessingDirector(builder=AdvancedTextProcessorBuilder())
+    nlp_cache = {}
+    frequency = Counter()
+    for cipher_id, reaction_desc in qs:
+        font_name = cipher_names.get(cipher_id)
+        if not font_name or not reaction_desc:
+            continue
+        if reaction_desc not in nlp_cache:
+            analysis_result = nlp_director.construct_custom_analysis(text=reaction_desc, **nlp_params)
+            nlp_cache[reaction_desc] = analysis_result.grouping_key or ""
+        processed_desc = nlp_cache[reaction_desc] or reaction_desc[:50]
+        frequency[(font_name, processed_desc)] += 1
+
+    return [{'name': name, 'description': desc, 'count': count} for (name, desc), count in frequency.items()]
+
+
+def _live_graph_cache_key(nlp_params: dict) -> str:
+    """
+    Ключ меняется с любой новой или удалённой ассоциацией и с версией справочника шрифтов.
+    Правки текста существующих реакций подхватываются по истечении GRAPH_VIEW_CACHE_TIMEOUT.
+    """
+    from django.db.models import Count, Max
+
+    from .cipher_catalogue import get_cipher_catalogue
+    from .models import Association
+
+    state = Association.objects.aggregate(count=Count('id'), max_id=Max('id'))
+    catalogue = get_cipher_catalogue()
+    params = ",".join(f"{name}={nlp_params[name]}" for name in sorted(nlp_params))
+    raw = f"{params}|{state['count']}|{state['max_id']}|{catalogue.version}|{len(catalogue)}"
+    return f"live_graph:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+def cached_live_graph_data(nlp_params: dict) -> list:
+    """live_graph_data через кэш Django: при общем бэкенде кэша граф считает один воркер (или warm_caches)."""
+    timeout = getattr(settings, 'GRAPH_VIEW_CACHE_TIMEOUT', 600)
+    if timeout <= 0:
+        return live_graph_data(nlp_params)
+    key = _live_graph_cache_key(nlp_params)
+    data = cache.get(key)
+    if data is None:
+        started = time.monotonic()
+        data = live_graph_data(nlp_params)
+        cache.set(key, data, timeout=timeout)
+        logger.info(f"Граф на лету посчитан за {time.monotonic() - started:.2f} с.: {len(data)} пар шрифт — реакция.")
+    return data
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import metrics
+
+logger = logging.getLogger('mainapp')
+
+
+class EndpointBusy(Exception):
+    """Все слоты эндпоинта заняты дольше ASYNC_QUEUE_TIMEOUT секунд."""
+
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"Эндпоинт '{endpoint}' перегружен.")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+# Семафоры привязаны к циклу событий (в Python 3.9 — при создании), поэтому свои у каждого цикла
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Общий для процесса пул потоков под инференс (spaCy, SBERT) и связанную с ним работу с ORM.
+    Размер ограничивает число одновременно считающих потоков на воркер (INFERENCE_POOL_SIZE).
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'INFERENCE_POOL_SIZE', 2), thread_name_prefix='inference'
+        )
+    return _executor
+
+
+def endpoint_limit(endpoint: str) -> int:
+    return getattr(settings, 'ASYNC_ENDPOINT_LIMITS', {}).get(endpoint, 1)
+
+
+def _limiter(endpoint: str) -> asyncio.Semaphore:
+    per_loop = _limiters.setdefault(asyncio.get_running_loop(), {})
+    limiter = per_loop.get(endpoint)
+    if limiter is None:
+        limiter = per_loop[endpoint] = asyncio.Semaphore(endpoint_limit(endpoint))
+    return limiter
+
+
+def _call_closing_connections(func: Callable, *args, **kwargs):
+    # Потоки пула живут долго: соединение с БД закрывается по тем же правилам
+    # (CONN_MAX_AGE, ошибки), что и в конце обычного запроса
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_pool(endpoint: str, func: Callable, *args, **kwargs):
+    """
+    Выполняет синхронную func в пуле инференса, не занимая цикл событий ASGI-воркера.
+    Одновременно выполняется не больше ASYNC_ENDPOINT_LIMITS[endpoint] вызовов эндпоинта;
+    остальные ждут слот не дольше ASYNC_QUEUE_TIMEOUT секунд, затем EndpointBusy.
+    Контекст (contextvars) передаётся в поток, так что замеры stage_timer попадают в Server-Timing.
+    """
+    limiter = _limiter(endpoint)
+    queue_timeout = getattr(settings, 'ASYNC_QUEUE_TIMEOUT', 10.0)
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(limiter.acquire(), timeout=queue_timeout)
+    except asyncio.TimeoutError:
+        metrics.inc('inference_rejected_total', endpoint=endpoint)
+        logger.warning(f"Эндпоинт '{endpoint}': нет свободного слота за {queue_timeout} с, запрос отклонён.")
+        raise EndpointBusy(endpoint, retry_after=max(1, int(round(queue_timeout))))
+    metrics.observe('inference_queue_seconds', time.perf_counter() - started, endpoint=endpoint)
+    try:
+        return await sync_to_async(
+            _call_closing_connections, thread_sensitive=False, executor=get_executor()
+        )(func, *args, **kwargs)
+    finally:
+        limiter.release()
@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from scipy import sparse
+
+from .font_similarity import variation_key
+
+logger = logging.getLogger('mainapp')
+
+METRICS = ('pmi', 'lift', 'chi2', 'count')
+
+
+def _row_index(keys: list, row_of: Dict) -> np.ndarray:
+    """Номера строк для ключей; новые ключи дописываются в row_of."""
+    rows = np.empty(len(keys), dtype=np.int64)
+    for pos, key in enumerate(keys):
+        row = row_of.get(key)
+        if row is None:
+            row = row_of[key] = len(row_of)
+        rows[pos] = row
+    return rows
+
+
+class LemmaContingency:
+    """
+    Разреженные таблицы сопряжённости шрифт x лемма и вариация x лемма по reaction_lemmas.
+    Лемма считается один раз на реакцию, так что ячейка — число реакций шрифта с этой леммой.
+    Новые ассоциации дописываются по водяному знаку id; удаление и леммы, записанные в уже
+    учтённые строки (fill_nlp_cache после import_sas без --nlp), ведут к полной пересборке.
+    """
+
+    def __init__(self):
+        self.cipher_rows: Dict[int, int] = {}
+        self.variation_rows: Dict[tuple, int] = {}
+        self.lemma_columns: Dict[str, int] = {}
+        self.cipher_counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+        self.variation_counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+        self.max_association_id = 0
+        self.total_associations = 0
+        self.lemmatized_associations = 0
+        self._stats: Dict[str, dict] = {}
+
+    def copy(self) -> 'LemmaContingency':
+        # Матрицы не копируются: add_rows всегда создаёт новые
+        other = LemmaContingency()
+        other.cipher_rows = dict(self.cipher_rows)
+        other.variation_rows = dict(self.variation_rows)
+        other.lemma_columns = dict(self.lemma_columns)
+        other.cipher_counts = self.cipher_counts
+        other.variation_counts = self.variation_counts
+        other.max_association_id = self.max_association_id
+        other.total_associations = self.total_associations
+        other.lemmatized_associations = self.lemmatized_associations
+        return other
+
+    @property
+    def version(self) -> Tuple[int, int, int]:
+        return self.max_association_id, self.total_associations, self.lemmatized_associations
+
+    def add_rows(self, rows: List[tuple]) -> int:
+        """
+        rows — (id, cipher_id, font_weight, font_style, letter_spacing, font_size, line_height, reaction_lemmas).
+        Возвращает число добавленных пар (реакция, лемма).
+        """
+        cipher_keys, variation_keys, lemmas = [], [], []
+        for assoc_id, cipher_id, weight, style, spacing, size, line_height, reaction_lemmas in rows:
+            self.max_association_id = max(self.max_association_id, assoc_id)
+            self.total_associations += 1
+            if not reaction_lemmas:
+                continue
+            self.lemmatized_associations += 1
+            key = variation_key(cipher_id, weight, style, spacing, size, line_height)
+            for lemma in set(reaction_lemmas.split()):
+                cipher_keys.append(cipher_id)
+                variation_keys.append(key)
+                lemmas.append(lemma)
+        if not lemmas:
+            return 0
+
+        cipher_index = _row_index(cipher_keys, self.cipher_rows)
+        variation_index = _row_index(variation_keys, self.variation_rows)
+        lemma_index = _row_index(lemmas, self.lemma_columns)
+        ones = np.ones(len(lemmas), dtype=np.int64)
+        self.cipher_counts = self._accumulate(self.cipher_counts, cipher_index, lemma_index, ones, len(self.cipher_rows))
+        self.variation_counts = self._accumulate(self.variation_counts, variation_index, lemma_index, ones, len(self.variation_rows))
+        self._stats.clear()
+        return len(lemmas)
+
+    def _accumulate(self, matrix, row_index, column_index, data, n_rows):
+        shape = (n_rows, len(self.lemma_columns))
+        delta = sparse.coo_matrix((data, (row_index, column_index)), shape=shape).tocsr()
+        matrix = matrix.copy()
+        matrix.resize(shape)
+        return (matrix + delta).tocsr()
+
+    def statistics(self, level: str = 'cipher') -> dict:
+        """
+        PMI, lift и chi-square для всех ненулевых ячеек таблицы (векторно по CSR.data).
+        Для ячейки a = n(строка, лемма): lift = a * N / (R * L), PMI = log2(lift),
+        chi2 — по таблице 2x2 (строка / не строка) x (лемма / нет леммы).
+        """
+        if level not in self._stats:
+            matrix = self.cipher_counts if level == 'cipher' else self.variation_counts
+            matrix = matrix.tocsr()
+            matrix.sum_duplicates()
+            a = matrix.data.astype(np.float64)
+            row_totals = np.asarray(matrix.sum(axis=1)).ravel().astype(np.float64)
+            col_totals = np.asarray(matrix.sum(axis=0)).ravel().astype(np.float64)
+            n = float(matrix.sum())
+            rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+            r = row_totals[rows]
+            c = col_totals[matrix.indices]
+            lift = a * n / (r * c) if n else np.zeros_like(a)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                pmi = np.log2(lift)
+                b, d_col, d = r - a, c - a, n - r - c + a
+                denominator = r * (n - r) * c * (n - c)
+                chi2 = np.where(denominator > 0, n * (a * d - b * d_col) ** 2 / denominator, 0.0)
+            self._stats[level] = {
+                'matrix': matrix, 'count': a, 'lift': lift, 'pmi': pmi, 'chi2': chi2,
+                'row_totals': row_totals,
+            }
+        return self._stats[level]
+
+    def top_lemmas(self, row: int, level: str = 'cipher', metric: str = 'pmi', k: int = 10, min_count: int = 3) -> list:
+        """Топ-k характерных лемм строки: [{'lemma', 'count', 'pmi', 'lift', 'chi2'}, ...]."""
+        stats = self.statistics(level)
+        matrix = stats['matrix']
+        if row >= matrix.shape[0]:
+            return []
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        counts = stats['count'][start:end]
+        candidates = np.flatnonzero(counts >= min_count)
+        if not len(candidates):
+            return []
+        scores = stats[metric][start:end][candidates]
+        if k < len(candidates):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        lemmas = self.lemma_list()
+        result = []
+        for pos in candidates[top]:
+            cell = start + pos
+            result.append({
+                'lemma': lemmas[matrix.indices[cell]],
+                'count': int(stats['count'][cell]),
+                'pmi': round(float(stats['pmi'][cell]), 4),
+                'lift': round(float(stats['lift'][cell]), 4),
+                'chi2': round(float(stats['chi2'][cell]), 4),
+            })
+        return result
+
+    def lemma_list(self) -> List[str]:
+        if '_lemmas' not in self._stats:
+            lemmas = [''] * len(self.lemma_columns)
+            for lemma, column in self.lemma_columns.items():
+                lemmas[column] = lemma
+            self._stats['_lemmas'] = lemmas
+        return self._stats['_lemmas']
+
+
+def _association_rows(min_id: int = 0, chunk_size: int = 10000):
+    from .models import Association
+
+    return Association.objects.filter(id__gt=min_id).order_by('id').values_list(
+        'id', 'cipher_id', 'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height', 'reaction_lemmas'
+    ).iterator(chunk_size=chunk_size)
+
+
+def update_contingency(table: LemmaContingency, chunk_size: int = 10000) -> int:
+    batch, added = [], 0
+    for row in _association_rows(table.max_association_id, chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            added += table.add_rows(batch)
+            batch = []
+    added += table.add_rows(batch)
+    return added
+
+
+def build_contingency() -> LemmaContingency:
+    started = time.monotonic()
+    table = LemmaContingency()
+    update_contingency(table)
+    logger.info(
+        f"LemmaContingency: {len(table.cipher_rows)} шрифтов, {len(table.variation_rows)} вариаций, "
+        f"{len(table.lemma_columns)} лемм за {time.monotonic() - started:.2f} с."
+    )
+    return table
+
+
+# --- Процессный кэш по версии данных ---
+
+_table: Optional[LemmaContingency] = None
+_table_lock = threading.Lock()
+_last_check = 0.0
+
+
+_LEMMATIZED = Q(reaction_lemmas__isnull=False) & ~Q(reaction_lemmas='')
+
+
+def _data_version() -> Tuple[int, int, int]:
+    from .models import Association
+
+    row = Association.objects.aggregate(max_id=Max('id'), total=Count('id'), lemmatized=Count('id', filter=_LEMMATIZED))
+    return row['max_id'] or 0, row['total'], row['lemmatized']
+
+
+def get_contingency() -> LemmaContingency:
+    """
+    Таблицы для текущей версии данных (max id, число ассоциаций, число ассоциаций с леммами).
+    Если вся разница — строки с id выше учтённого, они догружаются в копию; иначе (удаления,
+    леммы, дописанные в уже учтённые строки) — пересборка.
+    """
+    global _table, _last_check
+    interval = getattr(settings, 'LEMMA_STATS_CHECK_INTERVAL', 30)
+    with _table_lock:
+        now = time.monotonic()
+        if _table is not None and now - _last_check < interval:
+            return _table
+        _last_check = now
+        version = _data_version()
+        if _table is None:
+            _table = build_contingency()
+        elif version != _table.version:
+            _, total, lemmatized = version
+            new_total, new_lemmatized = _count_new(_table.max_association_id)
+            if (total - _table.total_associations == new_total
+                    and lemmatized - _table.lemmatized_associations == new_lemmatized):
+                # Догружаем в копию: запросы, уже получившие таблицу, читают её без блокировки.
+                refreshed = _table.copy()
+                update_contingency(refreshed)
+                _table = refreshed
+            else:
+                _table = build_contingency()
+        return _table
+
+
+def _count_new(max_association_id: int) -> Tuple[int, int]:
+    from .models import Association
+    row = Association.objects.filter(id__gt=max_association_id).aggregate(
+        total=Count('id'), lemmatized=Count('id', filter=_LEMMATIZED)
+    )
+    return row['total'], row['lemmatized']
@@ -0,0 +1,115 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from rest_framework.test import APIClient
+
+from mainapp.benchmarks.cases import BENCHMARKS
+from mainapp.benchmarks.corpus import build_synthetic_corpus
+from mainapp.benchmarks.harness import (
+    CaseResult, SkipBenchmark, compare_with_baseline, load_results, run_case, save_results
+)
+
+DEFAULT_DIR = Path(settings.BASE_DIR) / 'benchmarks'
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарки NLP, поиска, графа, агрегаций и StudyView на синтетическом корпусе в отдельной "
+        "тестовой БД: пропускная способность, перцентили латентности, SQL-запросы, пиковый RSS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default='1000,10000', help='Размеры корпуса через запятую')
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--only', type=str, default=None, help='Имена сценариев через запятую')
+        parser.add_argument('--iterations', type=float, default=1.0, help='Множитель числа замеров сценария')
+        parser.add_argument('--output', type=str, default=str(DEFAULT_DIR / 'results.json'))
+        parser.add_argument('--baseline', type=str, default=str(DEFAULT_DIR / 'baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='Записать результаты как новую базовую линию')
+        parser.add_argument('--threshold', type=float, default=0.10, help='Допустимый рост метрики относительно базовой линии')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--keepdb', action='store_true', help='Не удалять тестовую БД после прогона')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError("--sizes: ожидались целые числа через запятую.")
+        only = set(options['only'].split(',')) if options['only'] else None
+        benchmarks = [b for b in BENCHMARKS if only is None or b.name in only]
+        if not benchmarks:
+            raise CommandError(f"Нет сценариев с именами {sorted(only)}.")
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = self._run(benchmarks, sizes, options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        save_results(options['output'], results, options['seed'])
+        self.stdout.write(f"Результаты: {options['output']}")
+        self._report_comparison(results, options)
+        if options['save_baseline']:
+            save_results(options['baseline'], results, options['seed'])
+            self.stdout.write(self.style.SUCCESS(f"Базовая линия обновлена: {options['baseline']}"))
+
+    def _run(self, benchmarks, sizes, options):
+        from mainapp.query_cache import query_embedding_cache
+        from mainapp.vector_index import get_semantic_index
+
+        User = get_user_model()
+        context = {'seed': options['seed']}
+        context['client'], context['study_client'] = APIClient(), APIClient()
+        context['client'].force_authenticate(user=User.objects.create_user('bench_reader', password='bench'))
+
+        results = []
+        pending = list(benchmarks)
+        for size in sizes:
+            summary = build_synthetic_corpus(size, seed=options['seed'])
+            get_semantic_index(force_rebuild=True)
+            query_embedding_cache.clear()
+            self.stdout.write(f"Корпус {size}: {summary}")
+            for benchmark in pending:
+                # Для каждого размера — новый пользователь StudyView с пустой историей вариаций
+                study_user, _ = User.objects.get_or_create(username=f'bench_writer_{size}_{benchmark.name}')
+                context['study_client'].force_authenticate(user=study_user)
+                results.append(self._run_one(benchmark, size if benchmark.per_size else 0, context, options))
+            pending = [b for b in pending if b.per_size]
+        return results
+
+    def _run_one(self, benchmark, size, context, options) -> CaseResult:
+        iterations = max(1, round(benchmark.iterations * options['iterations']))
+        try:
+            operation, items_per_op = benchmark.setup(dict(context, size=size))
+            result = run_case(benchmark.name, size, operation, iterations=iterations, items_per_op=items_per_op)
+        except SkipBenchmark as e:
+            result = CaseResult(name=benchmark.name, size=size, skipped=str(e))
+            self.stdout.write(self.style.WARNING(f"  {result.key}: пропущен ({e})"))
+            return result
+        self.stdout.write(
+            f"  {result.key}: {result.ops_per_sec:.1f} оп/с, {result.items_per_sec:.1f} эл/с, "
+            f"p50 {result.p50_ms:.2f} мс, p95 {result.p95_ms:.2f} мс, p99 {result.p99_ms:.2f} мс, "
+            f"{result.queries_per_op:g} SQL/оп, пик RSS {result.peak_rss_mb:.0f} МБ"
+        )
+        return result
+
+    def _report_comparison(self, results, options):
+        baseline = load_results(options['baseline'])
+        if not baseline:
+            self.stdout.write(f"Базовой линии нет ({options['baseline']}) — сравнение пропущено.")
+            return
+        rows = compare_with_baseline(results, baseline, threshold=options['threshold'])
+        regressions = [row for row in rows if row['regression']]
+        for row in rows:
+            line = (f"  {row['case']} {row['metric']}: {row['baseline']:g} -> {row['current']:g} "
+                    f"({row['change'] * 100:+.1f}%)")
+            self.stdout.write(self.style.ERROR(line) if row['regression'] else line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"Регрессий относительно базовой линии: {len(regressions)}.")
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS("Регрессий относительно базовой линии нет."))
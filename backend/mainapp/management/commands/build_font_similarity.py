@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.font_similarity import build_font_profiles, profiles_path
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает центроиды шрифтов/вариаций и распределения реакций для fonts/similarity/"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать с нуля вместо догрузки новых ассоциаций')
+        parser.add_argument('--store-dir', type=str, default=None, help='Каталог вместо EMBEDDING_STORE_DIR')
+
+    def handle(self, *args, **options):
+        profiles = build_font_profiles(full=options['full'], directory=options['store_dir'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Профили {len(profiles.cipher_ids)} шрифтов и {len(profiles.variation_keys)} вариаций сохранены в "
+            f"{profiles_path(profiles.model_name, options['store_dir'])}"
+        ))
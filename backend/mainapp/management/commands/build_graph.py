@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.graph_builder import DEFAULT_GRAPH_NAME, rebuild_graph, update_graph
+
+
+class Command(BaseCommand):
+    help = "Материализует граф шрифт — лемма и совместной встречаемости лемм в Graph/Node/Edge"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', type=str, default=DEFAULT_GRAPH_NAME, help='Имя графа')
+        parser.add_argument('--rebuild', action='store_true', help='Удалить узлы и рёбра и собрать граф заново')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Ассоциаций на транзакцию')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Дообновлять граф каждые N секунд до остановки процесса (фоновая джоба)')
+
+    def handle(self, *args, **options):
+        if options['every'] < 0:
+            raise CommandError("--every не может быть отрицательным.")
+        if options['rebuild']:
+            result = rebuild_graph(options['name'], chunk_size=options['chunk_size'])
+        else:
+            result = update_graph(options['name'], chunk_size=options['chunk_size'])
+        self._report(options['name'], result)
+        while options['every']:
+            time.sleep(options['every'])
+            result = update_graph(options['name'], chunk_size=options['chunk_size'])
+            if result['associations']:
+                self._report(options['name'], result)
+
+    def _report(self, name, result):
+        self.stdout.write(self.style.SUCCESS(
+            f"Граф '{name}': учтено {result['associations']} ассоциаций, рёбер обновлено {result['edges']}"
+        ))
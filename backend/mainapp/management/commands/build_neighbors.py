@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.neighbors import DEFAULT_BLOCK_SIZE, DEFAULT_NEIGHBORS_K, rebuild_neighbors, update_neighbors
+from mainapp.vector_index import get_semantic_index
+
+
+class Command(BaseCommand):
+    help = "Строит таблицу k ближайших ассоциаций по эмбеддингам (блочное умножение матриц)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=DEFAULT_NEIGHBORS_K, help='Размер списка соседей')
+        parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE, help='Размер плитки матрицы сходств')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Только новые векторы: посчитать их списки и дополнить существующие')
+
+    def handle(self, *args, **options):
+        if options['k'] < 1 or options['block_size'] < 1:
+            raise CommandError("--k и --block-size должны быть положительными.")
+        index = get_semantic_index()
+        self.stdout.write(f"Индекс: {len(index)} векторов модели '{index.model.name}'")
+        if options['incremental']:
+            result = update_neighbors(k=options['k'], block_size=options['block_size'], index=index)
+            self.stdout.write(self.style.SUCCESS(
+                f"Новых списков: {result['new']}, дополнено существующих: {result['updated']}"
+            ))
+        else:
+            saved = rebuild_neighbors(k=options['k'], block_size=options['block_size'], index=index)
+            self.stdout.write(self.style.SUCCESS(f"Пересчитаны соседи для {saved} ассоциаций"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from mainapp.dataset_export import EXPORT_FORMATS, default_format, export_dataset, last_watermark
+
+
+class Command(BaseCommand):
+    help = "Колоночная выгрузка ассоциаций с леммами, демографией и эмбеддингами (Parquet при наличии pyarrow, иначе .npz)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str, help='Путь к файлу выгрузки')
+        parser.add_argument('--file-format', choices=EXPORT_FORMATS, default=None, help='parquet или npz (по умолчанию parquet, если установлен pyarrow)')
+        parser.add_argument('--since', type=str, default=None, help='Выгрузить только ассоциации, созданные позже (ISO 8601, с окном перекрытия)')
+        parser.add_argument('--incremental', action='store_true', help='Продолжить с водяного знака предыдущей выгрузки (<output>.json)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['since']:
+            try:
+                since_at = parse_datetime(options['since'])
+            except ValueError:
+                since_at = None
+            if since_at is None or since_at.tzinfo is None:
+                raise CommandError("--since: ожидается дата и время ISO 8601 с часовым поясом.")
+            since = {'created_at': since_at.isoformat(), 'exported_ids': []}
+        else:
+            since = last_watermark(options['output']) if options['incremental'] else None
+        try:
+            meta = export_dataset(
+                options['output'], fmt=options['file_format'] or default_format(),
+                since=since, chunk_size=options['chunk_size'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Выгружено {meta['count']} ассоциаций ({meta['format']}, созданных после {meta['since'] or 'начала'}, "
+            f"водяной знак {meta['created_at']}) в {options['output']}"
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.embeddings import get_active_embedding_model, export_embedding_matrix
+from mainapp.models import EmbeddingModel
+
+
+class Command(BaseCommand):
+    help = "Выгружает эмбеддинги модели в непрерывный .npy (открывается через mmap без обращения к БД)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', type=str, default=None, help='Имя модели из реестра (по умолчанию активная)')
+        parser.add_argument('--store-dir', type=str, default=None, help='Каталог выгрузки вместо EMBEDDING_STORE_DIR')
+
+    def handle(self, *args, **options):
+        if options['model']:
+            try:
+                embedding_model = EmbeddingModel.objects.get(name=options['model'])
+            except EmbeddingModel.DoesNotExist:
+                raise CommandError(f"Модель '{options['model']}' отсутствует в реестре.")
+        else:
+            embedding_model = get_active_embedding_model()
+        meta = export_embedding_matrix(embedding_model, directory=options['store_dir'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Выгружено {meta['count']} векторов модели '{meta['model']}' (max id {meta['max_association_id']})"
+        ))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from mainapp.models import Association
 from mainapp.nlp_processor import AdvancedTextProcessorBuilder, NLPProcessingDirector
+from mainapp.embeddings import association_content_hash, get_active_embedding_model, save_association_embedding
 
 class Command(BaseCommand):
     help = "Вычисляет и кэширует леммы, grouping_key и эмбеддинг для всех ассоциаций"
@@ -8,9 +9,11 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         nlp_builder = AdvancedTextProcessorBuilder()
         nlp_director = NLPProcessingDirector(builder=nlp_builder)
+        embedding_model = get_active_embedding_model()
+        embedded_ids = set(embedding_model.association_embeddings.values_list('association_id', flat=True))
         total = Association.objects.count()
         for i, assoc in enumerate(Association.objects.all(), 1):
-            if assoc.grouping_key_lemmas and assoc.text_embedding_vector:
+            if assoc.grouping_key_lemmas and assoc.id in embedded_ids:
                 continue  # уже заполнено
             result = nlp_director.construct_custom_analysis(
                 text=assoc.reaction_description,
@@ -24,8 +27,11 @@ class Command(BaseCommand):
             )
             assoc.reaction_lemmas = " ".join(result.lemmas)
             assoc.grouping_key_lemmas = result.grouping_key
-            assoc.text_embedding_vector = result.text_embedding.tolist() if result.text_embedding is not None else None
-            assoc.save(update_fields=['reaction_lemmas', 'grouping_key_lemmas', 'text_embedding_vector'])
+            assoc.save(update_fields=['reaction_lemmas', 'grouping_key_lemmas'])
+            save_association_embedding(
+                assoc.id, result.text_embedding,
+                association_content_hash(assoc.reaction_description, assoc.reaction_lemmas), model=embedding_model
+            )
             if i % 10 == 0:
                 self.stdout.write(f"{i}/{total} обработано")
-        self.stdout.write("Готово!") 
\ No newline at end of file
+        self.stdout.write("Готово!") 
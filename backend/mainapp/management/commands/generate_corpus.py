@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.synthetic_corpus import EMBEDDING_MODES, LEMMA_MODES, SyntheticCorpusGenerator
+
+
+class Command(BaseCommand):
+    help = "Генерирует детерминированный синтетический корпус ассоциаций для проверки масштабирования"
+
+    def add_arguments(self, parser):
+        parser.add_argument('size', type=int, help='Число ассоциаций')
+        parser.add_argument('--users', type=int, default=0, help='Число пользователей (по умолчанию size / 40)')
+        parser.add_argument('--ciphers', type=int, default=50, help='Число синтетических шрифтов')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--user-prefix', type=str, default='synth_user_')
+        parser.add_argument('--lemmas', choices=LEMMA_MODES, default='dictionary',
+                            help='dictionary — леммы из словаря генератора, nlp — через NLP-пайплайн (медленно)')
+        parser.add_argument('--embeddings', choices=EMBEDDING_MODES, default='none',
+                            help='random — синтетические векторы со смысловой структурой, real — SentenceTransformer')
+        parser.add_argument('--days', type=int, default=365, help='Период, по которому распределяются created_at')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Ассоциаций на одну COPY-пачку')
+        parser.add_argument('--clear', action='store_true', help='Сначала удалить пользователей с этим префиксом и их данные')
+
+    def handle(self, *args, **options):
+        try:
+            generator = SyntheticCorpusGenerator(
+                options['size'], users=options['users'], ciphers=options['ciphers'], seed=options['seed'],
+                user_prefix=options['user_prefix'], lemmas=options['lemmas'], embeddings=options['embeddings'],
+                days=options['days'], chunk_size=options['chunk_size'], log=self.stdout.write,
+            )
+            if options['clear']:
+                deleted = generator.clear()
+                self.stdout.write(f"Удалено пользователей с префиксом {options['user_prefix']}: {deleted}")
+            stats = generator.generate()
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано {stats['associations']} ассоциаций, {stats['users']} пользователей, "
+            f"{stats['ciphers']} шрифтов за {stats['seconds']} с."
+        ))
+        if options['embeddings'] != 'none':
+            self.stdout.write("Перестройте индексы: build_neighbors, build_graph.")
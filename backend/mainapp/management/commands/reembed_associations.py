@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.embeddings import (
+    get_active_embedding_model, stale_associations, embed_texts,
+    bulk_save_association_embeddings, export_embedding_matrix, association_content_hash
+)
+from mainapp.nlp_processor import AdvancedTextProcessorBuilder, NLPProcessingDirector, get_sentence_transformer
+
+
+class Command(BaseCommand):
+    help = "Строит эмбеддинги активной модели для ассоциаций без вектора или с изменившимся текстом"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=256, help='Сколько реакций кодировать за один вызов модели')
+        parser.add_argument('--limit', type=int, default=None, help='Обработать не больше N ассоциаций')
+        parser.add_argument('--export', action='store_true', help='После пересчёта выгрузить матрицу в EMBEDDING_STORE_DIR')
+        parser.add_argument('--store-dir', type=str, default=None, help='Каталог выгрузки вместо EMBEDDING_STORE_DIR')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        limit = options['limit']
+        embedding_model = get_active_embedding_model()
+
+        sbert_model = get_sentence_transformer()
+        if sbert_model is None:
+            raise CommandError(f"Модель SentenceTransformer '{embedding_model.name}' не загружена.")
+        model_dim = sbert_model.get_sentence_embedding_dimension()
+        if model_dim != embedding_model.dimension:
+            raise CommandError(
+                f"Размерность модели ({model_dim}) не совпадает с реестром ({embedding_model.dimension}) для '{embedding_model.name}'."
+            )
+
+        nlp_director = NLPProcessingDirector(builder=AdvancedTextProcessorBuilder())
+        total_stale = stale_associations(embedding_model).count()
+        self.stdout.write(f"Модель '{embedding_model.name}': устаревших ассоциаций {total_stale}")
+
+        processed, last_id, started = 0, 0, time.monotonic()
+        while limit is None or processed < limit:
+            chunk_size = batch_size if limit is None else min(batch_size, limit - processed)
+            rows = list(
+                stale_associations(embedding_model).filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'reaction_description', 'reaction_lemmas')[:chunk_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            ids, texts, hashes = [], [], []
+            for assoc_id, description, lemmas in rows:
+                # Эмбеддинг строится по той же строке, что и в StudyView: леммы через пробел.
+                text = lemmas
+                if not text or not text.strip():
+                    analysis = nlp_director.construct_custom_analysis(text=description, gen_text_emb=False)
+                    text = " ".join(analysis.lemmas) or (analysis.processed_text or description)
+                if text and text.strip():
+                    ids.append(assoc_id)
+                    texts.append(text)
+                    hashes.append(association_content_hash(description, lemmas))
+
+            vectors = embed_texts(texts, batch_size=min(batch_size, 64))
+            bulk_save_association_embeddings(zip(ids, vectors, hashes), model=embedding_model)
+            processed += len(rows)
+            self.stdout.write(f"{processed}/{total_stale} обработано ({time.monotonic() - started:.1f} с)")
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: {processed} ассоциаций"))
+
+        if options['export']:
+            meta = export_embedding_matrix(embedding_model, directory=options['store_dir'])
+            self.stdout.write(self.style.SUCCESS(f"Выгружено {meta['count']} векторов модели '{meta['model']}'"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.cache_warmup import DEFAULT_QUERY_LIMIT, STEP_NAMES, warm_caches
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогревает модели NLP, индекс семантического поиска, граф graph/ для параметров по умолчанию "
+        "и кэш анализа частых поисковых запросов. Процессные кэши нужны в каждом воркере — их прогревает "
+        "gunicorn.conf.py; команда наполняет общие (кэш Django, выгрузка эмбеддингов) и проверяет шаги перед деплоем"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', type=str, default=None, help=f"Шаги через запятую: {', '.join(STEP_NAMES)}")
+        parser.add_argument('--skip', type=str, default=None, help='Пропустить шаги (через запятую)')
+        parser.add_argument('--query-limit', type=int, default=DEFAULT_QUERY_LIMIT, help='Сколько самых частых реакций прогнать через кэш запросов')
+        parser.add_argument('--export-index', action='store_true', help='Перед построением индекса выгрузить эмбеддинги в .npy (mmap для воркеров)')
+
+    def handle(self, *args, **options):
+        steps = list(STEP_NAMES)
+        if options['only']:
+            steps = [name.strip() for name in options['only'].split(',') if name.strip()]
+        if options['skip']:
+            skipped = {name.strip() for name in options['skip'].split(',')}
+            steps = [name for name in steps if name not in skipped]
+        if options['query_limit'] < 0:
+            raise CommandError("--query-limit не может быть отрицательным.")
+
+        total = len(steps)
+        position = [0]
+
+        def report(result):
+            position[0] += 1
+            prefix = f"[{position[0]}/{total}] {result['title']}"
+            if result['error'] is None:
+                self.stdout.write(f"{prefix}: {result['detail']} ({result['seconds']:.2f} с)")
+            else:
+                self.stdout.write(self.style.ERROR(f"{prefix}: ошибка — {result['error']} ({result['seconds']:.2f} с)"))
+
+        try:
+            results = warm_caches(
+                steps, options={'query_limit': options['query_limit'], 'export_index': options['export_index']}, report=report
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        seconds = sum(result['seconds'] for result in results)
+        failed = [result['step'] for result in results if result['error'] is not None]
+        if failed:
+            raise CommandError(f"Прогрев завершён с ошибками за {seconds:.2f} с, шаги: {', '.join(failed)}.")
+        self.stdout.write(self.style.SUCCESS(f"Прогрев завершён за {seconds:.2f} с."))
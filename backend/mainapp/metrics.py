@@ -0,0 +1,202 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger('mainapp')
+
+# Границы корзин гистограмм, секунды: от долей миллисекунды (стоп-слова) до секунд (SBERT на CPU)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_HELP = {
+    'nlp_stage_seconds': "Длительность этапа NLP-анализа",
+    'nlp_texts_total': "Тексты, прошедшие через NLPProcessingDirector",
+    'nlp_tokens_total': "Токены после удаления стоп-слов",
+    'embedding_texts_total': "Тексты, закодированные пакетно SentenceTransformer",
+    'query_cache_lookups_total': "Обращения к кэшу анализа поисковых запросов",
+    'http_request_seconds': "Длительность обработки запроса по маршруту",
+    'db_queries_total': "SQL-запросы в профилированных запросах по маршруту",
+    'db_request_seconds': "Время в БД за профилированный запрос по маршруту",
+    'n_plus_one_requests_total': "Профилированные запросы с признаками N+1",
+    'inference_queue_seconds': "Ожидание слота эндпоинта в пуле инференса",
+    'inference_rejected_total': "Запросы, не дождавшиеся слота в пуле инференса",
+    'admission_queue_depth': "Запросы процесса, ждущие допуска к тяжёлому эндпоинту",
+    'admission_in_flight': "Запросы процесса, выполняющиеся на тяжёлом эндпоинте",
+    'admission_rejected_total': "Запросы, отклонённые контролем допуска",
+    'admission_wait_seconds': "Ожидание допуска к тяжёлому эндпоинту",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Счётчики и гистограммы процесса. Каждый воркер gunicorn считает своё,
+    Prometheus суммирует по экземплярам (label instance).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(labels: dict) -> LabelKey:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def gauge_add(self, name: str, delta: float, **labels) -> None:
+        """Изменяет текущее значение (глубина очереди, запросы в работе) на delta."""
+        key = self._key(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + delta
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._gauges.clear()
+
+    def snapshot(self) -> dict:
+        """{имя: {метки: значение}}; для гистограмм — count, sum и среднее."""
+        with self._lock:
+            result = {name: {_format_labels(key): value for key, value in series.items()}
+                      for name, series in list(self._counters.items()) + list(self._gauges.items())}
+            for name, series in self._histograms.items():
+                result[name] = {
+                    _format_labels(key): {
+                        'count': h.count, 'sum': round(h.sum, 6),
+                        'mean': round(h.sum / h.count, 6) if h.count else 0.0,
+                    }
+                    for key, h in series.items()
+                }
+            return result
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                _describe(lines, name, 'counter')
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._gauges.items()):
+                _describe(lines, name, 'gauge')
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._histograms.items()):
+                _describe(lines, name, 'histogram')
+                for key, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(h.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        lines.append("# TYPE process_start_time_seconds gauge")
+        lines.append(f"process_start_time_seconds {_format_value(self.started_at)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _describe(lines: list, name: str, metric_type: str) -> None:
+    lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+metrics = MetricsRegistry()
+
+
+# --- Server-Timing: длительности этапов в рамках текущего запроса ---
+
+_request_timings: contextvars.ContextVar[Optional[Dict[str, list]]] = contextvars.ContextVar(
+    'request_timings', default=None
+)
+
+
+def start_request_timings() -> contextvars.Token:
+    return _request_timings.set({})
+
+
+def finish_request_timings(token: contextvars.Token) -> Dict[str, list]:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def record_timing(name: str, seconds: float, calls: int = 1) -> None:
+    """Добавляет длительность к метрике Server-Timing текущего запроса (вне запроса — ничего)."""
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+
+def server_timing_header(timings: Dict[str, list]) -> str:
+    parts = []
+    for name, (seconds, calls) in timings.items():
+        desc = f';desc="{calls}x"' if calls > 1 else ''
+        parts.append(f"{name};dur={seconds * 1000.0:.2f}{desc}")
+    return ", ".join(parts)
+
+
+@contextmanager
+def stage_timer(stage: str, metric: str = 'nlp_stage_seconds'):
+    """Замер этапа: гистограмма процесса metric{stage=...} и Server-Timing текущего запроса."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe(metric, elapsed, stage=stage)
+        record_timing(f"nlp_{stage}" if metric == 'nlp_stage_seconds' else stage, elapsed)
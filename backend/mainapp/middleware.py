@@ -0,0 +1,162 @@
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # без Brotli ответы сжимаются только gzip
+    brotli = None
+
+from .metrics import finish_request_timings, metrics, record_timing, server_timing_header, start_request_timings
+from .query_profiler import QueryCollector, query_profiler
+from .renderers import is_large_response
+from .sampling_profiler import active_session, claim_request, profile_call
+
+
+def _route(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match is not None and match.url_name else 'unmatched'
+
+
+class ServerTimingMiddleware:
+    """
+    Длительность запроса по маршруту (гистограмма http_request_seconds) и, при
+    SERVER_TIMING_ENABLED, заголовок Server-Timing с этапами NLP, замеренными stage_timer.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = start_request_timings()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = finish_request_timings(token)
+        elapsed = time.perf_counter() - started
+
+        metrics.observe('http_request_seconds', elapsed, route=_route(request), method=request.method)
+        if getattr(settings, 'SERVER_TIMING_ENABLED', False):
+            timings['total'] = [elapsed, 1]
+            response['Server-Timing'] = server_timing_header(timings)
+        return response
+
+
+class QueryProfilingMiddleware:
+    """
+    Для выборки запросов (QUERY_PROFILING['SAMPLE_RATE']) считает SQL-запросы, время в БД
+    и повторы одного запроса (N+1) — см. query_profiler. Стоит после ServerTimingMiddleware,
+    чтобы время в БД попадало в Server-Timing как db. Запросы, выполняемые при отдаче
+    StreamingHttpResponse, уже после выхода из middleware, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not query_profiler.should_sample():
+            return self.get_response(request)
+        collector = QueryCollector()
+        started = time.perf_counter()
+        with connection.execute_wrapper(collector):
+            response = self.get_response(request)
+        query_profiler.record(_route(request), request.method, time.perf_counter() - started, collector)
+        record_timing('db', collector.db_time, calls=collector.count)
+        return response
+
+
+class SamplingProfilerMiddleware:
+    """
+    Профилирование по запросу администратора (api/profiling/): пока активна сессия
+    sampling_profiler, подходящие запросы выполняются под сэмплером стека или cProfile.
+    Вне сессии — одна проверка состояния в памяти процесса на запрос.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        session = active_session()
+        if session is None:
+            return self.get_response(request)
+        try:
+            route = resolve(request.path_info).url_name or 'unmatched'
+        except Resolver404:
+            return self.get_response(request)
+        if not session.matches(route) or not claim_request(session):
+            return self.get_response(request)
+        return profile_call(session, f"{request.method} {route}", lambda: self.get_response(request))
+
+
+_ACCEPT_ENCODING_PART = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """'br', 'gzip' или '' по заголовку Accept-Encoding (q=0 — запрет кодировки)."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        match = _ACCEPT_ENCODING_PART.match(part)
+        if match:
+            try:
+                accepted[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+            except ValueError:
+                continue
+    wildcard = accepted.get('*', 0.0)
+    candidates = [('br', brotli is not None), ('gzip', True)]
+    best, best_q = '', 0.0
+    for encoding, available in candidates:
+        q = accepted.get(encoding, wildcard)
+        if available and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Сжатие больших JSON-ответов (RESPONSE_COMPRESSION, по умолчанию выключено): только ответы
+    FastJSONRenderer/FastJsonResponse — представлений из LARGE_RESPONSE_RENDERERS и GraphView —
+    не меньше MIN_SIZE байт. Страницы админки, ответы с токенами (users/login, token/refresh) и
+    прочие ответы не сжимаются. Brotli, если клиент его принимает и пакет установлен, иначе gzip
+    со случайным заголовком против BREACH, как в GZipMiddleware. Потоковые ответы не сжимаются —
+    буфер компрессора задержал бы записи NDJSON. Время сжатия попадает в Server-Timing как compress.
+    """
+
+    max_random_bytes = 100
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        config = getattr(settings, 'RESPONSE_COMPRESSION', {})
+        if (not config.get('ENABLED', False) or not is_large_response(response) or response.streaming
+                or response.has_header('Content-Encoding') or len(response.content) < config.get('MIN_SIZE', 1024)):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if not encoding:
+            return response
+
+        started = time.perf_counter()
+        if encoding == 'br':
+            compressed = brotli.compress(response.content, mode=brotli.MODE_TEXT, quality=config.get('BROTLI_QUALITY', 4))
+        else:
+            compressed = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+        record_timing('compress', time.perf_counter() - started)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # Как в GZipMiddleware: сильный ETag несжатого тела для сжатого неверен
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('mainapp', '0007_association_nlp_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('dimension', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AssociationEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vector', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('association', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='mainapp.association')),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='association_embeddings', to='mainapp.embeddingmodel')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='associationembedding',
+            constraint=models.UniqueConstraint(fields=('association', 'model'), name='unique_association_embedding_model'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+from django.db import migrations
+import numpy as np
+
+CHUNK_SIZE = 2000
+# Модель, которой построены векторы text_embedding_vector (nlp_processor.SBERT_MODEL_NAME до реестра моделей).
+# Зафиксирована здесь: SBERT_MODEL_NAME из окружения на момент миграции может указывать на другую модель.
+LEGACY_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+LEGACY_MODEL_DIMENSION = 384
+
+
+def _legacy_model(apps):
+    EmbeddingModel = apps.get_model('mainapp', 'EmbeddingModel')
+    model, _ = EmbeddingModel.objects.get_or_create(
+        name=LEGACY_MODEL_NAME, defaults={'dimension': LEGACY_MODEL_DIMENSION},
+    )
+    return model
+
+
+def array_to_store(apps, schema_editor):
+    # Векторы из ArrayField сразу пишутся в хранилище как float32 bytea, без промежуточной колонки
+    Association = apps.get_model('mainapp', 'Association')
+    AssociationEmbedding = apps.get_model('mainapp', 'AssociationEmbedding')
+    if not Association.objects.filter(text_embedding_vector__isnull=False).exists():
+        return
+    model = _legacy_model(apps)
+    last_id = 0
+    while True:
+        rows = list(
+            Association.objects.filter(id__gt=last_id, text_embedding_vector__isnull=False)
+            .order_by('id').values_list('id', 'text_embedding_vector')[:CHUNK_SIZE]
+        )
+        if not rows:
+            return
+        AssociationEmbedding.objects.bulk_create([
+            AssociationEmbedding(association_id=assoc_id, model=model, vector=np.asarray(vector, dtype='<f4').tobytes())
+            for assoc_id, vector in rows
+        ], ignore_conflicts=True)
+        last_id = rows[-1][0]
+
+
+def store_to_array(apps, schema_editor):
+    Association = apps.get_model('mainapp', 'Association')
+    AssociationEmbedding = apps.get_model('mainapp', 'AssociationEmbedding')
+    model = _legacy_model(apps)
+    last_id = 0
+    while True:
+        rows = list(
+            AssociationEmbedding.objects.filter(model=model, association_id__gt=last_id)
+            .order_by('association_id').values_list('association_id', 'vector')[:CHUNK_SIZE]
+        )
+        if not rows:
+            return
+        batch = []
+        for assoc_id, buffer in rows:
+            raw = bytes(buffer)
+            dtype = '<f2' if len(raw) == model.dimension * 2 else '<f4'
+            batch.append(Association(
+                id=assoc_id,
+                text_embedding_vector=np.frombuffer(raw, dtype=dtype).astype(float).tolist(),
+            ))
+        Association.objects.bulk_update(batch, ['text_embedding_vector'])
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    # Перенос идёт чанками с коммитом после каждого, чтобы не держать
+    # одну долгую транзакцию на всей таблице.
+    atomic = False
+
+    dependencies = [
+        ('mainapp', '0008_embedding_store'),
+    ]
+
+    operations = [
+        migrations.RunPython(array_to_store, store_to_array),
+        migrations.RemoveField(
+            model_name='association',
+            name='text_embedding_vector',
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+import django.contrib.postgres.fields
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('mainapp', '0009_move_vectors_to_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssociationNeighbors',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('neighbor_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('scores', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), default=list, size=None)),
+                ('min_score', models.FloatField(default=-1.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('association', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_lists', to='mainapp.association')),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_lists', to='mainapp.embeddingmodel')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='associationneighbors',
+            constraint=models.UniqueConstraint(fields=('association', 'model'), name='unique_association_neighbors_model'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('mainapp', '0010_association_neighbors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='name',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='graph',
+            name='cipher_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='graph',
+            name='administrator',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='mainapp.administrator'),
+        ),
+        migrations.AddField(
+            model_name='graph',
+            name='last_association_id',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='graph',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='node_type',
+            field=models.CharField(choices=[('font', 'Шрифт'), ('lemma', 'Лемма')], default='lemma', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='ref_id',
+            field=models.IntegerField(blank=True, help_text='ID шрифта для узлов типа font', null=True),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='weight',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='edge',
+            name='weight',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='node',
+            constraint=models.UniqueConstraint(fields=('graph', 'node_type', 'name'), name='unique_graph_node'),
+        ),
+        migrations.AddConstraint(
+            model_name='edge',
+            constraint=models.UniqueConstraint(fields=('node1', 'node2', 'connection_type'), name='unique_edge'),
+        ),
+        migrations.AddIndex(
+            model_name='edge',
+            index=models.Index(fields=['connection_type', '-weight'], name='edge_type_weight_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mainapp', '0011_graph_materialization'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSeenVariations',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='seen_variations', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bitmap', models.BinaryField(default=bytes)),
+                ('association_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
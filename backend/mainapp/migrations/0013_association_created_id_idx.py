@@ -0,0 +1,14 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('mainapp', '0012_userseenvariations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='association',
+            index=models.Index(fields=['created_at', 'id'], name='association_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+
+def mark_counted_associations(apps, schema_editor):
+    Graph = apps.get_model('mainapp', 'Graph')
+    Association = apps.get_model('mainapp', 'Association')
+    graph = Graph.objects.filter(name='reactions').first()
+    if graph is not None and graph.last_association_id:
+        Association.objects.filter(id__lte=graph.last_association_id).update(in_graph=True)
+
+
+def restore_watermark(apps, schema_editor):
+    Graph = apps.get_model('mainapp', 'Graph')
+    Association = apps.get_model('mainapp', 'Association')
+    counted = Association.objects.filter(in_graph=True).aggregate(max_id=models.Max('id'))['max_id']
+    Graph.objects.filter(name='reactions').update(last_association_id=counted or 0)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('mainapp', '0013_association_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='association',
+            name='in_graph',
+            field=models.BooleanField(default=False),
+        ),
+        # Значение по умолчанию и в самой БД: import_sas и синтетический корпус пишут ассоциации через SQL/COPY
+        migrations.RunSQL(
+            "ALTER TABLE mainapp_association ALTER COLUMN in_graph SET DEFAULT false",
+            "ALTER TABLE mainapp_association ALTER COLUMN in_graph DROP DEFAULT",
+        ),
+        migrations.RunPython(mark_counted_associations, restore_watermark),
+        migrations.RemoveField(
+            model_name='graph',
+            name='last_association_id',
+        ),
+        migrations.AddIndex(
+            model_name='association',
+            index=models.Index(condition=models.Q(('in_graph', False)), fields=['id'], name='association_graph_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('mainapp', '0014_association_in_graph'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='associationembedding',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            "UPDATE mainapp_associationembedding SET updated_at = created_at",
+            migrations.RunSQL.noop,
+        ),
+        # Значение по умолчанию и в самой БД: синтетический корпус пишет эмбеддинги через COPY
+        migrations.RunSQL(
+            "ALTER TABLE mainapp_associationembedding ALTER COLUMN updated_at SET DEFAULT now()",
+            "ALTER TABLE mainapp_associationembedding ALTER COLUMN updated_at DROP DEFAULT",
+        ),
+        migrations.AddIndex(
+            model_name='associationembedding',
+            index=models.Index(fields=['model', 'updated_at'], name='embedding_model_updated_idx'),
+        ),
+    ]
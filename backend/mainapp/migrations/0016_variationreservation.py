@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mainapp', '0015_associationembedding_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariationReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variation_id', models.BigIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variation_reservations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'expires_at'], name='reservation_user_expires_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='variationreservation',
+            constraint=models.UniqueConstraint(fields=('user', 'variation_id'), name='unique_user_variation_reservation'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, TextField, Value
+from django.db.models.functions import MD5, Coalesce, Concat
+
+
+def hash_current_content(apps, schema_editor):
+    # Существующие векторы считаются построенными по текущему тексту ассоциации
+    Association = apps.get_model('mainapp', 'Association')
+    AssociationEmbedding = apps.get_model('mainapp', 'AssociationEmbedding')
+    content_hash = Association.objects.filter(pk=OuterRef('association_id')).annotate(
+        content_hash=MD5(Concat(
+            Coalesce(F('reaction_description'), Value('')), Value('\x1f'),
+            Coalesce(F('reaction_lemmas'), Value('')), output_field=TextField(),
+        ))
+    ).values('content_hash')[:1]
+    AssociationEmbedding.objects.update(content_hash=Subquery(content_hash))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('mainapp', '0016_variationreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='associationembedding',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(hash_current_content, migrations.RunPython.noop),
+        # Значение по умолчанию и в самой БД: синтетический корпус пишет эмбеддинги через COPY
+        migrations.RunSQL(
+            "ALTER TABLE mainapp_associationembedding ALTER COLUMN content_hash SET DEFAULT ''",
+            "ALTER TABLE mainapp_associationembedding ALTER COLUMN content_hash DROP DEFAULT",
+        ),
+    ]
@@ -1,8 +1,8 @@
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.contrib.postgres.fields import ArrayField
 
 User = get_user_model()
 
@@ -12,19 +12,48 @@ class Administrator(models.Model):
 
 class Graph(models.Model):
     id = models.AutoField(primary_key=True)
-    cipher_count = models.IntegerField()
-    administrator = models.OneToOneField(Administrator, on_delete=models.CASCADE)
-    def __str__(self): return f'Graph with {self.cipher_count} ciphers'
+    name = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    cipher_count = models.IntegerField(default=0)
+    administrator = models.OneToOneField(Administrator, on_delete=models.CASCADE, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+    def __str__(self): return f'Graph {self.name or self.id} with {self.cipher_count} ciphers'
 
 class Node(models.Model):
+    class NodeType(models.TextChoices):
+        FONT = 'font', 'Шрифт'
+        LEMMA = 'lemma', 'Лемма'
+
     name = models.CharField(max_length=255)
     graph = models.ForeignKey(Graph, related_name="nodes", on_delete=models.CASCADE)
+    node_type = models.CharField(max_length=10, choices=NodeType.choices, default=NodeType.LEMMA)
+    ref_id = models.IntegerField(null=True, blank=True, help_text="ID шрифта для узлов типа font")
+    weight = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['graph', 'node_type', 'name'], name='unique_graph_node')
+        ]
+
     def __str__(self): return self.name
 
 class Edge(models.Model):
+    class ConnectionType(models.TextChoices):
+        FONT_LEMMA = 'font_lemma', 'Шрифт — лемма'
+        COOCCURRENCE = 'cooccurrence', 'Совместная встречаемость лемм'
+
     node1 = models.ForeignKey(Node, related_name="edges_from", on_delete=models.CASCADE)
     node2 = models.ForeignKey(Node, related_name="edges_to", on_delete=models.CASCADE)
     connection_type = models.CharField(max_length=255)
+    weight = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['node1', 'node2', 'connection_type'], name='unique_edge')
+        ]
+        indexes = [
+            models.Index(fields=['connection_type', '-weight'], name='edge_type_weight_idx'),
+        ]
+
     def __str__(self): return f'{self.node1} -> {self.node2}'
 
 class Reaction(models.Model):
@@ -64,13 +93,14 @@ class Association(models.Model):
     reaction_description = models.TextField(blank=True, null=True, db_index=True)
     reaction_lemmas = models.TextField(blank=True, null=True, db_index=True)
     grouping_key_lemmas = models.TextField(blank=True, null=True, db_index=True)
-    text_embedding_vector = ArrayField(models.FloatField(), size=384, blank=True, null=True)
     font_weight = models.IntegerField(choices=FontWeight.choices, default=FontWeight.REGULAR)
     font_style = models.CharField(max_length=10, choices=FontStyle.choices, default=FontStyle.NORMAL)
     letter_spacing = models.IntegerField(default=0)
     font_size = models.IntegerField(default=16)
     line_height = models.DecimalField(max_digits=3, decimal_places=1, default=1.5)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Учтена в весах материализованного графа Graph/Node/Edge (build_graph)
+    in_graph = models.BooleanField(default=False)
 
     class Meta:
         constraints = [
@@ -79,6 +109,12 @@ class Association(models.Model):
                 name='unique_user_font_variation_reaction'
             )
         ]
+        indexes = [
+            # Курсорная пагинация по (created_at, id); обратный порядок — тот же индекс в обратном направлении
+            models.Index(fields=['created_at', 'id'], name='association_created_id_idx'),
+            # Очередь build_graph: ещё не учтённые в графе ассоциации
+            models.Index(fields=['id'], condition=models.Q(in_graph=False), name='association_graph_pending_idx'),
+        ]
         ordering = ['-created_at']
 
     @property
@@ -96,6 +132,76 @@ class Association(models.Model):
         username = self.user.username if self.user else "Unknown user"
         return f"Assoc. by {username} for {self.variation_details}"
 
+class EmbeddingModel(models.Model):
+    """Реестр моделей, которыми строились эмбеддинги (имя SentenceTransformer и размерность)."""
+    name = models.CharField(max_length=255, unique=True)
+    dimension = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    def __str__(self): return f"{self.name} ({self.dimension}d)"
+
+class AssociationEmbedding(models.Model):
+    """Эмбеддинг реакции, построенный конкретной моделью; вектор хранится как float32/float16 bytea."""
+    association = models.ForeignKey(Association, on_delete=models.CASCADE, related_name='embeddings')
+    model = models.ForeignKey(EmbeddingModel, on_delete=models.CASCADE, related_name='association_embeddings')
+    vector = models.BinaryField()
+    # MD5 текста реакции и лемм, по которым построен вектор (embeddings.association_content_hash)
+    content_hash = models.CharField(max_length=32, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Время последней записи вектора: по нему индексы в памяти подхватывают перезаписанные векторы
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['association', 'model'], name='unique_association_embedding_model')
+        ]
+        indexes = [
+            models.Index(fields=['model', 'updated_at'], name='embedding_model_updated_idx'),
+        ]
+
+    def __str__(self): return f"Embedding of association {self.association_id} by {self.model_id}"
+
+class AssociationNeighbors(models.Model):
+    """Предвычисленные k ближайших по эмбеддингу ассоциаций (по убыванию косинусного сходства)."""
+    association = models.ForeignKey(Association, on_delete=models.CASCADE, related_name='neighbor_lists')
+    model = models.ForeignKey(EmbeddingModel, on_delete=models.CASCADE, related_name='neighbor_lists')
+    neighbor_ids = ArrayField(models.IntegerField(), default=list)
+    scores = ArrayField(models.FloatField(), default=list)
+    # Сходство последнего соседа: порог, выше которого новая ассоциация попадает в список
+    min_score = models.FloatField(default=-1.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['association', 'model'], name='unique_association_neighbors_model')
+        ]
+
+    def __str__(self): return f"Neighbors of association {self.association_id} ({len(self.neighbor_ids)})"
+
+class UserSeenVariations(models.Model):
+    """Битовая карта вариаций шрифтов, на которые пользователь уже ответил (см. variation_space)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='seen_variations')
+    bitmap = models.BinaryField(default=bytes)
+    # Сколько ассоциаций пользователя учтено; расхождение с фактическим числом — повод пересобрать карту
+    association_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    def __str__(self): return f"Seen variations of user {self.user_id}"
+
+class VariationReservation(models.Model):
+    """Вариация, выданная одной вкладке пользователя и закреплённая за ней до expires_at (см. variation_space)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='variation_reservations')
+    variation_id = models.BigIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'variation_id'], name='unique_user_variation_reservation')
+        ]
+        indexes = [
+            models.Index(fields=['user', 'expires_at'], name='reservation_user_expires_idx'),
+        ]
+
+    def __str__(self): return f"Variation {self.variation_id} reserved by user {self.user_id}"
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
 
@@ -139,4 +245,22 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
     else:
-        UserProfile.objects.get_or_create(user=instance)
\ No newline at end of file
+        UserProfile.objects.get_or_create(user=instance)
+
+@receiver(post_save, sender=Association)
+def update_reaction_graph(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        from .graph_builder import schedule_graph_update
+        schedule_graph_update()
+
+@receiver(post_save, sender=Association)
+def mark_variation_seen(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        from .variation_space import mark_seen
+        mark_seen(instance)
+
+@receiver(post_save, sender=Cipher)
+@receiver(post_delete, sender=Cipher)
+def invalidate_cipher_catalogue(sender, **kwargs):
+    from .cipher_catalogue import invalidate_cipher_catalogue as invalidate
+    invalidate()
@@ -0,0 +1,205 @@
+import logging
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+from django.utils import timezone
+
+from .vector_index import SemanticIndex, get_semantic_index
+
+logger = logging.getLogger('mainapp')
+
+DEFAULT_NEIGHBORS_K = 20
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def _merge_topk(best_scores: np.ndarray, best_rows: np.ndarray,
+                scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Построчно объединяет текущие top-k с новыми кандидатами (порядок внутри не важен).
+    """
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_rows = np.concatenate([best_rows, rows], axis=1)
+    if all_scores.shape[1] <= k:
+        return all_scores, all_rows
+    part = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(all_scores, part, axis=1), np.take_along_axis(all_rows, part, axis=1)
+
+
+def topk_neighbors(index: SemanticIndex, query_rows: np.ndarray, k: int,
+                   candidate_rows: Optional[np.ndarray] = None,
+                   block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Для строк индекса query_rows — k ближайших среди candidate_rows (по умолчанию все строки)
+    без самой строки. Матрица сходств считается плитками block_size x block_size, поэтому
+    память не зависит от размера индекса. Возвращает (строки, сходства) формы
+    (len(query_rows), k), отсортированные по убыванию; недобор заполняется -1 / -inf.
+    """
+    query_rows = np.asarray(query_rows, dtype=np.int64)
+    n_queries = len(query_rows)
+    out_rows = np.full((n_queries, k), -1, dtype=np.int64)
+    out_scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    if candidate_rows is None:
+        candidate_rows = np.arange(len(index), dtype=np.int64)
+    if not n_queries or not len(candidate_rows):
+        return out_rows, out_scores
+
+    for q_start in range(0, n_queries, block_size):
+        q_rows = query_rows[q_start:q_start + block_size]
+        queries = index.normalized_rows(q_rows)
+        best_scores = np.full((len(q_rows), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(q_rows), 0), dtype=np.int64)
+        for c_start in range(0, len(candidate_rows), block_size):
+            c_rows = candidate_rows[c_start:c_start + block_size]
+            scores = (queries @ np.asarray(index.matrix[c_rows], dtype=np.float32).T) * index.inv_norms[c_rows]
+            scores[q_rows[:, None] == c_rows[None, :]] = -np.inf
+            rows = np.broadcast_to(c_rows, scores.shape)
+            best_scores, best_rows = _merge_topk(best_scores, best_rows, scores, rows, k)
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        width = best_scores.shape[1]
+        out_scores[q_start:q_start + len(q_rows), :width] = best_scores
+        out_rows[q_start:q_start + len(q_rows), :width] = np.where(np.isfinite(best_scores), best_rows, -1)
+    return out_rows, out_scores
+
+
+def _neighbor_objects(index: SemanticIndex, query_rows, rows: np.ndarray, scores: np.ndarray, k: int):
+    from .models import AssociationNeighbors
+
+    objs = []
+    for query_row, row_list, score_list in zip(query_rows, rows, scores):
+        valid = row_list >= 0
+        neighbor_scores = [round(float(s), 6) for s in score_list[valid]]
+        objs.append(AssociationNeighbors(
+            association_id=int(index.ids[query_row]),
+            model=index.model,
+            neighbor_ids=[int(i) for i in index.ids[row_list[valid]]],
+            scores=neighbor_scores,
+            # Неполный список принимает любого нового соседа
+            min_score=neighbor_scores[-1] if len(neighbor_scores) >= k else -1.0,
+        ))
+    return objs
+
+
+def _save_neighbor_objects(objs, batch_size: int = 1000) -> None:
+    from .models import AssociationNeighbors
+
+    if objs:
+        AssociationNeighbors.objects.bulk_create(
+            objs, batch_size=batch_size, update_conflicts=True,
+            unique_fields=['association', 'model'], update_fields=['neighbor_ids', 'scores', 'min_score', 'updated_at']
+        )
+
+
+def _compute_and_save(index: SemanticIndex, query_rows: np.ndarray, k: int, block_size: int) -> int:
+    saved = 0
+    for start in range(0, len(query_rows), block_size):
+        batch = query_rows[start:start + block_size]
+        rows, scores = topk_neighbors(index, batch, k, block_size=block_size)
+        _save_neighbor_objects(_neighbor_objects(index, batch, rows, scores, k))
+        saved += len(batch)
+    return saved
+
+
+def rebuild_neighbors(k: int = DEFAULT_NEIGHBORS_K, block_size: int = DEFAULT_BLOCK_SIZE,
+                      index: Optional[SemanticIndex] = None) -> int:
+    """
+    Полный пересчёт списков соседей для всех векторов активной модели.
+    """
+    from .models import AssociationNeighbors
+
+    index = index or get_semantic_index()
+    started = time.monotonic()
+    saved = _compute_and_save(index, np.arange(len(index), dtype=np.int64), k, block_size)
+    AssociationNeighbors.objects.filter(model=index.model).exclude(association_id__in=index.ids.tolist()).delete()
+    logger.info(f"Соседи пересчитаны для {saved} ассоциаций (k={k}) за {time.monotonic() - started:.2f} с.")
+    return saved
+
+
+def update_neighbors(k: int = DEFAULT_NEIGHBORS_K, block_size: int = DEFAULT_BLOCK_SIZE,
+                     index: Optional[SemanticIndex] = None) -> dict:
+    """
+    Инкрементальное обновление: новым векторам считаются списки по всему индексу,
+    а существующие списки дополняются новыми векторами, если те сильнее текущего k-го соседа.
+    """
+    from .models import AssociationNeighbors
+
+    index = index or get_semantic_index()
+    started = time.monotonic()
+    existing = dict(
+        AssociationNeighbors.objects.filter(model=index.model).values_list('association_id', 'min_score')
+    )
+    has_list = np.fromiter((int(i) in existing for i in index.ids), dtype=bool, count=len(index))
+    new_rows = np.flatnonzero(~has_list)
+    old_rows = np.flatnonzero(has_list)
+    if not len(new_rows):
+        return {'new': 0, 'updated': 0}
+
+    created = _compute_and_save(index, new_rows, k, block_size)
+
+    # Старые списки: лучшие кандидаты среди новых векторов, отсекаем по сохранённому порогу.
+    updated = 0
+    if len(old_rows):
+        cand_rows, cand_scores = topk_neighbors(index, old_rows, k, candidate_rows=new_rows, block_size=block_size)
+        thresholds = np.fromiter((existing[int(i)] for i in index.ids[old_rows]), dtype=np.float32, count=len(old_rows))
+        touched = np.flatnonzero(cand_scores[:, 0] > thresholds)
+        for start in range(0, len(touched), block_size):
+            batch = touched[start:start + block_size]
+            batch_ids = [int(i) for i in index.ids[old_rows[batch]]]
+            current = {
+                obj.association_id: obj for obj in AssociationNeighbors.objects.filter(
+                    model=index.model, association_id__in=batch_ids
+                )
+            }
+            objs = []
+            for pos, assoc_id in zip(batch, batch_ids):
+                obj = current.get(assoc_id)
+                if obj is None:
+                    continue
+                merged = dict(zip(obj.neighbor_ids, obj.scores))
+                valid = cand_rows[pos] >= 0
+                for neighbor_id, score in zip(index.ids[cand_rows[pos][valid]], cand_scores[pos][valid]):
+                    merged[int(neighbor_id)] = round(float(score), 6)
+                top = sorted(merged.items(), key=lambda item: -item[1])[:k]
+                obj.neighbor_ids = [neighbor_id for neighbor_id, _ in top]
+                obj.scores = [score for _, score in top]
+                obj.min_score = obj.scores[-1] if len(top) >= k else -1.0
+                obj.updated_at = timezone.now()  # bulk_update не выставляет auto_now
+                objs.append(obj)
+            AssociationNeighbors.objects.bulk_update(objs, ['neighbor_ids', 'scores', 'min_score', 'updated_at'])
+            updated += len(objs)
+
+    logger.info(
+        f"Соседи обновлены: новых списков {created}, дополнено {updated} за {time.monotonic() - started:.2f} с."
+    )
+    return {'new': created, 'updated': updated}
+
+
+def get_neighbors(association_id: int, k: int = DEFAULT_NEIGHBORS_K):
+    """
+    [(association_id, score), ...] из таблицы соседей. При промахе (новая ассоциация ещё
+    не обработана джобой) или k больше сохранённого списка соседи считаются одним проходом
+    по индексу без сохранения: таблицу пишет только build_neighbors, иначе update_neighbors
+    принял бы такую ассоциацию за обработанную и не добавил её в списки остальных.
+    None — у ассоциации нет эмбеддинга.
+    """
+    from .models import AssociationNeighbors
+    from .embeddings import get_active_embedding_model
+
+    model = get_active_embedding_model()
+    stored = AssociationNeighbors.objects.filter(association_id=association_id, model=model).first()
+    if stored is not None and k <= len(stored.neighbor_ids):
+        return list(zip(stored.neighbor_ids, stored.scores))[:k]
+
+    index = get_semantic_index()
+    row = int(index.rows_for_ids([association_id])[0])
+    if row < 0:
+        return None
+    rows, scores = topk_neighbors(index, np.array([row]), k)
+    valid = rows[0] >= 0
+    return [
+        (int(neighbor_id), round(float(score), 6))
+        for neighbor_id, score in zip(index.ids[rows[0][valid]], scores[0][valid])
+    ]
@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger('mainapp')
+
+SPACY_MODEL_NAME = getattr(settings, 'SPACY_MODEL_NAME', 'ru_core_news_sm')
+SBERT_MODEL_NAME = getattr(settings, 'SBERT_MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+
+# Прогрев: короткий пакет, проходящий все этапы пайплайна (первые вызовы spaCy/torch заметно медленнее)
+WARMUP_TEXTS = (
+    "Строгий деловой шрифт, как в официальных документах",
+    "лёгкий и весёлый, напоминает детскую книжку",
+    "старая советская вывеска",
+    "холодный современный",
+)
+
+
+class _ModelSlot:
+    """
+    Модель процесса, загружаемая при первом обращении (или заранее через preload_models).
+    Загрузка выполняется один раз под блокировкой; ошибка запоминается, чтобы не повторять
+    долгую неудачную загрузку на каждом запросе.
+    """
+
+    def __init__(self, name: str, loader: Callable):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.error: Optional[Exception] = None
+        self.load_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.value is None and self.error is None:
+            with self._lock:
+                if self.value is None and self.error is None:
+                    started = time.monotonic()
+                    try:
+                        logger.info(f"Загрузка модели {self.name}...")
+                        self.value = self.loader()
+                        self.load_seconds = round(time.monotonic() - started, 3)
+                        logger.info(f"Модель {self.name} загружена за {self.load_seconds} с.")
+                    except Exception as e:
+                        self.error = e
+                        logger.error(f"Ошибка загрузки модели {self.name}: {e}")
+        return self.value
+
+    def status(self) -> dict:
+        return {
+            'loaded': self.value is not None,
+            'error': str(self.error) if self.error is not None else None,
+            'load_seconds': self.load_seconds,
+        }
+
+
+def _load_spacy():
+    import spacy
+
+    try:
+        return spacy.load(SPACY_MODEL_NAME)
+    except OSError:
+        # Модель ставится из requirements.txt; скачивание в рантайме — только если явно разрешено
+        if not getattr(settings, 'SPACY_AUTO_DOWNLOAD', False):
+            raise
+        logger.warning(f"Модель spaCy {SPACY_MODEL_NAME} не найдена, скачивание (SPACY_AUTO_DOWNLOAD)...")
+        spacy.cli.download(SPACY_MODEL_NAME)
+        return spacy.load(SPACY_MODEL_NAME)
+
+
+def _load_morph():
+    from pymorphy2 import MorphAnalyzer
+    return MorphAnalyzer()
+
+
+def _load_sentence_transformer():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(SBERT_MODEL_NAME)
+
+
+spacy_model = _ModelSlot(f"spaCy '{SPACY_MODEL_NAME}'", _load_spacy)
+morph_analyzer = _ModelSlot('pymorphy2 MorphAnalyzer', _load_morph)
+sentence_transformer = _ModelSlot(f"SentenceTransformer '{SBERT_MODEL_NAME}'", _load_sentence_transformer)
+MODEL_SLOTS = {'spacy': spacy_model, 'morph': morph_analyzer, 'sbert': sentence_transformer}
+
+
+def get_spacy_model():
+    return spacy_model.get()
+
+
+def get_morph_analyzer():
+    return morph_analyzer.get()
+
+
+def get_sentence_transformer():
+    """Загруженная модель SentenceTransformer или None, если загрузка не удалась."""
+    return sentence_transformer.get()
+
+
+_ruwordnet_local = threading.local()
+
+
+def get_ruwordnet():
+    """
+    RuWordNet работает через SQLite-сессию SQLAlchemy, которую нельзя делить между потоками
+    и переносить через fork, поэтому экземпляр свой у каждого потока и в мастере не создаётся.
+    """
+    instance = getattr(_ruwordnet_local, 'instance', None)
+    if instance is None:
+        try:
+            from ruwordnet import RuWordNet
+            instance = _ruwordnet_local.instance = RuWordNet()
+        except Exception as e:
+            logger.error(f"Ошибка создания экземпляра RuWordNet: {e}")
+    return instance
+
+
+# --- Жизненный цикл: загрузка в мастере gunicorn, прогрев в воркере, готовность ---
+
+def preload_models() -> dict:
+    """
+    Загружает spaCy, pymorphy2 и SBERT в текущем процессе. Вызывается в мастере gunicorn
+    при preload_app (см. gunicorn.conf.py): веса загружаются один раз и достаются воркерам
+    через fork без копирования, пока страницы не изменены.
+    """
+    started = time.monotonic()
+    for slot in MODEL_SLOTS.values():
+        slot.get()
+    logger.info(f"Предзагрузка моделей NLP завершена за {time.monotonic() - started:.2f} с.")
+    return {name: slot.status() for name, slot in MODEL_SLOTS.items()}
+
+
+_warm_state = {'warmed_at': None, 'warmup_seconds': None, 'error': None}
+_warm_lock = threading.Lock()
+
+
+def warm_up() -> dict:
+    """
+    Прогоняет WARMUP_TEXTS через весь NLP-пайплайн и пакетное кодирование SBERT, чтобы
+    первый пользовательский запрос не платил за ленивую инициализацию (загрузку весов,
+    первые аллокации torch, RuWordNet потока). Модели, не загруженные заранее, загружаются здесь.
+    """
+    from .embeddings import embed_texts
+    from .nlp_processor import AdvancedTextProcessorBuilder, NLPProcessingDirector
+
+    started = time.monotonic()
+    with _warm_lock:
+        try:
+            director = NLPProcessingDirector(builder=AdvancedTextProcessorBuilder())
+            for text in WARMUP_TEXTS:
+                director.construct_custom_analysis(text=text, group_syns=True, gen_text_emb=False)
+            embed_texts(list(WARMUP_TEXTS))
+            _warm_state.update(warmed_at=time.time(), warmup_seconds=round(time.monotonic() - started, 3), error=None)
+            logger.info(f"Прогрев моделей NLP завершён за {_warm_state['warmup_seconds']} с.")
+        except Exception as e:
+            _warm_state.update(error=str(e))
+            logger.error(f"Ошибка прогрева моделей NLP: {e}")
+    return dict(_warm_state)
+
+
+def readiness() -> dict:
+    """
+    ready — прогрев завершён и обязательные модели (spaCy, pymorphy2) загружены.
+    Без SBERT воркер обслуживает запросы без эмбеддингов, это отмечается как degraded.
+    """
+    models = {name: slot.status() for name, slot in MODEL_SLOTS.items()}
+    warm = _warm_state['warmed_at'] is not None
+    return {
+        'ready': warm and models['spacy']['loaded'] and models['morph']['loaded'],
+        'degraded': warm and not models['sbert']['loaded'],
+        'warm': warm,
+        'warmup_seconds': _warm_state['warmup_seconds'],
+        'warmup_error': _warm_state['error'],
+        'models': models,
+    }
@@ -3,37 +3,15 @@ import logging
 from dataclasses import dataclass, field, asdict
 from typing import List, Optional, Dict, Set, Any
 import numpy as np
-from .utils import load_spacy_model
-from pymorphy2 import MorphAnalyzer
-from ruwordnet import RuWordNet
-from sentence_transformers import SentenceTransformer
+from .metrics import metrics, stage_timer
+# Модели загружаются лениво или заранее (preload_models), но не при импорте модуля
+from .nlp_models import (
+    SBERT_MODEL_NAME, get_morph_analyzer, get_ruwordnet, get_sentence_transformer, get_spacy_model
+)
 
 # Используем только логгер mainapp
 logger = logging.getLogger('mainapp')
 
-SBERT_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
-
-_sentence_transformer_model = None
-_sentence_transformer_init_error = None
-
-def get_sentence_transformer() -> Optional[SentenceTransformer]:
-    """
-    Возвращает загруженную модель SentenceTransformer или None, если возникла ошибка.
-    """
-    global _sentence_transformer_model, _sentence_transformer_init_error
-    if _sentence_transformer_model is None and _sentence_transformer_init_error is None:
-        try:
-            logger.info(f"Загрузка модели SentenceTransformer: {SBERT_MODEL_NAME}...")
-            _sentence_transformer_model = SentenceTransformer(SBERT_MODEL_NAME)
-            logger.info(f"Модель SentenceTransformer '{SBERT_MODEL_NAME}' успешно загружена.")
-        except Exception as e:
-            _sentence_transformer_init_error = e
-            logger.error(f"Ошибка загрузки модели SentenceTransformer '{SBERT_MODEL_NAME}': {e}")
-            _sentence_transformer_model = None
-    if _sentence_transformer_init_error and _sentence_transformer_model is None:
-        pass
-    return _sentence_transformer_model
-
 @dataclass
 class NLPAnalysisResult:
     """
@@ -93,22 +71,14 @@ class AdvancedTextProcessorBuilder(ITextProcessorBuilder):
     Реализация builder для поэтапной обработки текста: spaCy, pymorphy2, RuWordNet, SBERT.
     """
     def __init__(self):
-        self._nlp_model = load_spacy_model()
-        self._morph = MorphAnalyzer()
+        # Модели общие для процесса: создание builder на каждый запрос ничего не загружает
+        self._nlp_model = get_spacy_model()
+        self._morph = get_morph_analyzer()
         self._sbert_model = get_sentence_transformer()
-        self._rwn_instance_local = None
         self.reset()
 
     def _get_rwn_local_instance(self):
-        if self._rwn_instance_local is None:
-            try:
-                logger.debug("Создание локального экземпляра RuWordNet...")
-                self._rwn_instance_local = RuWordNet()
-                logger.info("Локальный экземпляр RuWordNet успешно создан.")
-            except Exception as e:
-                logger.error(f"Ошибка создания локального экземпляра RuWordNet: {e}")
-                self._rwn_instance_local = None
-        return self._rwn_instance_local
+        return get_ruwordnet()
 
     def reset(self):
         self._original_text: Optional[str] = None
@@ -312,24 +282,26 @@ class NLPProcessingDirector:
             return NLPAnalysisResult(original_text=text or "", grouping_key="")
 
         self._builder.set_text(text)
+        metrics.inc('nlp_texts_total')
         
         doc_exists_after_preprocess = False
 
         if preprocess:
-            self._builder.preprocess_text()
+            with stage_timer('preprocess'):
+                self._builder.preprocess_text()
             doc_exists_after_preprocess = hasattr(self._builder, '_doc') and self._builder._doc is not None
         
         if tokenize_step:
-            if doc_exists_after_preprocess:
-                self._builder.tokenize()
-            elif preprocess and self._builder._result and self._builder._result.processed_text:
-                self._builder.tokenize()
+            if doc_exists_after_preprocess or (preprocess and self._builder._result and self._builder._result.processed_text):
+                with stage_timer('tokenize'):
+                    self._builder.tokenize()
             else:
                  logger.warning(f"Токенизация для '{text[:30]}...' не выполнена: spaCy Doc отсутствует или нет текста после preprocess.")
         
         if remove_stops:
             if doc_exists_after_preprocess:
-                self._builder.remove_stopwords()
+                with stage_timer('stopwords'):
+                    self._builder.remove_stopwords()
             else:
                  logger.warning(f"Удаление стоп-слов для '{text[:30]}...' не выполнено: spaCy Doc отсутствует.")
         
@@ -340,31 +312,41 @@ class NLPProcessingDirector:
             
             if needs_re_tokenize and not doc_exists_after_preprocess :
                  if preprocess and not doc_exists_after_preprocess:
-                     self._builder.preprocess_text()
+                     with stage_timer('preprocess'):
+                         self._builder.preprocess_text()
                      doc_exists_after_preprocess = hasattr(self._builder, '_doc') and self._builder._doc is not None
                  if tokenize_step and (doc_exists_after_preprocess or (self._builder._result and self._builder._result.processed_text)):
-                     self._builder.tokenize()
-            self._builder.lemmatize()
+                     with stage_timer('tokenize'):
+                         self._builder.tokenize()
+            with stage_timer('lemmatize'):
+                self._builder.lemmatize()
 
         if group_syns:
             lemmas_exist = self._builder._result and self._builder._result.lemmas and len(self._builder._result.lemmas) > 0
             if not lemmas_exist and lemmatize_step:
                 if not (self._builder._result and self._builder._result.tokens):
-                    if tokenize_step: self._builder.tokenize()
-                self._builder.lemmatize()
+                    if tokenize_step:
+                        with stage_timer('tokenize'):
+                            self._builder.tokenize()
+                with stage_timer('lemmatize'):
+                    self._builder.lemmatize()
                 lemmas_exist = self._builder._result and self._builder._result.lemmas and len(self._builder._result.lemmas) > 0
 
             if lemmas_exist:
-                self._builder.group_synonyms()
+                with stage_timer('synonyms'):
+                    self._builder.group_synonyms()
             else:
                  logger.warning(f"Группировка синонимов для '{text[:30]}...' невозможна: леммы отсутствуют.")
         
         if gen_text_emb:
-            self._builder.generate_text_embedding()
+            with stage_timer('embed'):
+                self._builder.generate_text_embedding()
         
         if gen_token_embs:
             self._builder.generate_token_embeddings()
             
         self._builder.set_grouping_key(grouping_strategy)
         
-        return self._builder.get_result()
\ No newline at end of file
+        result = self._builder.get_result()
+        metrics.inc('nlp_tokens_total', len(result.tokens))
+        return result
\ No newline at end of file
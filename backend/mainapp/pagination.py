@@ -0,0 +1,103 @@
+import base64
+import json
+import logging
+from typing import Optional, Tuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+logger = logging.getLogger('mainapp')
+
+# Порядок выдачи ассоциаций; его поддерживает индекс association_created_id_idx
+KEYSET_ORDERING = ('-created_at', '-id')
+
+
+def estimate_count(queryset) -> Optional[int]:
+    """
+    Оценка числа строк выборки по статистике планировщика (EXPLAIN), без COUNT(*).
+    None, если СУБД не отдаёт план в JSON.
+    """
+    try:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.debug(f"Не удалось оценить число строк по плану запроса: {e}")
+        return None
+
+
+def encode_cursor(created_at, pk: int) -> str:
+    raw = f"{created_at.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[object, int]:
+    """(created_at, id) из курсора; ValueError, если курсор повреждён."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        parsed = parse_datetime(created_at)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Некорректный курсор.") from e
+    if parsed is None:
+        raise ValueError("Некорректный курсор.")
+    return parsed, pk
+
+
+def after_cursor(queryset, cursor: str):
+    """
+    Строки строго после курсора в порядке KEYSET_ORDERING. Условие created_at <= X
+    дублирует OR-ветку, чтобы сканирование индекса начиналось с позиции курсора,
+    а не с начала: глубокие страницы стоят столько же, сколько первая.
+    """
+    created_at, pk = decode_cursor(cursor)
+    return queryset.filter(created_at__lte=created_at).filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+    )
+
+
+class AssociationKeysetPagination(BasePagination):
+    """
+    Курсорная пагинация ассоциаций по (created_at, id) без OFFSET и COUNT(*).
+    Ответ: next (ссылка с курсором), estimated_count (оценка планировщика), results.
+    """
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 20
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.estimated_count = estimate_count(queryset)
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                queryset = after_cursor(queryset, cursor)
+            except ValueError as e:
+                raise NotFound(str(e))
+        rows = list(queryset.order_by(*KEYSET_ORDERING)[:page_size + 1])
+        self.next_cursor = encode_cursor(rows[page_size - 1].created_at, rows[page_size - 1].pk) if len(rows) > page_size else None
+        return rows[:page_size]
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'estimated_count': self.estimated_count,
+            'results': data,
+        })
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .embeddings import encode_embedding, decode_embedding
+from .metrics import metrics
+from .nlp_processor import AdvancedTextProcessorBuilder, NLPProcessingDirector, SBERT_MODEL_NAME, get_sentence_transformer
+
+logger = logging.getLogger('mainapp')
+
+
+@dataclass(frozen=True)
+class CachedQueryAnalysis:
+    """
+    То, что нужно поиску от NLP-анализа запроса: ключ группировки (леммы) и эмбеддинг.
+    """
+    grouping_key: str
+    embedding: Optional[np.ndarray]
+
+
+class QueryEmbeddingCache:
+    """
+    Ограниченный LRU-кэш с TTL: нормализованный запрос + параметры NLP -> (ключ лемм, эмбеддинг).
+    Общий для процесса; при shared=True промахи дополнительно ищутся в кэше Django,
+    чтобы результат, посчитанный одним воркером, видели остальные.
+    """
+
+    def __init__(self, max_size: int = 2048, ttl: float = 3600.0, shared: bool = False, cache_alias: str = 'default'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self.cache_alias = cache_alias
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    @classmethod
+    def make_key(cls, text: str, nlp_params: dict, model_name: str) -> str:
+        params = ",".join(f"{name}={nlp_params[name]}" for name in sorted(nlp_params))
+        raw = f"{model_name}|{params}|{cls.normalize(text)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedQueryAnalysis]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.inc('query_cache_lookups_total', result='hit')
+                    return value
+                del self._entries[key]
+
+        if self.shared:
+            payload = caches[self.cache_alias].get(f"query_emb:{key}")
+            if payload is not None:
+                value = CachedQueryAnalysis(
+                    grouping_key=payload['grouping_key'],
+                    embedding=decode_embedding(payload['embedding'], dim=payload['dim']),
+                )
+                self._store_local(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                metrics.inc('query_cache_lookups_total', result='shared_hit')
+                return value
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc('query_cache_lookups_total', result='miss')
+        return None
+
+    def set(self, key: str, value: CachedQueryAnalysis) -> None:
+        self._store_local(key, value)
+        if self.shared:
+            caches[self.cache_alias].set(
+                f"query_emb:{key}",
+                {
+                    'grouping_key': value.grouping_key,
+                    'embedding': encode_embedding(value.embedding),
+                    'dim': int(value.embedding.shape[0]),
+                },
+                timeout=int(self.ttl),
+            )
+
+    def get_or_compute(self, text: str, nlp_params: dict, model_name: str,
+                       compute: Callable[[], CachedQueryAnalysis]) -> CachedQueryAnalysis:
+        key = self.make_key(text, nlp_params, model_name)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            # Неудачный анализ (нет эмбеддинга) не кэшируем, чтобы не закрепить ошибку загрузки модели.
+            if value.embedding is not None:
+                self.set(key, value)
+        return value
+
+    def _store_local(self, key: str, value: CachedQueryAnalysis) -> None:
+        if value.embedding is not None:
+            value.embedding.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'shared': self.shared,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache_settings = getattr(settings, 'QUERY_EMBEDDING_CACHE', {})
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=_cache_settings.get('MAX_SIZE', 2048),
+    ttl=_cache_settings.get('TTL', 3600),
+    shared=_cache_settings.get('SHARED', False),
+    cache_alias=_cache_settings.get('CACHE_ALIAS', 'default'),
+)
+
+
+def search_nlp_params(preprocess: bool = True, remove_stops: bool = True, lemmatize_step: bool = True) -> dict:
+    """Параметры анализа поискового запроса для семантического поиска (леммы и эмбеддинг)."""
+    return {
+        "preprocess": preprocess,
+        "tokenize_step": True,
+        "remove_stops": remove_stops,
+        "lemmatize_step": lemmatize_step,
+        "group_syns": False,
+        "grouping_strategy": "lemmas",
+        "gen_text_emb": True,
+    }
+
+
+def analyze_search_query(text: str, nlp_params: dict) -> CachedQueryAnalysis:
+    if not get_sentence_transformer():
+        return CachedQueryAnalysis(grouping_key="", embedding=None)
+    director = NLPProcessingDirector(builder=AdvancedTextProcessorBuilder())
+    analysis = director.construct_custom_analysis(text=text, **nlp_params)
+    return CachedQueryAnalysis(grouping_key=analysis.grouping_key or "", embedding=analysis.text_embedding)
+
+
+def cached_search_analysis(text: str, nlp_params: dict) -> CachedQueryAnalysis:
+    """Анализ поискового запроса через query_embedding_cache (так же его наполняет warm_caches)."""
+    return query_embedding_cache.get_or_compute(
+        text, nlp_params, SBERT_MODEL_NAME, lambda: analyze_search_query(text, nlp_params)
+    )
@@ -0,0 +1,148 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import metrics
+
+logger = logging.getLogger('mainapp')
+
+_IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACES = re.compile(r'\s+')
+# Не чаще одного предупреждения о N+1 на пару (маршрут, отпечаток) за этот интервал, секунды
+WARNING_INTERVAL = 300.0
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Отпечаток запроса без значений: параметры и так приходят отдельно (%s), а литералы,
+    встроенные в текст (LIMIT 21, execute_values), и списки IN (%s, %s, ...) сворачиваются.
+    """
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+class QueryCollector:
+    """Обёртка connection.execute_wrapper: число запросов, время в БД и повторы по отпечатку."""
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[sql] += 1
+
+    def duplicates(self, threshold: int) -> Dict[str, int]:
+        """Отпечатки, повторённые за запрос не меньше threshold раз (кандидаты в N+1)."""
+        by_fingerprint = Counter()
+        for sql, count in self.fingerprints.items():
+            by_fingerprint[fingerprint(sql)] += count
+        return {fp: count for fp, count in by_fingerprint.items() if count >= threshold}
+
+
+class _RouteStats:
+    __slots__ = ('samples', 'requests', 'n_plus_one', 'duplicates')
+
+    def __init__(self, window: int):
+        # (время запроса, время в БД, число SQL-запросов) последних window замеров
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.n_plus_one = 0
+        self.duplicates = Counter()
+
+
+class QueryProfiler:
+    """
+    Скользящая статистика SQL по маршрутам для выборки запросов (QUERY_PROFILING['SAMPLE_RATE']).
+    Повтор одного запроса не меньше N_PLUS_ONE_THRESHOLD раз за запрос считается
+    признаком N+1 и пишется в лог.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[Tuple[str, str], _RouteStats] = {}
+        self._warned_at: Dict[Tuple[str, str], float] = {}
+
+    @staticmethod
+    def config() -> dict:
+        return getattr(settings, 'QUERY_PROFILING', {})
+
+    def should_sample(self) -> bool:
+        rate = self.config().get('SAMPLE_RATE', 0.0)
+        return rate > 0 and (rate >= 1 or random.random() < rate)
+
+    def record(self, route: str, method: str, wall_time: float, collector: QueryCollector) -> Dict[str, int]:
+        config = self.config()
+        duplicates = collector.duplicates(config.get('N_PLUS_ONE_THRESHOLD', 10))
+        key = (route, method)
+        now = time.monotonic()
+        to_warn = []
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = _RouteStats(config.get('WINDOW', 500))
+            stats.samples.append((wall_time, collector.db_time, collector.count))
+            stats.requests += 1
+            if duplicates:
+                stats.n_plus_one += 1
+            for fp, count in duplicates.items():
+                stats.duplicates[fp] = max(stats.duplicates[fp], count)
+                if now - self._warned_at.get((route, fp), -WARNING_INTERVAL) >= WARNING_INTERVAL:
+                    self._warned_at[(route, fp)] = now
+                    to_warn.append((fp, count))
+
+        metrics.inc('db_queries_total', collector.count, route=route)
+        metrics.observe('db_request_seconds', collector.db_time, route=route)
+        if duplicates:
+            metrics.inc('n_plus_one_requests_total', route=route)
+        for fp, count in to_warn:
+            logger.warning(f"Возможный N+1 в {method} {route}: запрос повторён {count} раз за запрос: {fp[:300]}")
+        return duplicates
+
+    def stats(self) -> list:
+        with self._lock:
+            snapshot = [(key, list(stats.samples), stats.requests, stats.n_plus_one, stats.duplicates.most_common(5))
+                        for key, stats in self._routes.items()]
+        rows = []
+        for (route, method), samples, requests, n_plus_one, duplicates in snapshot:
+            wall, db, queries = (np.array(column, dtype=np.float64) for column in zip(*samples))
+            rows.append({
+                'route': route,
+                'method': method,
+                'sampled_requests': requests,
+                'window': len(samples),
+                'wall_p50_ms': round(float(np.percentile(wall, 50)) * 1000, 2),
+                'wall_p95_ms': round(float(np.percentile(wall, 95)) * 1000, 2),
+                'db_mean_ms': round(float(db.mean()) * 1000, 2),
+                'queries_mean': round(float(queries.mean()), 2),
+                'queries_max': int(queries.max()),
+                'n_plus_one_requests': n_plus_one,
+                'top_duplicates': [{'fingerprint': fp, 'max_repeats': count} for fp, count in duplicates],
+            })
+        rows.sort(key=lambda row: row['queries_mean'], reverse=True)
+        return rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+            self._warned_at.clear()
+
+
+query_profiler = QueryProfiler()
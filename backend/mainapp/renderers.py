@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # без orjson — прежняя сериализация через json
+    orjson = None
+
+
+_ORJSON_OPTIONS = (
+    orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z if orjson is not None else 0
+)
+
+
+def fast_json_enabled() -> bool:
+    return orjson is not None and getattr(settings, 'FAST_JSON_ENABLED', True)
+
+
+def _orjson_default(obj):
+    # Массивы, которые orjson не пишет сам: float16 из хранилища эмбеддингов и срезы не подряд в памяти
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == np.float16:
+            return obj.astype(np.float32)
+        if not obj.flags['C_CONTIGUOUS']:
+            return np.ascontiguousarray(obj)
+    # Decimal, ленивые строки, прочие массивы и скаляры NumPy (.tolist()) — как в DRF
+    return JSONEncoder().default(obj)
+
+
+def dumps(data) -> bytes:
+    """JSON в UTF-8: orjson (ndarray пишутся напрямую, без .tolist()), иначе json."""
+    if fast_json_enabled():
+        return orjson.dumps(data, default=_orjson_default, option=_ORJSON_OPTIONS)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Рендерер для больших ответов (FAST_JSON_ENABLED): orjson с нативной сериализацией NumPy.
+    Ответ всегда компактный — отступы запрошенные клиентом (Accept: ...; indent=N) игнорируются.
+    Без orjson (или с FAST_JSON_ENABLED=0) работает как обычный JSONRenderer: его кодировщик
+    тоже понимает ndarray, но через .tolist().
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not fast_json_enabled():
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class FastJsonResponse(HttpResponse):
+    """JsonResponse (safe=False) через dumps — для представлений на django.views.View."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+def is_large_response(response) -> bool:
+    """Ответ больших представлений (FastJSONRenderer или FastJsonResponse) — только такие сжимает CompressionMiddleware."""
+    return isinstance(response, FastJsonResponse) or isinstance(getattr(response, 'accepted_renderer', None), FastJSONRenderer)
@@ -0,0 +1,244 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('mainapp')
+
+SESSION_KEY = 'profiling_session'
+PROFILE_MODES = ('sample', 'cprofile')
+ALL_ROUTES = '*'
+MAX_REQUESTS = 1000
+MAX_SECONDS = 3600
+# Не чаще, чем раз в столько секунд, воркер перечитывает из кэша, включено ли профилирование
+STATE_CHECK_INTERVAL = 1.0
+_SESSION_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+@dataclass
+class ProfilingSession:
+    id: str
+    route: str
+    mode: str
+    requests: int
+    until: float
+    interval: float
+    started_at: float
+
+    def matches(self, route: str) -> bool:
+        return time.time() < self.until and self.route in (ALL_ROUTES, route)
+
+    @property
+    def directory(self) -> Path:
+        return profiles_dir() / self.id
+
+
+def profiles_dir() -> Path:
+    return Path(getattr(settings, 'PROFILING_DIR', Path(tempfile.gettempdir()) / 'profiles'))
+
+
+def _remaining_key(session_id: str) -> str:
+    return f"profiling_remaining:{session_id}"
+
+
+# --- Включение и выключение (состояние в кэше Django, общее для воркеров при общем бэкенде) ---
+
+def start_session(route: str = ALL_ROUTES, mode: str = 'sample', requests: int = 100, seconds: int = 300,
+                  interval_ms: float = 5.0) -> ProfilingSession:
+    """
+    Профилирует следующие requests запросов к маршруту route (имя из urls.py, '*' — любой),
+    но не дольше seconds секунд. mode='sample' — сэмплирование стека потока запроса каждые
+    interval_ms мс (collapsed stacks для flamegraph), 'cprofile' — детерминированный cProfile.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Неизвестный режим профилирования '{mode}'.")
+    if not 1 <= requests <= MAX_REQUESTS or not 1 <= seconds <= MAX_SECONDS:
+        raise ValueError(f"requests должно быть от 1 до {MAX_REQUESTS}, seconds — от 1 до {MAX_SECONDS}.")
+    if not 1.0 <= interval_ms <= 1000.0:
+        raise ValueError("interval_ms должно быть от 1 до 1000.")
+
+    now = time.time()
+    session = ProfilingSession(
+        id=uuid.uuid4().hex, route=route or ALL_ROUTES, mode=mode, requests=requests,
+        until=now + seconds, interval=interval_ms / 1000.0, started_at=now,
+    )
+    session.directory.mkdir(parents=True, exist_ok=True)
+    (session.directory / 'session.json').write_text(json.dumps(asdict(session), ensure_ascii=False), encoding='utf-8')
+    cache.set(_remaining_key(session.id), requests, timeout=seconds + 60)
+    cache.set(SESSION_KEY, asdict(session), timeout=seconds)
+    logger.warning(f"Профилирование {session.id} включено: маршрут {session.route}, {mode}, {requests} запросов / {seconds} с.")
+    return session
+
+
+def stop_session() -> Optional[str]:
+    """Останавливает текущую сессию (в других воркерах — не позже STATE_CHECK_INTERVAL); её id или None."""
+    global _checked_at
+    payload = cache.get(SESSION_KEY)
+    cache.delete(SESSION_KEY)
+    _checked_at = 0.0
+    if not payload:
+        return None
+    cache.delete(_remaining_key(payload['id']))
+    return payload['id']
+
+
+_session: Optional[ProfilingSession] = None
+_checked_at = 0.0
+
+
+def active_session() -> Optional[ProfilingSession]:
+    """Текущая сессия профилирования; кэш Django опрашивается не чаще STATE_CHECK_INTERVAL."""
+    global _session, _checked_at
+    now = time.monotonic()
+    if now - _checked_at >= STATE_CHECK_INTERVAL:
+        payload = cache.get(SESSION_KEY)
+        _session = ProfilingSession(**payload) if payload else None
+        _checked_at = now
+    session = _session
+    return session if session is not None and time.time() < session.until else None
+
+
+def claim_request(session: ProfilingSession) -> bool:
+    """Забирает один запрос из бюджета сессии; False — бюджет исчерпан."""
+    try:
+        remaining = cache.decr(_remaining_key(session.id))
+    except ValueError:
+        return False  # ключ истёк или сессия остановлена
+    if remaining <= 0:
+        cache.delete(SESSION_KEY)
+    return remaining >= 0
+
+
+# --- Сэмплирование стека ---
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    for prefix in (str(settings.BASE_DIR) + os.sep, 'site-packages' + os.sep):
+        position = filename.find(prefix)
+        if position >= 0:
+            filename = filename[position + len(prefix):]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, root: Optional[str] = None) -> str:
+    """Стек от корня к листу через ';' — строка формата collapsed stacks (flamegraph.pl, speedscope)."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    if root:
+        names.append(root)
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """Раз в interval секунд снимает стек потока thread_id через sys._current_frames()."""
+
+    def __init__(self, thread_id: int, interval: float, root: Optional[str] = None):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame, self.root)] += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+_write_lock = threading.Lock()
+
+
+def profile_call(session: ProfilingSession, label: str, call: Callable):
+    """Выполняет call() под профилировщиком сессии и дописывает результат в её каталог."""
+    session.directory.mkdir(parents=True, exist_ok=True)
+    if session.mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return call()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(session.directory / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.prof")
+
+    sampler = StackSampler(threading.get_ident(), session.interval, root=label)
+    sampler.start()
+    try:
+        return call()
+    finally:
+        stacks = sampler.stop()
+        if stacks:
+            # Один файл на процесс: строки collapsed stacks складываются при слиянии
+            with _write_lock, open(session.directory / f"{os.getpid()}.folded", 'a', encoding='utf-8') as handle:
+                handle.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+
+
+# --- Результаты ---
+
+def list_sessions() -> List[dict]:
+    sessions = []
+    directory = profiles_dir()
+    if not directory.exists():
+        return sessions
+    for meta_path in directory.glob('*/session.json'):
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        files = [path for path in meta_path.parent.iterdir() if path.suffix in ('.folded', '.prof')]
+        meta.update({'files': len(files), 'bytes': sum(path.stat().st_size for path in files)})
+        sessions.append(meta)
+    sessions.sort(key=lambda meta: meta['started_at'], reverse=True)
+    return sessions
+
+
+def merged_profile(session_id: str) -> Optional[Tuple[bytes, str, str]]:
+    """
+    (содержимое, имя файла, content-type) результатов сессии со всех воркеров:
+    суммированные collapsed stacks (.folded) или объединённая статистика cProfile (.prof).
+    None — сессии нет или данных ещё нет.
+    """
+    if not _SESSION_ID.match(session_id or ''):
+        return None
+    directory = profiles_dir() / session_id
+    folded = sorted(directory.glob('*.folded'))
+    if folded:
+        totals = Counter()
+        for path in folded:
+            for line in path.read_text(encoding='utf-8').splitlines():
+                stack, _, count = line.rpartition(' ')
+                if stack and count.isdigit():
+                    totals[stack] += int(count)
+        content = ''.join(f"{stack} {count}\n" for stack, count in totals.most_common())
+        return content.encode('utf-8'), f"{session_id}.folded", 'text/plain; charset=utf-8'
+
+    profiles = sorted(directory.glob('*.prof'))
+    if profiles:
+        stats = pstats.Stats(str(profiles[0]))
+        for path in profiles[1:]:
+            stats.add(str(path))
+        with tempfile.NamedTemporaryFile(suffix='.prof') as handle:
+            stats.dump_stats(handle.name)
+            return Path(handle.name).read_bytes(), f"{session_id}.prof", 'application/octet-stream'
+    return None
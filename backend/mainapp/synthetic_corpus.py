@@ -0,0 +1,348 @@
+import csv
+import io
+import logging
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+
+from .variation_space import VARIATIONS_PER_CIPHER, SeenBitmap, decode_variation
+
+logger = logging.getLogger('mainapp')
+
+LEMMA_MODES = ('none', 'dictionary', 'nlp')
+EMBEDDING_MODES = ('none', 'random', 'real')
+
+# Слова реакций: (словоформа, лемма). Порядок задаёт ранг в распределении Ципфа
+WORDS = (
+    ('строгий', 'строгий'), ('лёгкий', 'лёгкий'), ('старый', 'старый'), ('современный', 'современный'),
+    ('официальный', 'официальный'), ('весёлый', 'весёлый'), ('тяжёлый', 'тяжёлый'), ('элегантный', 'элегантный'),
+    ('детский', 'детский'), ('деловой', 'деловой'), ('холодная', 'холодный'), ('тёплый', 'тёплый'),
+    ('грустный', 'грустный'), ('классика', 'классика'), ('мягкий', 'мягкий'), ('спокойное', 'спокойный'),
+    ('резкий', 'резкий'), ('газета', 'газета'), ('книги', 'книга'), ('реклама', 'реклама'),
+    ('компьютерный', 'компьютерный'), ('документы', 'документ'), ('праздник', 'праздник'), ('надёжный', 'надёжный'),
+    ('скучный', 'скучный'), ('дорогой', 'дорогой'), ('дешёвый', 'дешёвый'), ('игривый', 'игривый'),
+    ('техническая', 'технический'), ('романтичный', 'романтичный'), ('агрессивный', 'агрессивный'),
+    ('нейтральный', 'нейтральный'), ('читаемый', 'читаемый'), ('узкий', 'узкий'), ('широкие', 'широкий'),
+    ('круглый', 'круглый'), ('острые', 'острый'), ('печатная', 'печатный'), ('рукописный', 'рукописный'),
+    ('модный', 'модный'), ('простой', 'простой'), ('сложный', 'сложный'), ('школа', 'школа'),
+    ('письмо', 'письмо'), ('вывеска', 'вывеска'), ('плакат', 'плакат'), ('меню', 'меню'),
+    ('уютный', 'уютный'), ('тревожный', 'тревожный'), ('торжественный', 'торжественный'),
+    ('военный', 'военный'), ('научный', 'научный'), ('сказочный', 'сказочный'), ('футуристичный', 'футуристичный'),
+)
+# Повторяющиеся устойчивые фразы: (текст, леммы без стоп-слов)
+PHRASES = (
+    ('как в газете', 'газета'),
+    ('как на печатной машинке', 'печатный машинка'),
+    ('напоминает школьные прописи', 'напоминать школьный пропись'),
+    ('старая советская вывеска', 'старый советский вывеска'),
+    ('шрифт из документов', 'шрифт документ'),
+    ('как в детской книжке', 'детский книжка'),
+    ('похоже на рекламу', 'похожий реклама'),
+    ('как на экране компьютера', 'экран компьютер'),
+    ('свадебное приглашение', 'свадебный приглашение'),
+    ('ничего особенного', 'особенный'),
+)
+# Доля реакций с устойчивой фразой и показатель степени распределения Ципфа
+PHRASE_SHARE = 0.3
+ZIPF_EXPONENT = 1.1
+
+SPECIALTIES = ('Студент', 'Инженер', 'Психолог', 'Дизайнер', 'Учитель', 'Программист', 'Филолог', 'Врач', 'Менеджер')
+SYNTHETIC_CIPHER_PREFIX = 'Synthetic Font '
+# Даты ассоциаций отсчитываются от фиксированной точки: одинаковый seed даёт одинаковые данные
+CORPUS_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _zipf_weights(count: int, exponent: float = ZIPF_EXPONENT) -> np.ndarray:
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_reactions(count: int, rng: np.random.Generator) -> List[Tuple[str, str]]:
+    """
+    count пар (текст реакции, строка лемм): 1-3 слова по Ципфу, у части реакций — устойчивая
+    фраза. Леммы берутся из словаря, а не из NLP-пайплайна.
+    """
+    word_ids = rng.choice(len(WORDS), size=(count, 3), p=_zipf_weights(len(WORDS)))
+    lengths = rng.integers(1, 4, size=count)
+    phrase_ids = np.where(
+        rng.random(count) < PHRASE_SHARE,
+        rng.choice(len(PHRASES), size=count, p=_zipf_weights(len(PHRASES))), -1,
+    )
+    reactions = []
+    for row, length, phrase in zip(word_ids, lengths, phrase_ids):
+        chosen = [WORDS[i] for i in row[:length]]
+        if phrase >= 0:
+            chosen.append(PHRASES[phrase])
+        reactions.append((", ".join(form for form, _ in chosen).capitalize(), " ".join(lemma for _, lemma in chosen)))
+    return reactions
+
+
+def _lemma_vectors(rng: np.random.Generator, dim: int) -> dict:
+    lemmas = sorted({word for _, lemmas in WORDS + PHRASES for word in lemmas.split()})
+    vectors = rng.standard_normal((len(lemmas), dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return dict(zip(lemmas, vectors))
+
+
+def reaction_texts(count: int, seed: int) -> List[str]:
+    """Только тексты реакций generate_reactions — входные данные для замеров NLP."""
+    return [text for text, _ in generate_reactions(count, np.random.default_rng(seed))]
+
+
+def query_vector(lemmas: str, seed: int, dim: int) -> np.ndarray:
+    """Вектор запроса в пространстве эмбеддингов корпуса с embeddings='random' и тем же seed."""
+    lemma_vectors = _lemma_vectors(np.random.default_rng(seed), dim)
+    vector = np.sum([lemma_vectors[word] for word in lemmas.split()], axis=0)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def _copy_rows(cursor, table: str, columns: Tuple[str, ...], rows) -> None:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+class SyntheticCorpusGenerator:
+    """
+    Синтетический корпус для нагрузочных замеров: пользователи с профилями, шрифты,
+    ассоциации по всей сетке вариаций (у каждого пользователя — уникальные вариации,
+    активность пользователей распределена по Ципфу), карты просмотренных вариаций
+    и, по желанию, леммы и эмбеддинги. Ассоциации и эмбеддинги пишутся через COPY
+    пачками по chunk_size; всё определяется seed.
+    """
+
+    ASSOCIATION_COLUMNS = (
+        'id', 'user_id', 'cipher_id', 'reaction_description', 'reaction_lemmas', 'grouping_key_lemmas',
+        'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height', 'created_at',
+    )
+
+    def __init__(self, size: int, users: int = 0, ciphers: int = 50, seed: int = 42, user_prefix: str = 'synth_user_',
+                 lemmas: str = 'dictionary', embeddings: str = 'none', days: int = 365, chunk_size: int = 10000,
+                 log=None):
+        if lemmas not in LEMMA_MODES:
+            raise ValueError(f"Неизвестный режим лемм '{lemmas}'.")
+        if embeddings not in EMBEDDING_MODES:
+            raise ValueError(f"Неизвестный режим эмбеддингов '{embeddings}'.")
+        self.size = size
+        self.users = users or max(1, size // 40)
+        self.ciphers = ciphers
+        self.seed = seed
+        self.user_prefix = user_prefix
+        self.lemmas = lemmas
+        self.embeddings = embeddings
+        self.days = days
+        self.chunk_size = chunk_size
+        self.log = log or logger.info
+        self.rng = np.random.default_rng(seed)
+        self._lemma_vectors = None
+        if self.size > self.users * self.ciphers * VARIATIONS_PER_CIPHER:
+            raise ValueError(
+                f"{self.size} ассоциаций не помещаются в {self.users} x {self.ciphers} x {VARIATIONS_PER_CIPHER} "
+                "уникальных вариаций: увеличьте число пользователей или шрифтов."
+            )
+
+    # --- Очистка ---
+
+    def clear(self) -> int:
+        """Удаляет пользователей с префиксом user_prefix вместе с их ассоциациями."""
+        from .models import Association, AssociationEmbedding, AssociationNeighbors
+
+        User = get_user_model()
+        users = User.objects.filter(username__startswith=self.user_prefix)
+        with transaction.atomic():
+            # Сначала зависимые таблицы: удаление без каскадного сбора объектов в память
+            AssociationNeighbors.objects.filter(association__user__in=users).delete()
+            AssociationEmbedding.objects.filter(association__user__in=users).delete()
+            Association.objects.filter(user__in=users).delete()
+            _, deleted = users.delete()
+        return deleted.get(User._meta.label, 0)
+
+    # --- Шрифты и пользователи ---
+
+    def _create_ciphers(self) -> List[int]:
+        from .cipher_catalogue import invalidate_cipher_catalogue
+        from .models import Cipher
+
+        names = [f"{SYNTHETIC_CIPHER_PREFIX}{i:04d}" for i in range(self.ciphers)]
+        Cipher.objects.bulk_create([Cipher(result=name) for name in names], ignore_conflicts=True)
+        invalidate_cipher_catalogue()  # bulk_create не шлёт сигналы
+        ids = dict(Cipher.objects.filter(result__in=names).values_list('result', 'id'))
+        return [ids[name] for name in names]
+
+    def _create_users(self) -> List[int]:
+        from .models import UserProfile
+
+        User = get_user_model()
+        if User.objects.filter(username__startswith=self.user_prefix).exists():
+            raise ValueError(
+                f"Пользователи с префиксом '{self.user_prefix}' уже есть: запустите с --clear или другим --user-prefix."
+            )
+        password = make_password(None)
+        joined = [CORPUS_EPOCH + timedelta(days=float(day)) for day in self.rng.uniform(0, self.days, self.users)]
+        User.objects.bulk_create([
+            User(username=f"{self.user_prefix}{i}", email=f"{self.user_prefix}{i}@example.com",
+                 password=password, date_joined=joined[i])
+            for i in range(self.users)
+        ], batch_size=self.chunk_size)
+        user_ids = list(
+            User.objects.filter(username__startswith=self.user_prefix).order_by('id').values_list('id', flat=True)
+        )
+
+        # bulk_create не шлёт post_save, профили создаются явно с правдоподобной демографией
+        genders = [None] + [value for value, _ in UserProfile.Gender.choices]
+        educations = [None] + [value for value, _ in UserProfile.EducationLevel.choices]
+        gender_ids = self.rng.choice(len(genders), len(user_ids), p=[0.1, 0.4, 0.42, 0.03, 0.05])
+        education_ids = self.rng.choice(len(educations), len(user_ids), p=_zipf_weights(len(educations), 0.5))
+        ages = np.clip(self.rng.normal(27, 9, len(user_ids)), 16, 80).astype(int)
+        no_age = self.rng.random(len(user_ids)) < 0.1
+        specialties = self.rng.choice(len(SPECIALTIES) + 1, len(user_ids), p=_zipf_weights(len(SPECIALTIES) + 1, 0.8))
+        UserProfile.objects.bulk_create([
+            UserProfile(
+                user_id=user_id, gender=genders[gender_ids[i]], education_level=educations[education_ids[i]],
+                age=None if no_age[i] else int(ages[i]),
+                specialty=SPECIALTIES[specialties[i] - 1] if specialties[i] else None,
+            )
+            for i, user_id in enumerate(user_ids)
+        ], batch_size=self.chunk_size)
+        return user_ids
+
+    def _associations_per_user(self) -> np.ndarray:
+        """Активность по Ципфу: немногие пользователи дают большую часть ответов."""
+        capacity = self.ciphers * VARIATIONS_PER_CIPHER
+        counts = np.ones(self.users, dtype=np.int64) if self.size >= self.users else np.zeros(self.users, dtype=np.int64)
+        weights = self.rng.permutation(_zipf_weights(self.users, 0.8))
+        counts += self.rng.multinomial(self.size - counts.sum(), weights)
+        # Излишек сверх числа вариаций переносится на пользователей с запасом
+        excess = int((counts - capacity).clip(min=0).sum())
+        counts = counts.clip(max=capacity)
+        while excess:
+            room = capacity - counts
+            added = np.minimum(self.rng.multinomial(excess, room / room.sum()), room)
+            counts += added
+            excess -= int(added.sum())
+        return counts
+
+    # --- Ассоциации ---
+
+    def _allocate_ids(self, cursor, count: int) -> List[int]:
+        from .models import Association
+
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [Association._meta.db_table, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _analyze(self, reactions: List[Tuple[str, str]]) -> List[Tuple[Optional[str], Optional[str]]]:
+        if self.lemmas == 'none':
+            return [(None, None)] * len(reactions)
+        if self.lemmas == 'nlp':
+            from .bulk_import import analyze_reaction
+            return [analyze_reaction(text) for text, _ in reactions]
+        # Ключ группировки стратегии 'lemmas' — отсортированные уникальные леммы (NLPAnalysisResult.get_lemmas_as_string)
+        return [(lemmas, " ".join(sorted(set(lemmas.split())))) for _, lemmas in reactions]
+
+    def _vectors(self, reactions, analyses, dim: int) -> Optional[np.ndarray]:
+        if self.embeddings == 'random':
+            # Эмбеддинг — сумма векторов лемм с шумом: похожие реакции близки по косинусу
+            vectors = np.stack([
+                np.sum([self._lemma_vectors[word] for word in lemmas.split()], axis=0) for _, lemmas in reactions
+            ])
+            vectors += 0.05 * self.rng.standard_normal(vectors.shape).astype(np.float32)
+            return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        from .embeddings import embed_texts
+        # Эмбеддинг строится по строке лемм, как в StudyView; без лемм — по тексту реакции
+        return embed_texts([lemmas or text for (text, _), (lemmas, _) in zip(reactions, analyses)])
+
+    def _write_chunk(self, user_ids: List[int], counts: np.ndarray, cipher_ids: List[int],
+                     created_at: np.ndarray, model) -> int:
+        from .embeddings import association_content_hash, encode_embedding
+        from .models import Association, AssociationEmbedding, UserSeenVariations
+
+        total = int(counts.sum())
+        if not total:
+            return 0
+        reactions = generate_reactions(total, self.rng)
+        analyses = self._analyze(reactions)
+        capacity = len(cipher_ids) * VARIATIONS_PER_CIPHER
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Ответы пользователей перемешаны во времени; id растут вместе с created_at
+            order = self.rng.permutation(total)
+            row_ids = np.empty(total, dtype=np.int64)
+            row_ids[order] = self._allocate_ids(cursor, total)
+            row_created = np.empty(total, dtype=object)
+            row_created[order] = created_at
+
+            rows, seen, pos = [], [], 0
+            for user_id, count in zip(user_ids, counts):
+                bitmap = SeenBitmap()
+                for slot in self.rng.choice(capacity, size=int(count), replace=False):
+                    cipher_pos, offset = divmod(int(slot), VARIATIONS_PER_CIPHER)
+                    _, weight, style, spacing, font_size, line_height = decode_variation(offset)
+                    bitmap.add(cipher_ids[cipher_pos] * VARIATIONS_PER_CIPHER + offset)
+                    (text, _), (lemmas, grouping_key) = reactions[pos], analyses[pos]
+                    rows.append((
+                        int(row_ids[pos]), user_id, cipher_ids[cipher_pos], text, lemmas, grouping_key,
+                        weight, style, spacing, font_size, line_height, row_created[pos].isoformat(),
+                    ))
+                    pos += 1
+                seen.append(UserSeenVariations(user_id=user_id, bitmap=bitmap.to_bytes(), association_count=int(count)))
+            rows = [rows[i] for i in order]
+            _copy_rows(cursor, Association._meta.db_table, self.ASSOCIATION_COLUMNS, rows)
+            UserSeenVariations.objects.bulk_create(seen, update_conflicts=True, unique_fields=['user'],
+                                                   update_fields=['bitmap', 'association_count'])
+
+            if model is not None:
+                vectors = self._vectors(reactions, analyses, model.dimension)
+                if vectors is not None:
+                    now = datetime.now(dt_timezone.utc).isoformat()
+                    columns = ('association_id', 'model_id', 'vector', 'content_hash', 'created_at')
+                    _copy_rows(cursor, AssociationEmbedding._meta.db_table, columns, (
+                        (assoc_id, model.id, '\\x' + encode_embedding(vector).hex(), association_content_hash(text, lemmas), now)
+                        for assoc_id, vector, (text, _), (lemmas, _) in zip(row_ids.tolist(), vectors, reactions, analyses)
+                    ))
+        return total
+
+    def generate(self) -> dict:
+        from .embeddings import embed_texts, get_active_embedding_model
+
+        started = time.monotonic()
+        cipher_ids = self._create_ciphers()
+        user_ids = self._create_users()
+        counts = self._associations_per_user()
+        model = None
+        if self.embeddings != 'none':
+            model = get_active_embedding_model()
+            if self.embeddings == 'real' and embed_texts(['проверка']) is None:
+                raise ValueError("Модель SentenceTransformer не загружена: используйте --embeddings random.")
+            self._lemma_vectors = _lemma_vectors(np.random.default_rng(self.seed), model.dimension)
+        self.log(f"Шрифтов: {len(cipher_ids)}, пользователей: {len(user_ids)}, ассоциаций: {self.size}.")
+
+        # Общая шкала времени корпуса: пачки идут подряд, created_at растёт от пачки к пачке
+        seconds = np.sort(self.rng.uniform(0, self.days * 86400, int(counts.sum())))
+        cumulative = np.cumsum(counts)
+        written, start = 0, 0
+        while start < len(user_ids):
+            # Пачка — пользователи, в сумме дающие около chunk_size ассоциаций
+            base = int(cumulative[start - 1]) if start else 0
+            end = max(start + 1, int(np.searchsorted(cumulative, base + self.chunk_size, side='right')))
+            created_at = [CORPUS_EPOCH + timedelta(seconds=float(value)) for value in seconds[base:int(cumulative[end - 1])]]
+            written += self._write_chunk(user_ids[start:end], counts[start:end], cipher_ids, created_at, model)
+            start = end
+            rate = written / max(time.monotonic() - started, 1e-9)
+            self.log(f"Записано ассоциаций: {written} из {self.size} ({rate:.0f} строк/с)")
+
+        with connection.cursor() as cursor:
+            from .models import Association
+            cursor.execute(f"ANALYZE {Association._meta.db_table}")
+        return {
+            'ciphers': len(cipher_ids), 'users': len(user_ids), 'associations': written,
+            'seconds': round(time.monotonic() - started, 2),
+        }
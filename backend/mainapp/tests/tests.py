@@ -1,14 +1,58 @@
 # mainapp/tests.py
 
+import asyncio
+import gzip
 import json
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch, call
 
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.http import HttpResponse
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 
-from .models import Study, Cipher, Association, Administrator, UserProfile
+from .models import Study, Cipher, Association, Administrator, UserProfile, Node, EmbeddingModel
+import numpy as np
+from mainapp.embeddings import (
+    encode_embedding, decode_embedding, stack_embeddings, association_content_hash, save_association_embedding,
+    bulk_save_association_embeddings, stale_associations, export_embedding_matrix, load_embedding_matrix,
+)
+from mainapp.query_cache import QueryEmbeddingCache, CachedQueryAnalysis
+from mainapp.vector_index import SemanticIndex, extend_index
+from mainapp.neighbors import topk_neighbors
+from mainapp.font_similarity import FontProfiles, variation_key, decode_variation_key
+from mainapp import lemma_stats
+from mainapp.lemma_stats import LemmaContingency, get_contingency
+from mainapp.graph_builder import _count_chunk, get_graph, live_graph_data, update_graph
+from mainapp.variation_space import (
+    SeenBitmap, variation_id, decode_variation, pick_unseen_variations, VARY_FLAGS,
+    get_reserved, reserve_variations, release_variations, VARIATIONS_PER_CIPHER
+)
+from mainapp.dataset_export import _chunk_columns, export_dataset, last_watermark, MISSING_AGE
+from mainapp.bulk_import import iter_csv_rows, read_header
+from mainapp.benchmarks.harness import CaseResult, compare_with_baseline
+from mainapp.synthetic_corpus import SyntheticCorpusGenerator, generate_reactions, query_vector, _lemma_vectors
+from mainapp.metrics import MetricsRegistry, stage_timer, start_request_timings, finish_request_timings, server_timing_header
+from mainapp.query_profiler import QueryCollector, fingerprint
+from mainapp.sampling_profiler import start_session, stop_session, active_session, claim_request, profile_call, merged_profile
+from mainapp.nlp_models import _ModelSlot
+from mainapp import cache_warmup
+from mainapp.inference_pool import EndpointBusy, run_in_pool
+from mainapp.admission import AdmissionRejected, EndpointGate, ReleasingIterator
+from mainapp.renderers import FastJSONRenderer, FastJsonResponse, dumps
+from mainapp.middleware import CompressionMiddleware, negotiate_encoding
+from mainapp.pagination import encode_cursor, decode_cursor
+from mainapp.cipher_catalogue import get_cipher_catalogue, resolve_cipher, attach_ciphers, invalidate_cipher_catalogue
 
 User = get_user_model()
 
@@ -306,6 +350,28 @@ class StudyViewTests(APITestCase):
         mock_get_lemmas.assert_has_calls(expected_calls, any_order=False)
 
 
+
+@patch('mainapp.views.NLPProcessingDirector')
+@patch('mainapp.views.AdvancedTextProcessorBuilder')
+class StudySaveErrorTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('study_error_user', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.cipher = Cipher.objects.create(result="Study Error Cipher")
+        self.item = {"cipher_id": self.cipher.id, "reaction_description": "реакция", "font_size": 20}
+
+    def test_non_numeric_cipher_id_is_not_found(self, mock_builder, mock_director):
+        response = self.client.post(reverse('study-save'), [dict(self.item, cipher_id="abc")], format='json')
+        self.assertEqual(response.data['errors'][0]['error'], "Базовый шрифт с ID abc не найден")
+        mock_director.assert_not_called()
+
+    def test_nlp_value_error_is_an_internal_error(self, mock_builder, mock_director):
+        mock_director.return_value.construct_custom_analysis.side_effect = ValueError("bad text")
+        response = self.client.post(reverse('study-save'), [self.item], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0]['error'], "Внутренняя ошибка сервера при сохранении")
+        self.assertEqual(response.data['errors'][0]['details'], "bad text")
+
 class GraphViewTests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -375,6 +441,24 @@ class GraphViewTests(APITestCase):
         data = json.loads(response.content)
         self.assertEqual(len(data), 0)
 
+    def test_live_graph_is_cached_until_associations_change(self):
+        cache.clear()
+        with patch('mainapp.graph_builder.live_graph_data', wraps=live_graph_data) as compute:
+            first = json.loads(self.client.get(self.graph_url).content)
+            second = json.loads(self.client.get(self.graph_url).content)
+            self.assertEqual(first, second)
+            self.assertEqual(compute.call_count, 1)
+
+            Association.objects.create(
+                user=self.user2, cipher=self.cipher_times, reaction_description="Sad", reaction_lemmas="sad",
+                font_weight=FONT_WEIGHT_VALUES[0], font_style=FONT_STYLE_VALUES[0],
+                letter_spacing=LETTER_SPACING_VALUES[0], font_size=FONT_SIZE_VALUES[0], line_height=LINE_HEIGHT_VALUES[0]
+            )
+            data = json.loads(self.client.get(self.graph_url).content)
+            self.assertEqual(compute.call_count, 2)
+            times_sad_item = next(item for item in data if item['name'] == "G_Times" and item['description'] == "Sad")
+            self.assertEqual(times_sad_item['count'], 2)
+
 
 @patch('mainapp.views.get_lemmas')
 class AssociationSearchViewTests(APITestCase):
@@ -507,4 +591,950 @@ class AssociationSearchViewTests(APITestCase):
         search_data = {"reaction_description": "несуществующий текст"}
         response = self.client.post(self.search_url, search_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data['error'], "Ассоциации не найдены.")
\ No newline at end of file
+        self.assertEqual(response.data['error'], "Ассоциации не найдены.")
+
+
+class EmbeddingCodecTests(SimpleTestCase):
+    def setUp(self):
+        self.vector = np.linspace(-1, 1, 8, dtype=np.float32)
+
+    def test_float32_round_trip_without_copy(self):
+        buffer = encode_embedding(self.vector)
+        self.assertEqual(len(buffer), 8 * 4)
+        decoded = decode_embedding(buffer, dim=8)
+        self.assertEqual(decoded.dtype, np.dtype('<f4'))
+        self.assertFalse(decoded.flags.writeable)
+        np.testing.assert_array_equal(decoded, self.vector)
+
+    @override_settings(EMBEDDING_STORAGE_DTYPE='float16')
+    def test_float16_storage_is_half_size(self):
+        buffer = encode_embedding(self.vector.tolist())
+        self.assertEqual(len(buffer), 8 * 2)
+        decoded = decode_embedding(buffer, dim=8)
+        self.assertEqual(decoded.dtype, np.dtype('<f2'))
+        np.testing.assert_allclose(decoded, self.vector, atol=1e-3)
+        self.assertEqual(stack_embeddings([buffer, encode_embedding(-self.vector)], dim=8).dtype, np.float32)
+
+    def test_buffer_size_must_match_dimension(self):
+        with self.assertRaises(ValueError):
+            decode_embedding(encode_embedding(self.vector), dim=7)
+        with self.assertRaises(ValueError):
+            decode_embedding(b'\x00' * 8 * 3, dim=8)
+        self.assertIsNone(decode_embedding(b'', dim=8))
+        with self.assertRaises(ValueError):
+            encode_embedding(np.zeros((2, 4)))
+
+
+class EmbeddingStoreTests(TestCase):
+    def setUp(self):
+        self.model = EmbeddingModel.objects.create(name='test-embedding-model', dimension=4)
+        user = User.objects.create_user('embedding_user', password='testpassword')
+        cipher = Cipher.objects.create(result="Embedding Cipher")
+        self.first, self.second, self.empty = (
+            Association.objects.create(user=user, cipher=cipher, reaction_description=text, reaction_lemmas=text, font_size=size)
+            for text, size in (("яркий шрифт", 12), ("строгий", 16), ("", 20))
+        )
+
+    def _content_hash(self, association):
+        return association_content_hash(association.reaction_description, association.reaction_lemmas)
+
+    def test_stale_associations_follow_text_changes(self):
+        save_association_embedding(self.first.id, np.ones(4), self._content_hash(self.first), model=self.model)
+        self.assertEqual(set(stale_associations(self.model).values_list('id', flat=True)), {self.second.id})
+        self.first.reaction_lemmas = "яркий"
+        self.first.save(update_fields=['reaction_lemmas'])
+        self.assertEqual(set(stale_associations(self.model).values_list('id', flat=True)), {self.first.id, self.second.id})
+
+    def test_export_is_loaded_through_mmap(self):
+        vectors = np.arange(8, dtype=np.float32).reshape(2, 4)
+        bulk_save_association_embeddings(
+            [(a.id, v, self._content_hash(a)) for a, v in zip((self.second, self.first), vectors[::-1])], model=self.model
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            meta = export_embedding_matrix(self.model, directory=directory)
+            ids, matrix, loaded_meta = load_embedding_matrix(self.model.name, directory=directory)
+            self.assertEqual(meta['count'], 2)
+            self.assertEqual(loaded_meta['max_association_id'], self.second.id)
+            self.assertIsInstance(matrix, np.memmap)
+            self.assertEqual(ids.tolist(), [self.first.id, self.second.id])
+            np.testing.assert_array_equal(matrix, vectors)
+            del ids, matrix
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def _value(self, key_text):
+        return CachedQueryAnalysis(grouping_key=key_text, embedding=np.ones(4, dtype=np.float32))
+
+    def test_repeated_query_is_served_from_cache(self):
+        cache = QueryEmbeddingCache(max_size=10, ttl=60)
+        computed = []
+        def compute():
+            computed.append(1)
+            return self._value("весёлый")
+        cache.get_or_compute("Весёлый ", {"lemmatize_step": True}, "m", compute)
+        cache.get_or_compute("весёлый", {"lemmatize_step": True}, "m", compute)
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryEmbeddingCache(max_size=2, ttl=60)
+        cache.set("a", self._value("a")); cache.set("b", self._value("b"))
+        cache.get("a")
+        cache.set("c", self._value("c"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_expired_entry_is_a_miss(self):
+        cache = QueryEmbeddingCache(max_size=2, ttl=-1)
+        cache.set("a", self._value("a"))
+        self.assertIsNone(cache.get("a"))
+
+    def test_failed_analysis_is_not_cached(self):
+        cache = QueryEmbeddingCache(max_size=2, ttl=60)
+        cache.get_or_compute("x", {}, "m", lambda: CachedQueryAnalysis(grouping_key="", embedding=None))
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class SemanticIndexFilterTests(SimpleTestCase):
+    def setUp(self):
+        matrix = np.array([[1, 0], [0.9, 0.1], [0, 1], [0.8, 0.2]], dtype=np.float32)
+        attributes = {
+            'cipher_id': np.array([1, 2, 1, 1]),
+            'font_weight': np.array([400, 700, 700, 700]),
+            'font_style': np.array([0, 1, 1, 1]),
+            'letter_spacing': np.zeros(4, dtype=np.int64),
+            'font_size': np.full(4, 16),
+            'line_height': np.full(4, 15),
+            'user_id': np.array([10, 11, 12, 13]),
+        }
+        created_at = np.array([100, 200, 300, 400])
+        self.index = SemanticIndex(
+            model=None, ids=np.array([101, 102, 103, 104]), matrix=matrix, attributes=attributes,
+            created_at=created_at, style_codes={'normal': 0, 'italic': 1}, max_embedding_id=4
+        )
+
+    def test_search_without_filters_ranks_by_cosine(self):
+        rows, scores = self.index.search(np.array([1, 0]), k=2)
+        self.assertEqual(self.index.ids[rows].tolist(), [101, 102])
+
+    def test_filters_are_applied_before_top_k(self):
+        rows, _ = self.index.search(np.array([1, 0]), k=1, filters={'cipher_id': [1], 'font_weight': 700, 'font_style': 'italic'})
+        self.assertEqual(self.index.ids[rows].tolist(), [104])
+
+    def test_created_range_and_min_score(self):
+        rows, _ = self.index.search(np.array([1, 0]), k=4, filters={'created_from': 150, 'created_to': 350}, min_score=0.5)
+        self.assertEqual(self.index.ids[rows].tolist(), [102])
+
+    def test_unknown_value_gives_empty_result(self):
+        rows, _ = self.index.search(np.array([1, 0]), k=4, filters={'font_style': 'oblique'})
+        self.assertEqual(len(rows), 0)
+
+    def test_extend_replaces_rewritten_vectors_and_appends_new(self):
+        tail = (
+            np.array([[0, 1], [1, 1]], dtype=np.float32),
+            [(102, 2, 700, 'italic', 0, 16, 1.5, 11, 200), (105, 1, 400, 'normal', 0, 16, 1.5, 14, 500)],
+            5, 1000.0,
+        )
+        with patch('mainapp.vector_index._fetch_embeddings', return_value=tail):
+            extended = extend_index(self.index)
+        self.assertEqual(extended.ids.tolist(), [101, 102, 103, 104, 105])
+        self.assertEqual(extended.matrix[1].tolist(), [0, 1])
+        np.testing.assert_allclose(self.index.matrix[1], [0.9, 0.1])
+        self.assertEqual((extended.max_embedding_id, extended.max_updated_at), (5, 1000.0))
+
+    def test_count_like_counts_whole_variation_not_candidates(self):
+        self.assertEqual(self.index.count_like(0, ('cipher_id',)), 3)
+        self.assertEqual(self.index.count_like(3, ('cipher_id', 'font_weight', 'font_style')), 2)
+        scope = self.index.build_mask({'created_to': 300})
+        self.assertEqual(self.index.count_like(3, ('cipher_id', 'font_weight'), scope), 1)
+
+    def test_refresh_runs_outside_index_lock(self):
+        from mainapp import vector_index
+
+        def refresh(index, model):
+            # Пока идёт догрузка, другие потоки должны получать текущий индекс без ожидания
+            self.assertFalse(vector_index._index_lock.locked())
+            self.assertIs(vector_index.get_semantic_index(), self.index)
+            return extended
+
+        extended = SemanticIndex(
+            model=self.index.model, ids=np.array([101]), matrix=np.ones((1, 2), dtype=np.float32),
+            attributes={name: np.zeros(1, dtype=np.int64) for name in self.index.attributes},
+            created_at=np.zeros(1, dtype=np.int64), style_codes={}, max_embedding_id=5
+        )
+        self.index.model = SimpleNamespace(id=1)
+        with patch.object(vector_index, '_index', self.index), patch.object(vector_index, '_last_check', 0.0), \
+                patch('mainapp.vector_index.get_active_embedding_model', return_value=self.index.model), \
+                patch('mainapp.vector_index._refreshed', side_effect=refresh):
+            self.assertIs(vector_index.get_semantic_index(), extended)
+            self.assertIs(vector_index._index, extended)
+
+
+class TopkNeighborsTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(size=(50, 8)).astype(np.float32)
+        attributes = {name: np.zeros(50, dtype=np.int64) for name in (
+            'cipher_id', 'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height', 'user_id')}
+        self.index = SemanticIndex(
+            model=None, ids=np.arange(1000, 1050), matrix=matrix, attributes=attributes,
+            created_at=np.zeros(50, dtype=np.int64), style_codes={}, max_embedding_id=50
+        )
+        normalized = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.similarity = normalized @ normalized.T
+        np.fill_diagonal(self.similarity, -np.inf)
+
+    def test_blocked_topk_matches_brute_force(self):
+        rows, scores = topk_neighbors(self.index, np.arange(50), k=5, block_size=7)
+        expected = np.argsort(-self.similarity, axis=1)[:, :5]
+        self.assertEqual(rows.tolist(), expected.tolist())
+        np.testing.assert_allclose(scores, np.take_along_axis(self.similarity, expected, axis=1), rtol=1e-5)
+
+    def test_candidate_subset_excludes_self_and_pads(self):
+        rows, scores = topk_neighbors(self.index, np.array([3]), k=4, candidate_rows=np.array([3, 10, 20]))
+        self.assertEqual(sorted(rows[0][:2].tolist()), [10, 20])
+        self.assertEqual(rows[0][2:].tolist(), [-1, -1])
+        self.assertTrue(np.isinf(scores[0][2:]).all())
+
+
+class FontProfilesTests(SimpleTestCase):
+    def setUp(self):
+        self.profiles = FontProfiles('test-model', 2)
+        self.profiles.add_embeddings(
+            np.array([1, 1, 2]),
+            np.array([variation_key(1, 400, 'normal', 0, 16, 1.5)] * 2 + [variation_key(2, 400, 'italic', 0, 16, 1.5)]),
+            np.array([[1, 0], [1, 0.2], [0, 1]], dtype=np.float32),
+        )
+
+    def test_incremental_batches_extend_cipher_rows(self):
+        self.profiles.add_embeddings(
+            np.array([3]), np.array([variation_key(3, 400, 'normal', 0, 16, 1.5)]), np.array([[0.9, 0.1]], dtype=np.float32)
+        )
+        self.assertEqual(self.profiles.cipher_ids.tolist(), [1, 2, 3])
+        self.assertEqual(self.profiles.cipher_counts.tolist(), [2, 1, 1])
+        self.assertEqual([cipher_id for cipher_id, _ in self.profiles.top_k_ciphers(1, k=2)], [3, 2])
+
+    def test_distribution_similarity_from_reaction_counts(self):
+        self.profiles.add_reactions(np.array([1, 2, 2]), ['весёлый', 'строгий', 'весёлый'])
+        matrix = self.profiles.similarity_matrix('distribution')
+        self.assertAlmostEqual(matrix[0, 0], 1.0)
+        self.assertAlmostEqual(matrix[0, 1], np.sqrt(0.5))
+
+    def test_save_replaces_file_without_leftovers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'model.fonts.npz'
+            self.profiles.save(path)
+            self.profiles.save(path)
+            self.assertEqual([p.name for p in Path(directory).iterdir()], ['model.fonts.npz'])
+            self.assertEqual(FontProfiles.load(path).cipher_counts.tolist(), [2, 1])
+
+    def test_decode_variation_key(self):
+        key = variation_key(2, 700, 'italic', 10, 16, 1.5)
+        self.assertEqual(decode_variation_key(key), {
+            'cipher_id': 2, 'font_weight': 700, 'font_style': 'italic',
+            'letter_spacing': 10, 'font_size': 16, 'line_height': 1.5,
+        })
+
+
+class LemmaContingencyTests(SimpleTestCase):
+    def setUp(self):
+        self.table = LemmaContingency()
+        self.table.add_rows([
+            (1, 1, 400, 'normal', 0, 16, 1.5, 'весёлый яркий'),
+            (2, 1, 400, 'normal', 0, 16, 1.5, 'весёлый'),
+            (3, 2, 700, 'italic', 0, 16, 1.5, 'строгий строгий'),
+        ])
+
+    def test_incremental_rows_extend_matrix(self):
+        self.table.add_rows([(4, 2, 700, 'italic', 0, 16, 1.5, 'строгий яркий'), (5, 1, 400, 'normal', 0, 16, 1.5, None)])
+        self.assertEqual(self.table.version, (5, 5, 4))
+        self.assertEqual(self.table.cipher_counts.shape, (2, 3))
+        self.assertEqual(self.table.cipher_counts.sum(), 6)
+
+    def test_pmi_lift_and_chi2(self):
+        self.table.add_rows([(4, 2, 700, 'italic', 0, 16, 1.5, 'строгий яркий')])
+        top = self.table.top_lemmas(self.table.cipher_rows[1], metric='pmi', k=1, min_count=1)
+        self.assertEqual(top, [{'lemma': 'весёлый', 'count': 2, 'pmi': 1.0, 'lift': 2.0, 'chi2': 3.0}])
+
+
+
+@override_settings(LEMMA_STATS_CHECK_INTERVAL=0)
+class LemmaContingencyRefreshTests(TestCase):
+    def setUp(self):
+        lemma_stats._table = None
+        self.addCleanup(setattr, lemma_stats, '_table', None)
+        self.user = User.objects.create_user('lemma_stats_user', password='testpassword')
+        self.cipher = Cipher.objects.create(result="Lemma Stats Cipher")
+
+    def test_lemmas_backfilled_into_counted_rows_rebuild_table(self):
+        # import_sas без --nlp: строка учтена пустой, леммы позже пишет fill_nlp_cache
+        Association.objects.create(user=self.user, cipher=self.cipher, reaction_lemmas='строгий', font_size=12)
+        backfilled = Association.objects.create(user=self.user, cipher=self.cipher, reaction_lemmas='', font_size=16)
+        self.assertEqual(get_contingency().cipher_counts.sum(), 1)
+        backfilled.reaction_lemmas = 'строгий яркий'
+        backfilled.save(update_fields=['reaction_lemmas'])
+        table = get_contingency()
+        self.assertEqual(table.version, (backfilled.id, 2, 2))
+        self.assertEqual(table.cipher_counts.sum(), 3)
+
+class GraphChunkCountTests(SimpleTestCase):
+    def test_font_lemma_and_cooccurrence_weights(self):
+        node_weights, node_refs, edge_weights = _count_chunk([
+            (1, 7, 'Georgia', 'строгий яркий'),
+            (2, 7, 'Georgia', 'яркий строгий строгий'),
+            (3, 8, 'Arial', ''),
+        ])
+        self.assertEqual(node_weights[('font', 'Georgia')], 2)
+        self.assertEqual(node_weights[('lemma', 'строгий')], 2)
+        self.assertNotIn(('font', 'Arial'), node_weights)
+        self.assertEqual(node_refs[('font', 'Georgia')], 7)
+        self.assertEqual(edge_weights[('font', 'Georgia', 'lemma', 'яркий', 'font_lemma')], 2)
+        self.assertEqual(edge_weights[('lemma', 'строгий', 'lemma', 'яркий', 'cooccurrence')], 2)
+
+
+class GraphUpdateTests(TestCase):
+    def setUp(self):
+        self.graph = get_graph()
+        user = User.objects.create_user('graph_update_user', password='testpassword')
+        cipher = Cipher.objects.create(result="Graph Update Cipher")
+        self.first = Association.objects.create(user=user, cipher=cipher, reaction_lemmas='строгий', font_size=12)
+        self.second = Association.objects.create(user=user, cipher=cipher, reaction_lemmas='строгий', font_size=16)
+
+    def test_row_committed_out_of_id_order_is_counted(self):
+        # Ассоциация с большим id уже учтена, с меньшим — закоммичена позже
+        update_graph()
+        Association.objects.filter(pk=self.first.pk).update(in_graph=False)
+        Node.objects.filter(graph=self.graph).update(weight=1)
+        self.assertEqual(update_graph()['associations'], 1)
+        self.assertFalse(Association.objects.filter(in_graph=False).exists())
+        self.assertEqual(Node.objects.get(graph=self.graph, node_type='lemma', name='строгий').weight, 2)
+
+    def test_lemmas_backfilled_after_build_are_counted(self):
+        # import_sas без --nlp: лемм ещё нет, их позже заполняет fill_nlp_cache
+        backfilled = Association.objects.create(user=self.first.user, cipher=self.first.cipher, reaction_lemmas='', font_size=20)
+        self.assertEqual(update_graph()['associations'], 2)
+        backfilled.refresh_from_db()
+        self.assertFalse(backfilled.in_graph)
+        backfilled.reaction_lemmas = 'строгий яркий'
+        backfilled.save(update_fields=['reaction_lemmas'])
+        self.assertEqual(update_graph()['associations'], 1)
+        self.assertEqual(Node.objects.get(graph=self.graph, node_type='lemma', name='строгий').weight, 3)
+        self.assertTrue(Node.objects.filter(graph=self.graph, node_type='lemma', name='яркий').exists())
+
+class VariationSpaceTests(SimpleTestCase):
+    def test_variation_id_round_trip(self):
+        vid = variation_id(3, 700, 'italic', 10, 20, 1.8)
+        self.assertEqual(decode_variation(vid), (3, 700, 'italic', 10, 20, 1.8))
+        self.assertIsNone(variation_id(3, 400, 'normal', 0, 14, 1.5))
+
+    def test_fixed_flags_leave_single_default_variation(self):
+        seen = SeenBitmap()
+        flags = {name: False for name in VARY_FLAGS}
+        picked = pick_unseen_variations([3], seen, flags)
+        self.assertEqual([decode_variation(vid) for vid in picked], [(3, 400, 'normal', 0, 16, 1.5)])
+        seen.add(picked[0])
+        self.assertEqual(pick_unseen_variations([3], seen, flags), [])
+
+    def test_batch_is_distinct_and_unseen(self):
+        seen = SeenBitmap()
+        seen.add(variation_id(1, 400, 'normal', 0, 16, 1.5))
+        picked = pick_unseen_variations([1], seen, {}, count=269)
+        self.assertEqual(len(set(picked)), 269)
+        self.assertFalse(seen.contains_many(picked).any())
+
+
+class VariationReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reservation_user', password='testpassword')
+        self.vid = variation_id(2, 400, 'normal', 0, 16, 1.5)
+        self.flags = {name: False for name in VARY_FLAGS}
+
+    def test_reserved_variations_are_skipped_until_released(self):
+        reserve_variations(self.user.id, vids=[self.vid], ttl=60)
+        self.assertEqual(pick_unseen_variations([2], SeenBitmap(), self.flags, exclude=get_reserved(self.user.id)), [])
+        release_variations(self.user.id, [self.vid])
+        self.assertEqual(pick_unseen_variations([2], SeenBitmap(), self.flags, exclude=get_reserved(self.user.id)), [self.vid])
+
+    def test_reservations_from_two_tabs_accumulate(self):
+        other = variation_id(3, 400, 'normal', 0, 16, 1.5)
+        reserve_variations(self.user.id, vids=[self.vid], ttl=60)
+        reserve_variations(self.user.id, vids=[other], ttl=60)
+        self.assertEqual(set(get_reserved(self.user.id)), {self.vid, other})
+
+
+@patch('mainapp.views.NLPProcessingDirector')
+@patch('mainapp.views.AdvancedTextProcessorBuilder')
+class RandomCipherBatchReservationTests(APITestCase):
+    def setUp(self):
+        invalidate_cipher_catalogue()
+        self.user = User.objects.create_user('batch_user', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        Cipher.objects.create(result="Batch Arial")
+        Cipher.objects.create(result="Batch Georgia")
+        # Без vary_* у каждого шрифта одна вариация — всего две
+        self.request = dict({name: False for name in VARY_FLAGS}, count=5, reserve=True)
+
+    def tearDown(self):
+        invalidate_cipher_catalogue()
+
+    def test_batch_reserve_and_save_release_round_trip(self, mock_builder, mock_director):
+        mock_director.return_value.construct_custom_analysis.return_value = SimpleNamespace(
+            grouping_key="строгий", lemmas=["строгий"], text_embedding=None
+        )
+        response = self.client.post(reverse('cipher-random-batch'), self.request, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        variations = response.data['variations']
+        self.assertEqual(len(variations), 2)
+        self.assertTrue(response.data['exhausted'])
+        self.assertIsNotNone(response.data['reserved_until'])
+        self.assertEqual(len(get_reserved(self.user.id)), 2)
+
+        # Другая вкладка не получает зарезервированные вариации
+        response = self.client.post(reverse('cipher-random-batch'), self.request, format='json')
+        self.assertTrue(response.data['all_seen'])
+
+        saved = dict(variations[0], reaction_description="строгий")
+        response = self.client.post(reverse('study-save'), [saved], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(len(get_reserved(self.user.id)), 1)
+
+        # Сохранённая вариация просмотрена, оставшаяся всё ещё в резерве
+        response = self.client.post(reverse('cipher-random-batch'), self.request, format='json')
+        self.assertTrue(response.data['all_seen'])
+
+class CipherCatalogueTests(SimpleTestCase):
+    def setUp(self):
+        invalidate_cipher_catalogue()
+
+    def tearDown(self):
+        invalidate_cipher_catalogue()
+
+    @patch('mainapp.models.Cipher.objects.all')
+    def test_catalogue_is_loaded_once_until_invalidated(self, mock_cipher_all):
+        mock_cipher_all.side_effect = [[Cipher(id=1, result="Arial")], [Cipher(id=1, result="Arial"), Cipher(id=2, result="Georgia")]]
+        self.assertEqual(get_cipher_catalogue().names(), {1: "Arial"})
+        self.assertEqual(resolve_cipher(1).result, "Arial")
+        self.assertEqual(mock_cipher_all.call_count, 1)
+        invalidate_cipher_catalogue()
+        self.assertEqual(resolve_cipher(name="Georgia").id, 2)
+        self.assertEqual(mock_cipher_all.call_count, 2)
+
+    @patch('mainapp.models.Cipher.objects.all')
+    def test_attach_ciphers_sets_related_without_query(self, mock_cipher_all):
+        mock_cipher_all.return_value = [Cipher(id=5, result="Verdana")]
+        association = Association(id=1, cipher_id=5)
+        attach_ciphers([association])
+        self.assertEqual(association.cipher.result, "Verdana")
+
+
+@patch('mainapp.views.NLPProcessingDirector')
+@patch('mainapp.views.AdvancedTextProcessorBuilder')
+@patch('mainapp.views.NLPAnalysisView._get_processing_variants', return_value=[])
+class AllAssociationsStreamTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('stream_user', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('all_associations_nlp_full')
+        cipher = Cipher.objects.create(result="StreamFont")
+        for text in ("первая реакция", "вторая реакция"):
+            Association.objects.create(user=self.user, cipher=cipher, reaction_description=text, font_size=12 if text.startswith('п') else 20)
+
+    def test_ndjson_stream_yields_one_record_per_line(self, *mocks):
+        response = self.client.get(self.url, {'stream': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), 2)
+        self.assertEqual({r['cipher_name'] for r in records}, {"StreamFont"})
+
+    def test_json_seq_records_start_with_record_separator(self, *mocks):
+        response = self.client.get(self.url, {'stream': 'json-seq'})
+        chunks = b''.join(response.streaming_content).decode('utf-8').split('\x1e')[1:]
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(json.loads(chunks[0])['user_username'], 'stream_user')
+
+    def test_unknown_stream_format_is_rejected(self, *mocks):
+        response = self.client.get(self.url, {'stream': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_interrupted_stream_ends_with_bytes_error_record(self, *mocks):
+        with patch('mainapp.views.association_nlp_record', side_effect=[{'id': 1}, RuntimeError("boom")]):
+            response = self.client.get(self.url, {'stream': 'ndjson'})
+            chunks = list(response.streaming_content)
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertEqual(json.loads(chunks[-1]), {"error": "Выгрузка прервана из-за внутренней ошибки.", "sent": 1})
+
+
+@patch('mainapp.views.NLPProcessingDirector')
+@patch('mainapp.views.AdvancedTextProcessorBuilder')
+@patch('mainapp.views.NLPAnalysisView._get_processing_variants', return_value=[
+    {'name': 'Лемматизация', 'result': {'text_embedding_vector': [0.1], 'grouping_key': 'реакция'}}
+])
+class FilteredAssociationsCursorTests(APITestCase):
+    def setUp(self):
+        self.url = reverse('filtered_associations_nlp')
+        user = User.objects.create_user('filtered_user', password='testpassword')
+        cipher = Cipher.objects.create(result="FilteredFont")
+        for font_size in (12, 20):
+            Association.objects.create(user=user, cipher=cipher, reaction_description="реакция", font_size=font_size)
+
+    def test_last_page_has_no_cursor(self, *mocks):
+        response = self.client.get(self.url, {'limit': 2})
+        self.assertEqual(response.data['count'], 2)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_cursor_is_given_only_while_rows_remain(self, *mocks):
+        first = self.client.get(self.url, {'limit': 1})
+        self.assertIsNotNone(first.data['next_cursor'])
+        second = self.client.get(self.url, {'limit': 1, 'cursor': first.data['next_cursor']})
+        self.assertEqual(second.data['count'], 1)
+        self.assertNotEqual(second.data['results'][0]['association_id'], first.data['results'][0]['association_id'])
+        self.assertIsNone(second.data['next_cursor'])
+
+class KeysetCursorTests(SimpleTestCase):
+    def test_cursor_round_trip(self):
+        from django.utils import timezone
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_damaged_cursor_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            decode_cursor('not-a-cursor')
+
+
+@patch('mainapp.views.NLPProcessingDirector')
+@patch('mainapp.views.AdvancedTextProcessorBuilder')
+@patch('mainapp.views.NLPAnalysisView._get_processing_variants', return_value=[])
+class AssociationKeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cursor_user', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('nlp-analyze-all-associations')
+        cipher = Cipher.objects.create(result="CursorFont")
+        for size in FONT_SIZE_VALUES:
+            Association.objects.create(user=self.user, cipher=cipher, reaction_description=f"реакция {size}", font_size=size)
+
+    def test_cursor_pages_cover_all_rows_once(self, *mocks):
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('estimated_count', response.data)
+        first_ids = [item['association_id'] for item in response.data['results']]
+        self.assertEqual(len(first_ids), 2)
+        response = self.client.get(response.data['next'])
+        second_ids = [item['association_id'] for item in response.data['results']]
+        self.assertEqual(len(second_ids), 1)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(set(first_ids + second_ids)), 3)
+
+    def test_page_number_mode_is_kept(self, *mocks):
+        response = self.client.get(self.url, {'page': 1, 'page_size': 2})
+        self.assertEqual(response.data['count'], 3)
+
+
+class DatasetExportColumnsTests(SimpleTestCase):
+    def test_chunk_columns_mark_missing_embedding_and_age(self):
+        from django.utils import timezone
+        vector = np.arange(4, dtype=np.float32)
+        rows = [
+            (1, timezone.now(), 10, 3, 400, 'normal', 0, 16, 1.5, 'яркий', 'яркий', 'яркий', 'MALE', 30, None, None, vector.tobytes()),
+            (2, timezone.now(), 11, 3, 700, 'italic', 10, 20, 1.8, 'тихий', 'тихий', None, None, None, None, None, None),
+        ]
+        columns = _chunk_columns(rows, {3: "Georgia"}, dim=4)
+        self.assertEqual(columns['cipher_name'], ["Georgia", "Georgia"])
+        self.assertEqual(columns['embedding'].dtype, np.float32)
+        np.testing.assert_array_equal(columns['embedding'][0], vector)
+        self.assertTrue(np.isnan(columns['embedding'][1]).all())
+        self.assertEqual(columns['has_embedding'].tolist(), [True, False])
+        self.assertEqual(columns['age'].tolist(), [30, MISSING_AGE])
+
+
+class DatasetIncrementalExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('export_user', password='testpassword')
+        self.cipher = Cipher.objects.create(result="Export Cipher")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = Path(self.directory.name) / 'associations.npz'
+
+    def _associate(self, font_size):
+        return Association.objects.create(user=self.user, cipher=self.cipher, reaction_description="тихий", font_size=font_size)
+
+    def _export(self):
+        meta = export_dataset(self.path, fmt='npz', since=last_watermark(self.path))
+        with np.load(self.path) as archive:
+            return meta, archive['id'].tolist()
+
+    def test_row_committed_late_is_exported_once(self):
+        first, second = self._associate(12), self._associate(16)
+        self.assertEqual(sorted(self._export()[1]), [first.id, second.id])
+        # Закоммичена после выгрузки, хотя создана раньше последней выгруженной строки
+        late = self._associate(20)
+        Association.objects.filter(pk=late.pk).update(created_at=second.created_at - timedelta(minutes=1))
+        meta, ids = self._export()
+        self.assertEqual(ids, [late.id])
+        self.assertEqual(set(meta['exported_ids']), {first.id, second.id, late.id})
+        self.assertEqual(self._export()[1], [])
+
+
+class CsvImportReaderTests(SimpleTestCase):
+    def test_offsets_allow_resuming_after_multiline_row(self):
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'associations.csv')
+            with open(path, 'w', encoding='utf-8-sig', newline='') as handle:
+                handle.write('user_id,cipher_id,reaction_description\n1,2,"две\nстроки"\n3,4,простая\n')
+            header = read_header(path)
+            rows = list(iter_csv_rows(path, header))
+            self.assertEqual([row['reaction_description'] for row, _ in rows], ["две\nстроки", "простая"])
+            resumed = list(iter_csv_rows(path, header, offset=rows[0][1]))
+            self.assertEqual([row['user_id'] for row, _ in resumed], ['3'])
+
+
+class BenchmarkBaselineTests(SimpleTestCase):
+    def test_regression_is_flagged_above_threshold(self):
+        current = CaseResult(name='search_lexical', size=1000, p50_ms=12.0, p95_ms=20.0, queries_per_op=3)
+        baseline = {'search_lexical@1000': {'p50_ms': 10.0, 'p95_ms': 19.0, 'queries_per_op': 3}}
+        rows = {row['metric']: row for row in compare_with_baseline([current], baseline, threshold=0.10)}
+        self.assertTrue(rows['p50_ms']['regression'])
+        self.assertFalse(rows['p95_ms']['regression'])
+        self.assertFalse(rows['queries_per_op']['regression'])
+
+    def test_skipped_cases_are_not_compared(self):
+        current = CaseResult(name='embed_batch', size=0, skipped='нет модели')
+        self.assertEqual(compare_with_baseline([current], {'embed_batch@0': {'p50_ms': 1.0}}), [])
+
+
+class SyntheticCorpusTests(SimpleTestCase):
+    def test_reactions_are_deterministic_for_seed(self):
+        first = generate_reactions(50, np.random.default_rng(7))
+        self.assertEqual(first, generate_reactions(50, np.random.default_rng(7)))
+        self.assertTrue(all(text and lemmas for text, lemmas in first))
+
+    def test_per_user_counts_fit_variation_grid(self):
+        generator = SyntheticCorpusGenerator(1400, users=3, ciphers=2)
+        counts = generator._associations_per_user()
+        self.assertEqual(counts.sum(), 1400)
+        self.assertLessEqual(counts.max(), 2 * VARIATIONS_PER_CIPHER)
+
+    def test_impossible_size_is_rejected(self):
+        with self.assertRaises(ValueError):
+            SyntheticCorpusGenerator(10 * VARIATIONS_PER_CIPHER, users=1, ciphers=2)
+
+    def test_query_vector_is_close_to_reactions_with_same_lemmas(self):
+        generator = SyntheticCorpusGenerator(10, users=1, ciphers=1, seed=3, embeddings='random')
+        generator._lemma_vectors = _lemma_vectors(np.random.default_rng(3), 16)
+        reactions = [('Строгий, деловой', 'строгий деловой'), ('Весёлый', 'весёлый')]
+        vectors = generator._vectors(reactions, None, 16)
+        scores = vectors @ query_vector('строгий деловой', seed=3, dim=16)
+        self.assertGreater(scores[0], 0.95)
+        self.assertLess(scores[1], scores[0])
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = MetricsRegistry()
+        registry.observe('nlp_stage_seconds', 0.003, stage='lemmatize')
+        registry.observe('nlp_stage_seconds', 0.2, stage='lemmatize')
+        registry.inc('query_cache_lookups_total', result='hit')
+        text = registry.render_prometheus()
+        self.assertIn('nlp_stage_seconds_bucket{stage="lemmatize",le="0.005"} 1', text)
+        self.assertIn('nlp_stage_seconds_bucket{stage="lemmatize",le="+Inf"} 2', text)
+        self.assertIn('nlp_stage_seconds_count{stage="lemmatize"} 2', text)
+        self.assertIn('query_cache_lookups_total{result="hit"} 1', text)
+
+    def test_stage_timer_feeds_server_timing_of_current_request(self):
+        token = start_request_timings()
+        with stage_timer('preprocess'):
+            pass
+        with stage_timer('preprocess'):
+            pass
+        timings = finish_request_timings(token)
+        self.assertEqual(timings['nlp_preprocess'][1], 2)
+        self.assertRegex(server_timing_header(timings), r'^nlp_preprocess;dur=\d+\.\d{2};desc="2x"$')
+
+
+class MetricsViewTests(APITestCase):
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_grants_access(self):
+        response = self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'process_start_time_seconds', response.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_wrong_token_is_rejected(self):
+        response = self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='guess')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    @override_settings(SERVER_TIMING_ENABLED=True, METRICS_TOKEN='secret')
+    def test_server_timing_header_is_attached(self):
+        response = self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='secret')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+
+class QueryFingerprintTests(SimpleTestCase):
+    def test_literals_and_in_lists_are_collapsed(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'a''b' LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+
+    def test_repeated_query_is_reported_as_duplicate(self):
+        collector = QueryCollector()
+        collector.fingerprints.update({'SELECT 1 FROM p WHERE u = %s': 12, 'SELECT 2': 1})
+        self.assertEqual(collector.duplicates(10), {'SELECT ? FROM p WHERE u = %s': 12})
+
+
+class UserListQueryCountTests(APITestCase):
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user-list-get'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries.captured_queries)
+
+    def test_profiles_do_not_add_query_per_user(self):
+        admin = User.objects.create_user(username='staff', password='pw', is_staff=True)
+        self.client.force_authenticate(user=admin)
+        User.objects.create_user(username='u1', password='pw')
+        baseline = self._count_queries()
+        for i in range(2, 7):
+            User.objects.create_user(username=f'u{i}', password='pw')
+        self.assertEqual(self._count_queries(), baseline)
+
+
+class SamplingProfilerTests(SimpleTestCase):
+    def setUp(self):
+        self.profiles_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(PROFILING_DIR=self.profiles_dir.name)
+        self.override.enable()
+
+    def tearDown(self):
+        stop_session()
+        self.override.disable()
+        self.profiles_dir.cleanup()
+
+    def test_request_budget_is_limited(self):
+        session = start_session(route='graph-data', requests=2, seconds=60)
+        self.assertEqual(active_session().id, session.id)
+        self.assertTrue(session.matches('graph-data'))
+        self.assertFalse(session.matches('association-search'))
+        self.assertEqual([claim_request(session) for _ in range(3)], [True, True, False])
+
+    def test_sampled_stacks_are_downloadable_as_collapsed_stacks(self):
+        session = start_session(requests=1, seconds=60, interval_ms=1)
+
+        def busy():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+            return 'done'
+
+        self.assertEqual(profile_call(session, 'GET graph-data', busy), 'done')
+        content, filename, _ = merged_profile(session.id)
+        self.assertTrue(filename.endswith('.folded'))
+        first_line = content.decode('utf-8').splitlines()[0]
+        self.assertTrue(first_line.startswith('GET graph-data;'))
+        self.assertRegex(first_line, r' \d+$')
+
+    def test_invalid_session_id_is_rejected(self):
+        self.assertIsNone(merged_profile('../settings'))
+
+
+class ModelSlotTests(SimpleTestCase):
+    def test_model_is_loaded_once(self):
+        loads = []
+        slot = _ModelSlot('test', lambda: loads.append(1) or 'model')
+        self.assertEqual(slot.get(), 'model')
+        self.assertEqual(slot.get(), 'model')
+        self.assertEqual(len(loads), 1)
+        self.assertTrue(slot.status()['loaded'])
+
+    def test_failed_load_is_remembered(self):
+        loads = []
+
+        def failing_loader():
+            loads.append(1)
+            raise OSError('нет модели')
+
+        slot = _ModelSlot('test', failing_loader)
+        self.assertIsNone(slot.get())
+        self.assertIsNone(slot.get())
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(slot.status()['error'], 'нет модели')
+
+
+class ReadinessViewTests(APITestCase):
+    @patch('mainapp.views.ensure_warm_up_started')
+    @patch('mainapp.views.readiness', return_value={'ready': False, 'warm': False})
+    def test_cold_worker_is_not_ready_and_starts_warm_up(self, _readiness, ensure_warm_up_started):
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        ensure_warm_up_started.assert_called_once()
+
+    @patch('mainapp.views.ensure_warm_up_started')
+    @patch('mainapp.views.readiness', return_value={'ready': True, 'warm': True})
+    def test_warm_worker_is_ready(self, _readiness, ensure_warm_up_started):
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ensure_warm_up_started.assert_not_called()
+
+
+class WarmCachesTests(SimpleTestCase):
+    def test_failed_step_does_not_stop_the_rest(self):
+        def failing_step(options):
+            raise RuntimeError('нет БД')
+
+        steps = (('first', "Первый", failing_step), ('second', "Второй", lambda options: 'готово'))
+        reported = []
+        with patch.object(cache_warmup, 'WARMUP_STEPS', steps), patch.object(cache_warmup, 'STEP_NAMES', ('first', 'second')):
+            results = cache_warmup.warm_caches(report=reported.append)
+            with self.assertRaises(ValueError):
+                cache_warmup.warm_caches(['unknown'])
+        self.assertEqual([result['step'] for result in results], ['first', 'second'])
+        self.assertEqual(results[0]['error'], 'нет БД')
+        self.assertEqual(results[1]['detail'], 'готово')
+        self.assertEqual(reported, results)
+
+    @patch('mainapp.cache_warmup.models_readiness', side_effect=lambda: {'ready': True, 'warm': True, 'models': {}})
+    def test_worker_is_not_ready_until_caches_are_warm(self, _models_readiness):
+        with patch.dict(cache_warmup._state, {'finished_at': None, 'steps': []}):
+            self.assertFalse(cache_warmup.readiness()['ready'])
+        with patch.dict(cache_warmup._state, {'finished_at': time.time(), 'steps': []}):
+            self.assertTrue(cache_warmup.readiness()['ready'])
+
+    @patch('mainapp.cache_warmup.models_readiness', side_effect=lambda: {'ready': True, 'warm': True, 'models': {}})
+    def test_failed_cache_step_is_reported_but_worker_is_ready(self, _models_readiness):
+        steps = [{'step': 'graph', 'error': 'нет данных'}, {'step': 'query_cache', 'error': None}]
+        with patch.dict(cache_warmup._state, {'finished_at': time.time(), 'steps': steps}):
+            state = cache_warmup.readiness()
+            with patch.object(cache_warmup.threading, 'Thread') as thread:
+                cache_warmup.ensure_warm_up_started()
+        self.assertTrue(state['ready'])
+        self.assertFalse(state['caches']['warm'])
+        self.assertEqual(state['caches']['failed_steps'], ['graph'])
+        thread.assert_not_called()
+
+
+class InferencePoolTests(SimpleTestCase):
+    @override_settings(ASYNC_ENDPOINT_LIMITS={'test': 1}, ASYNC_QUEUE_TIMEOUT=0.1)
+    def test_endpoint_concurrency_is_limited(self):
+        def slow(value):
+            time.sleep(0.3)
+            return value
+
+        async def two_concurrent_calls():
+            return await asyncio.gather(run_in_pool('test', slow, 1), run_in_pool('test', slow, 2), return_exceptions=True)
+
+        results = async_to_sync(two_concurrent_calls)()
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], EndpointBusy)
+        self.assertEqual(async_to_sync(run_in_pool)('test', slow, 3), 3)
+
+
+class AsyncEndpointsTests(APITestCase):
+    def test_search_requires_authentication(self):
+        response = self.client.post(reverse('association-search-async'), {'reaction_description': 'строгий'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @patch('mainapp.views.run_in_pool', side_effect=EndpointBusy('graph', retry_after=10))
+    def test_busy_endpoint_returns_503_with_retry_after(self, _run_in_pool):
+        response = self.client.get(reverse('graph-data-async'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '10')
+
+
+class AdmissionGateTests(SimpleTestCase):
+    def setUp(self):
+        self.admission_dir = tempfile.TemporaryDirectory()
+        self.override = override_settings(ADMISSION_DIR=self.admission_dir.name)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.admission_dir.cleanup()
+
+    def test_expensive_request_takes_all_slots(self):
+        gate = EndpointGate('test', {'SLOTS': 2, 'COST_PER_SLOT': 100, 'QUEUE': 0})
+        self.assertEqual(gate.slots_for(50), 1)
+        self.assertEqual(gate.slots_for(10 ** 6), 2)
+        with gate.admit(10 ** 6):
+            with self.assertRaises(AdmissionRejected) as rejected:
+                gate.admit(1)
+            self.assertEqual(rejected.exception.status_code, 429)
+        gate.admit(50).release()
+
+    def test_queued_request_gets_503_after_deadline(self):
+        gate = EndpointGate('test', {'SLOTS': 1, 'QUEUE': 1, 'DEADLINE': 0.1, 'RETRY_AFTER': 7})
+        ticket = gate.admit(1)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            gate.admit(1)
+        self.assertEqual(rejected.exception.status_code, 503)
+        self.assertEqual(rejected.exception.retry_after, 7)
+        ticket.release()
+
+    def test_streaming_iterator_releases_slots_on_close(self):
+        gate = EndpointGate('test', {'SLOTS': 1, 'QUEUE': 0})
+        records = ReleasingIterator(iter(['a', 'b']), gate.admit(1))
+        self.assertEqual(next(records), 'a')
+        records.close()
+        gate.admit(1).release()
+
+
+class AdmissionRejectedResponseTests(APITestCase):
+    @patch('mainapp.views.admit', side_effect=AdmissionRejected('nlp-filtered', 429, retry_after=12, reason='queue_full'))
+    def test_rejected_request_gets_retry_after(self, _admit):
+        response = self.client.get(reverse('filtered_associations_nlp'), {'limit': 5000})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '12')
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def test_numpy_arrays_are_serialized_without_tolist(self):
+        data = {'embedding': np.array([0.5, 0.25], dtype=np.float32), 'stored': np.array([0.5], dtype=np.float16),
+                'count': np.int64(3)}
+        self.assertEqual(json.loads(dumps(data)), {'embedding': [0.5, 0.25], 'stored': [0.5], 'count': 3})
+
+    def test_fallback_matches_fast_path(self):
+        data = [{'name': 'Arial', 'vector': np.arange(3, dtype=np.float32)[::-1]}]
+        fast = json.loads(FastJSONRenderer().render(data))
+        with override_settings(FAST_JSON_ENABLED=False):
+            fallback = json.loads(FastJSONRenderer().render(data))
+        self.assertEqual(fast, fallback)
+
+
+@override_settings(RESPONSE_COMPRESSION={'ENABLED': True, 'MIN_SIZE': 1024})
+class CompressionMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.body = b'{"values": [' + b','.join(b'0.123456' for _ in range(2000)) + b']}'
+        self.middleware = CompressionMiddleware(lambda request: HttpResponse(self.body, content_type='application/json'))
+        self.large_middleware = CompressionMiddleware(lambda request: FastJsonResponse({'values': [0.123456] * 2000}))
+
+    def test_encoding_negotiation(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate_encoding('identity'), '')
+        self.assertEqual(negotiate_encoding('gzip;q=0, *;q=0'), '')
+
+    def test_large_body_is_gzipped(self):
+        request = RequestFactory().get('/api/graph/', HTTP_ACCEPT_ENCODING='gzip')
+        response = self.large_middleware(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), {'values': [0.123456] * 2000})
+
+    def test_other_responses_are_not_compressed(self):
+        response = self.middleware(RequestFactory().get('/api/users/login/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.body)
+
+    @override_settings(RESPONSE_COMPRESSION={'ENABLED': True, 'MIN_SIZE': 10 ** 6})
+    def test_small_body_is_not_compressed(self):
+        response = self.large_middleware(RequestFactory().get('/api/graph/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(RESPONSE_COMPRESSION={})
+    def test_disabled_by_default(self):
+        response = self.large_middleware(RequestFactory().get('/api/graph/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertFalse(response.has_header('Content-Encoding'))
@@ -1,8 +1,11 @@
 from django.urls import path
 from .views import (
-    UserView, RandomCipherView, StudyView, GraphView, AssociationSearchView, 
+    UserView, RandomCipherView, RandomCipherBatchView, StudyView, GraphView, AssociationSearchView, 
     NLPAnalysisView, AllAssociationsNLPAnalysisView, AllAssociationsForNLPView,
-    filtered_associations_for_nlp, fast_grouped_associations
+    filtered_associations_for_nlp, fast_grouped_associations, QueryCacheStatsView,
+    SimilarAssociationsView, FontSimilarityView, CharacteristicLemmasView, GraphEdgesView, DatasetExportView,
+    MetricsView, QueryProfileStatsView, ProfilingView, ProfilingDownloadView,
+    ReadinessView, AsyncAssociationSearchView, AsyncNLPAnalysisView, AsyncGraphView
 )
 from rest_framework_simplejwt.views import TokenRefreshView
 
@@ -12,10 +15,22 @@ urlpatterns = [
     path('users/', UserView.as_view(), name='user-list-get'),
     path('users/<int:user_id>/', UserView.as_view(), name='user-detail-delete'),
     path('ciphers/random/', RandomCipherView.as_view(), name='cipher-random'),
+    path('ciphers/random/batch/', RandomCipherBatchView.as_view(), name='cipher-random-batch'),
     path('studies/', StudyView.as_view(), name='study-save'),
     path('graph/', GraphView.as_view(), name='graph-data'),
+    path('graph/edges/', GraphEdgesView.as_view(), name='graph-edges'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('associations/search/', AssociationSearchView.as_view(), name='association-search'),
+    path('associations/<int:association_id>/similar/', SimilarAssociationsView.as_view(), name='association-similar'),
+    path('fonts/similarity/', FontSimilarityView.as_view(), name='font-similarity'),
+    path('fonts/lemmas/', CharacteristicLemmasView.as_view(), name='font-characteristic-lemmas'),
+    path('export/dataset/', DatasetExportView.as_view(), name='dataset-export'),
+    path('health/ready/', ReadinessView.as_view(), name='readiness'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('metrics/queries/', QueryProfileStatsView.as_view(), name='query-profile-stats'),
+    path('profiling/', ProfilingView.as_view(), name='profiling'),
+    path('profiling/<str:session_id>/download/', ProfilingDownloadView.as_view(), name='profiling-download'),
+    path('nlp/query-cache/stats/', QueryCacheStatsView.as_view(), name='query-cache-stats'),
     path('nlp/analyze-text/', NLPAnalysisView.as_view(), name='nlp-analyze-text'),
     path('nlp/analyze-all-associations/', AllAssociationsNLPAnalysisView.as_view(), name='nlp-analyze-all-associations'),
     path('nlp/all-associations-full/', AllAssociationsForNLPView.as_view(), name='all_associations_nlp_full'),
@@ -23,4 +38,10 @@ urlpatterns = [
 ]
 urlpatterns += [
     path('nlp/fast-grouped/', fast_grouped_associations, name='fast_grouped_associations'),
+]
+# Асинхронные варианты тяжёлых эндпоинтов для ASGI (inference_pool); под WSGI тоже работают, но без выигрыша
+urlpatterns += [
+    path('async/associations/search/', AsyncAssociationSearchView.as_view(), name='association-search-async'),
+    path('async/nlp/analyze-text/', AsyncNLPAnalysisView.as_view(), name='nlp-analyze-text-async'),
+    path('async/graph/', AsyncGraphView.as_view(), name='graph-data-async'),
 ]
\ No newline at end of file
@@ -1,29 +1,12 @@
-import spacy
 import logging
 
+from .nlp_models import get_spacy_model
+
 logger = logging.getLogger(__name__)
-nlp = None
 
-def load_spacy_model(model_name="ru_core_news_sm"):
-    global nlp
-    if nlp is None:
-        try:
-            logger.info(f"Загрузка модели spaCy: {model_name}...")
-            nlp = spacy.load(model_name)
-            logger.info("Модель spaCy успешно загружена.")
-        except OSError:
-            logger.warning(f"Модель {model_name} не найдена. Попытка загрузки...")
-            try:
-                spacy.cli.download(model_name)
-                nlp = spacy.load(model_name)
-                logger.info(f"Модель {model_name} успешно загружена после скачивания.")
-            except Exception as e:
-                logger.error(f"Не удалось загрузить модель spaCy {model_name}: {e}")
-                nlp = None
-        except Exception as e:
-             logger.error(f"Неизвестная ошибка при загрузке модели spaCy: {e}")
-             nlp = None
-    return nlp
+def load_spacy_model(model_name=None):
+    """Модель spaCy процесса (mainapp.nlp_models); имя задаётся settings.SPACY_MODEL_NAME."""
+    return get_spacy_model()
 
 def get_lemmas(text):
     if not text: return ""
@@ -39,5 +22,3 @@ def get_lemmas(text):
     except Exception as e:
         logger.error(f"Ошибка при лемматизации текста '{text[:50]}...': {e}")
         return ""
-
-load_spacy_model()
\ No newline at end of file
@@ -0,0 +1,220 @@
+import logging
+import random
+from datetime import timedelta
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Association, UserSeenVariations, VariationReservation
+
+logger = logging.getLogger('mainapp')
+
+FONT_WEIGHTS = [fw[0] for fw in Association.FontWeight.choices]
+FONT_STYLES = [fs[0] for fs in Association.FontStyle.choices]
+LETTER_SPACINGS = [0, 10]
+FONT_SIZES = [12, 16, 20]
+LINE_HEIGHTS = [1.2, 1.5, 1.8]
+
+# Значения, которые показываются, когда соответствующий vary_* выключен
+DEFAULT_VARIATION = (Association.FontWeight.REGULAR, Association.FontStyle.NORMAL, 0, 16, 1.5)
+
+_AXES = (FONT_WEIGHTS, FONT_STYLES, LETTER_SPACINGS, FONT_SIZES, LINE_HEIGHTS)
+_AXIS_INDEX = tuple({value: pos for pos, value in enumerate(axis)} for axis in _AXES)
+_RADICES = tuple(len(axis) for axis in _AXES)
+VARIATIONS_PER_CIPHER = int(np.prod(_RADICES))
+
+VARY_FLAGS = ('vary_weight', 'vary_style', 'vary_spacing', 'vary_size', 'vary_leading')
+# Сколько случайных попыток делать до точного перебора свободных вариаций
+MAX_RANDOM_PROBES = 64
+
+
+def _axis_position(axis: int, value) -> Optional[int]:
+    if axis == 4:
+        value = round(float(value), 1)
+    return _AXIS_INDEX[axis].get(value)
+
+
+def variation_id(cipher_id: int, font_weight, font_style, letter_spacing, font_size, line_height) -> Optional[int]:
+    """
+    Плотный id вариации: cipher_id * VARIATIONS_PER_CIPHER + смешанный индекс по осям.
+    None — значения вне сетки, которую показывает RandomCipherView.
+    """
+    offset = 0
+    for axis, value in enumerate((font_weight, font_style, letter_spacing, font_size, line_height)):
+        pos = _axis_position(axis, value)
+        if pos is None:
+            return None
+        offset = offset * _RADICES[axis] + pos
+    return int(cipher_id) * VARIATIONS_PER_CIPHER + offset
+
+
+def decode_variation(vid: int) -> Tuple[int, int, str, int, int, float]:
+    cipher_id, offset = divmod(int(vid), VARIATIONS_PER_CIPHER)
+    positions = []
+    for radix in reversed(_RADICES):
+        offset, pos = divmod(offset, radix)
+        positions.append(pos)
+    positions.reverse()
+    return (cipher_id,) + tuple(axis[pos] for axis, pos in zip(_AXES, positions))
+
+
+@lru_cache(maxsize=32)
+def allowed_offsets(vary_weight=True, vary_style=True, vary_spacing=True, vary_size=True, vary_leading=True) -> np.ndarray:
+    """Смещения вариаций внутри шрифта, допустимые при данных vary_* (предвычисленная маска)."""
+    flags = (vary_weight, vary_style, vary_spacing, vary_size, vary_leading)
+    grids = []
+    for axis, (vary, default) in enumerate(zip(flags, DEFAULT_VARIATION)):
+        grids.append(np.arange(_RADICES[axis]) if vary else np.array([_axis_position(axis, default)]))
+    mesh = np.meshgrid(*grids, indexing='ij')
+    offsets = np.zeros(mesh[0].shape, dtype=np.int64)
+    for axis, positions in enumerate(mesh):
+        offsets = offsets * _RADICES[axis] + positions
+    offsets = np.sort(offsets.ravel())
+    offsets.setflags(write=False)
+    return offsets
+
+
+class SeenBitmap:
+    """Битовая карта просмотренных пользователем id вариаций (бит i — вариация i)."""
+
+    def __init__(self, data: bytes = b''):
+        self.bits = np.frombuffer(bytes(data), dtype=np.uint8).copy()
+
+    def __contains__(self, vid: int) -> bool:
+        byte = vid >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (vid & 7)))
+
+    def add(self, vid: int) -> None:
+        byte = vid >> 3
+        if byte >= len(self.bits):
+            self.bits = np.concatenate([self.bits, np.zeros(byte + 1 - len(self.bits), dtype=np.uint8)])
+        self.bits[byte] |= np.uint8(1 << (vid & 7))
+
+    def contains_many(self, vids: np.ndarray) -> np.ndarray:
+        vids = np.asarray(vids, dtype=np.int64)
+        inside = (vids >> 3) < len(self.bits)
+        result = np.zeros(len(vids), dtype=bool)
+        result[inside] = (self.bits[vids[inside] >> 3] >> (vids[inside] & 7)) & 1 == 1
+        return result
+
+    def count(self) -> int:
+        return int(np.unpackbits(self.bits).sum())
+
+    def to_bytes(self) -> bytes:
+        return self.bits.tobytes()
+
+
+def _bitmap_from_rows(rows: Iterable[tuple]) -> SeenBitmap:
+    bitmap = SeenBitmap()
+    for row in rows:
+        vid = variation_id(*row)
+        if vid is not None:
+            bitmap.add(vid)
+    return bitmap
+
+
+def get_seen_bitmap(user) -> SeenBitmap:
+    """
+    Битовая карта пользователя. Пересобирается из ассоциаций, если число учтённых
+    ассоциаций разошлось с фактическим (удаления, bulk_create без сигналов).
+    """
+    total = Association.objects.filter(user=user).count()
+    stored = UserSeenVariations.objects.filter(user=user).first()
+    if stored is not None and stored.association_count == total:
+        return SeenBitmap(stored.bitmap)
+
+    bitmap = _bitmap_from_rows(Association.objects.filter(user=user).values_list(
+        'cipher_id', 'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height'
+    ))
+    UserSeenVariations.objects.update_or_create(
+        user=user, defaults={'bitmap': bitmap.to_bytes(), 'association_count': total}
+    )
+    return bitmap
+
+
+def mark_seen(association) -> None:
+    """Отмечает вариацию новой ассоциации в карте пользователя (если карта уже построена)."""
+    with transaction.atomic():
+        stored = UserSeenVariations.objects.select_for_update().filter(user_id=association.user_id).first()
+        if stored is None:
+            return  # карта будет построена при первом запросе
+        bitmap = SeenBitmap(stored.bitmap)
+        vid = variation_id(
+            association.cipher_id, association.font_weight, association.font_style,
+            association.letter_spacing, association.font_size, association.line_height,
+        )
+        if vid is not None:
+            bitmap.add(vid)
+        stored.bitmap = bitmap.to_bytes()
+        stored.association_count += 1
+        stored.save(update_fields=['bitmap', 'association_count', 'updated_at'])
+
+
+def pick_unseen_variations(cipher_ids: List[int], seen: SeenBitmap, flags: dict, count: int = 1,
+                           exclude: Iterable[int] = (), rng: Optional[random.Random] = None) -> List[int]:
+    """
+    До count разных непросмотренных id вариаций. Сначала случайные пробы (шрифт, смещение) —
+    O(1) в ожидании, пока просмотрена не большая часть сетки; иначе точный отбор
+    по маске всех допустимых id.
+    """
+    rng = rng or random
+    offsets = allowed_offsets(*(bool(flags.get(name, True)) for name in VARY_FLAGS))
+    if not cipher_ids or not len(offsets):
+        return []
+    excluded = set(exclude)
+    picked: List[int] = []
+    for _ in range(MAX_RANDOM_PROBES * count):
+        if len(picked) >= count:
+            return picked
+        vid = rng.choice(cipher_ids) * VARIATIONS_PER_CIPHER + int(offsets[rng.randrange(len(offsets))])
+        if vid not in seen and vid not in excluded:
+            picked.append(vid)
+            excluded.add(vid)
+    if len(picked) >= count:
+        return picked
+
+    candidates = (np.asarray(cipher_ids, dtype=np.int64)[:, None] * VARIATIONS_PER_CIPHER + offsets[None, :]).ravel()
+    candidates = candidates[~seen.contains_many(candidates)]
+    if excluded:
+        candidates = candidates[~np.isin(candidates, list(excluded))]
+    needed = count - len(picked)
+    if len(candidates) > needed:
+        candidates = candidates[rng.sample(range(len(candidates)), needed)]
+    return picked + [int(vid) for vid in candidates]
+
+
+# --- Короткие резервы вариаций между вкладками одного пользователя ---
+# Резервы — строки VariationReservation, а не запись в кэше: каждая вариация пишется отдельным
+# upsert, поэтому одновременные запросы двух вкладок не затирают друг друга, и все воркеры
+# gunicorn видят одни и те же резервы при любом бэкенде кэша.
+
+def get_reserved(user_id: int) -> dict:
+    """{id вариации: время истечения (секунды epoch)} для неистёкших резервов пользователя."""
+    rows = VariationReservation.objects.filter(user_id=user_id, expires_at__gt=timezone.now())
+    return {vid: expires_at.timestamp() for vid, expires_at in rows.values_list('variation_id', 'expires_at')}
+
+
+def reserve_variations(user_id: int, vids: Iterable[int], ttl: Optional[int] = None) -> float:
+    """
+    Резервирует вариации на ttl секунд (settings.VARIATION_RESERVATION_TTL), чтобы другие
+    вкладки не получили их же. Заодно удаляет истёкшие резервы пользователя.
+    """
+    ttl = ttl or getattr(settings, 'VARIATION_RESERVATION_TTL', 300)
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    VariationReservation.objects.filter(user_id=user_id, expires_at__lte=now).delete()
+    VariationReservation.objects.bulk_create(
+        [VariationReservation(user_id=user_id, variation_id=int(vid), expires_at=expires_at) for vid in vids],
+        update_conflicts=True, unique_fields=['user', 'variation_id'], update_fields=['expires_at'],
+    )
+    return expires_at.timestamp()
+
+
+def release_variations(user_id: int, vids: Iterable[int]) -> None:
+    vids = [int(vid) for vid in vids]
+    if vids:
+        VariationReservation.objects.filter(user_id=user_id, variation_id__in=vids).delete()
@@ -0,0 +1,414 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Q
+
+from .embeddings import decode_embedding, get_active_embedding_model, load_embedding_matrix
+
+logger = logging.getLogger('mainapp')
+
+# Атрибуты ассоциации, по которым семантический поиск умеет фильтровать.
+# line_height хранится как int(x * 10), font_style — как код из словаря значений.
+FILTER_FIELDS = ('cipher_id', 'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height', 'user_id')
+
+_ATTRIBUTE_LOOKUPS = (
+    'id', 'cipher_id', 'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height', 'user_id', 'created_at'
+)
+
+
+def _line_height_code(value) -> int:
+    return int(round(float(value) * 10))
+
+
+def _timestamp(value) -> int:
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+class PostingLists:
+    """
+    Для одного атрибута: значение -> отсортированные номера строк индекса.
+    Строится одной сортировкой; маска для набора значений собирается из срезов.
+    """
+
+    def __init__(self, codes: np.ndarray):
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        values, starts = np.unique(sorted_codes, return_index=True)
+        self._rows = order.astype(np.int64)
+        self._values = values
+        self._bounds = np.append(starts, len(sorted_codes))
+        self._size = len(codes)
+
+    def rows_for(self, value) -> np.ndarray:
+        pos = np.searchsorted(self._values, value)
+        if pos >= len(self._values) or self._values[pos] != value:
+            return self._rows[:0]
+        return self._rows[self._bounds[pos]:self._bounds[pos + 1]]
+
+    def mask_for(self, values: Iterable) -> np.ndarray:
+        mask = np.zeros(self._size, dtype=bool)
+        for value in values:
+            mask[self.rows_for(value)] = True
+        return mask
+
+
+class SemanticIndex:
+    """
+    Матрица эмбеддингов активной модели (может быть mmap-выгрузкой) и выровненные с ней
+    атрибуты ассоциаций. Фильтры применяются как булевы маски до выбора top-k,
+    поэтому "реакции как X для Georgia Bold Italic" — одно маскированное умножение.
+    """
+
+    def __init__(self, model, ids: np.ndarray, matrix: np.ndarray, attributes: Dict[str, np.ndarray],
+                 created_at: np.ndarray, style_codes: Dict[str, int], max_embedding_id: int,
+                 max_updated_at: float = 0.0):
+        self.model = model
+        self.ids = ids
+        self.matrix = matrix
+        norms = np.linalg.norm(matrix, axis=1) if len(matrix) else np.empty(0, dtype=np.float32)
+        self.inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms, dtype=np.float32), where=norms > 0)
+        self.attributes = attributes
+        self.created_at = created_at
+        self.style_codes = style_codes
+        self.max_embedding_id = max_embedding_id
+        # Водяной знак перезаписей: max(updated_at) векторов в индексе, секунды epoch
+        self.max_updated_at = max_updated_at
+        self.postings = {name: PostingLists(attributes[name]) for name in FILTER_FIELDS}
+        self._id_order = np.argsort(ids, kind='stable')
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def build_mask(self, filters: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        filters: {поле: значение | список значений, 'created_from': datetime, 'created_to': datetime}.
+        Внутри поля значения объединяются (OR), между полями — пересечение (AND).
+        None — фильтров нет, ищем по всем строкам.
+        """
+        if not filters:
+            return None
+        mask = None
+        for name in FILTER_FIELDS:
+            if name not in filters or filters[name] is None:
+                continue
+            values = filters[name] if isinstance(filters[name], (list, tuple, set)) else [filters[name]]
+            if name == 'font_style':
+                values = [self.style_codes.get(v, -1) for v in values]
+            elif name == 'line_height':
+                values = [_line_height_code(v) for v in values]
+            field_mask = self.postings[name].mask_for(int(v) for v in values)
+            mask = field_mask if mask is None else (mask & field_mask)
+        if filters.get('created_from') is not None:
+            field_mask = self.created_at >= _timestamp(filters['created_from'])
+            mask = field_mask if mask is None else (mask & field_mask)
+        if filters.get('created_to') is not None:
+            field_mask = self.created_at <= _timestamp(filters['created_to'])
+            mask = field_mask if mask is None else (mask & field_mask)
+        return mask
+
+    def search(self, query: np.ndarray, k: int = 20, filters: Optional[dict] = None,
+               min_score: float = -1.0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Возвращает (строки индекса, косинусные сходства) по убыванию сходства.
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = query / query_norm
+
+        mask = self.build_mask(filters)
+        if mask is None:
+            rows = None
+            scores = (self.matrix @ query) * self.inv_norms
+        else:
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                return rows, np.empty(0, dtype=np.float32)
+            scores = (self.matrix[rows] @ query) * self.inv_norms[rows]
+
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        top = top[scores[top] >= min_score]
+        result_rows = top if rows is None else rows[top]
+        return result_rows, scores[top]
+
+    def rows_for_ids(self, association_ids) -> np.ndarray:
+        """
+        Номера строк для id ассоциаций; -1 для отсутствующих в индексе.
+        """
+        association_ids = np.asarray(association_ids, dtype=np.int64)
+        if not len(self):
+            return np.full(len(association_ids), -1, dtype=np.int64)
+        sorted_ids = self.ids[self._id_order]
+        pos = np.clip(np.searchsorted(sorted_ids, association_ids), 0, len(sorted_ids) - 1)
+        return np.where(sorted_ids[pos] == association_ids, self._id_order[pos], -1)
+
+    def normalized_rows(self, rows) -> np.ndarray:
+        return np.asarray(self.matrix[rows], dtype=np.float32) * self.inv_norms[rows][:, None]
+
+    def attributes_of(self, row: int) -> dict:
+        return {name: self.attributes[name][row] for name in FILTER_FIELDS}
+
+    def count_like(self, row: int, fields: Iterable[str], mask: Optional[np.ndarray] = None) -> int:
+        """
+        Сколько строк индекса совпадает со строкой row по полям fields (внутри mask, если задана).
+        """
+        matched = None
+        for name in fields:
+            rows = self.postings[name].rows_for(self.attributes[name][row])
+            matched = rows if matched is None else np.intersect1d(matched, rows, assume_unique=True)
+        if matched is None:
+            matched = np.arange(len(self))
+        if mask is not None:
+            matched = matched[mask[matched]]
+        return len(matched)
+
+
+# --- Построение ---
+
+def _attribute_columns(rows: List[tuple], style_codes: Dict[str, int]):
+    attributes = {
+        'cipher_id': np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows)),
+        'font_weight': np.fromiter((r[2] for r in rows), dtype=np.int64, count=len(rows)),
+        'font_style': np.fromiter((style_codes.setdefault(r[3], len(style_codes)) for r in rows), dtype=np.int64, count=len(rows)),
+        'letter_spacing': np.fromiter((r[4] for r in rows), dtype=np.int64, count=len(rows)),
+        'font_size': np.fromiter((r[5] for r in rows), dtype=np.int64, count=len(rows)),
+        'line_height': np.fromiter((_line_height_code(r[6]) for r in rows), dtype=np.int64, count=len(rows)),
+        'user_id': np.fromiter((r[7] for r in rows), dtype=np.int64, count=len(rows)),
+    }
+    created_at = np.fromiter((_timestamp(r[8]) for r in rows), dtype=np.int64, count=len(rows))
+    return attributes, created_at
+
+
+def _fetch_embeddings(model, min_embedding_id: int = 0, updated_since: Optional[float] = None,
+                      chunk_size: int = 5000):
+    """
+    Векторы модели с id > min_embedding_id, а при updated_since — ещё и записанные
+    (в т.ч. перезаписанные) не раньше этого момента. Возвращает
+    (матрица, строки атрибутов, max id, max updated_at) с водяными знаками не ниже исходных.
+    """
+    from .models import AssociationEmbedding
+
+    qs = AssociationEmbedding.objects.filter(model=model)
+    if updated_since is not None:
+        qs = qs.filter(Q(id__gt=min_embedding_id) | Q(updated_at__gte=_from_timestamp(updated_since)))
+    else:
+        qs = qs.filter(id__gt=min_embedding_id)
+    lookups = ['id', 'updated_at', 'vector'] + [f'association__{name}' for name in _ATTRIBUTE_LOOKUPS]
+    vectors, attr_rows = [], []
+    max_embedding_id, max_updated_at = min_embedding_id, updated_since or 0.0
+    for row in qs.order_by('association_id').values_list(*lookups).iterator(chunk_size=chunk_size):
+        max_embedding_id = max(max_embedding_id, row[0])
+        max_updated_at = max(max_updated_at, row[1].timestamp())
+        vectors.append(decode_embedding(row[2], dim=model.dimension))
+        attr_rows.append(row[3:])
+    matrix = np.vstack(vectors).astype(np.float32, copy=False) if vectors else np.empty((0, model.dimension), dtype=np.float32)
+    return matrix, attr_rows, max_embedding_id, max_updated_at
+
+
+def _from_timestamp(value: float) -> datetime:
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+def build_index_from_database(model=None) -> SemanticIndex:
+    model = model or get_active_embedding_model()
+    started = time.monotonic()
+    matrix, attr_rows, max_embedding_id, max_updated_at = _fetch_embeddings(model)
+    style_codes: Dict[str, int] = {}
+    attributes, created_at = _attribute_columns(attr_rows, style_codes)
+    ids = np.fromiter((r[0] for r in attr_rows), dtype=np.int64, count=len(attr_rows))
+    index = SemanticIndex(model, ids, matrix, attributes, created_at, style_codes, max_embedding_id, max_updated_at)
+    logger.info(f"SemanticIndex: построен из БД, {len(index)} векторов за {time.monotonic() - started:.2f} с.")
+    return index
+
+
+def build_index_from_store(model=None) -> Optional[SemanticIndex]:
+    """
+    Холодный старт из mmap-выгрузки: из БД читаются только атрибуты и векторы,
+    появившиеся после выгрузки. None, если выгрузки нет.
+    """
+    from .models import Association
+
+    model = model or get_active_embedding_model()
+    loaded = load_embedding_matrix(model.name)
+    if loaded is None:
+        return None
+    ids, matrix, meta = loaded
+    if meta.get('dimension', model.dimension) != model.dimension or 'max_embedding_id' not in meta:
+        logger.warning(f"SemanticIndex: выгрузка для '{model.name}' несовместима, строим из БД.")
+        return None
+    started = time.monotonic()
+
+    attr_by_id = {
+        row[0]: row for row in Association.objects.filter(id__lte=meta.get('max_association_id', 0))
+        .values_list(*_ATTRIBUTE_LOOKUPS).iterator(chunk_size=20000)
+    } if len(ids) else {}
+    keep = np.fromiter((int(assoc_id) in attr_by_id for assoc_id in ids), dtype=bool, count=len(ids))
+    if not keep.all():
+        # Ассоциации, удалённые после выгрузки; фильтрация копирует матрицу в память.
+        ids, matrix = ids[keep], matrix[keep]
+    attr_rows = [attr_by_id[int(assoc_id)] for assoc_id in ids]
+
+    style_codes: Dict[str, int] = {}
+    attributes, created_at = _attribute_columns(attr_rows, style_codes)
+    index = SemanticIndex(
+        model, np.asarray(ids, dtype=np.int64), matrix, attributes, created_at, style_codes, meta['max_embedding_id'],
+        # Выгрузки без max_updated_at: перезаписи после выгрузки ищем с момента самой выгрузки
+        meta.get('max_updated_at', meta.get('exported_at', 0.0)),
+    )
+    index = extend_index(index)
+    logger.info(
+        f"SemanticIndex: загружен из выгрузки ({meta.get('count', 0)} векторов, всего {len(index)}) "
+        f"за {time.monotonic() - started:.2f} с."
+    )
+    return index
+
+
+def extend_index(index: SemanticIndex) -> SemanticIndex:
+    """
+    Догружает векторы с id больше index.max_embedding_id и записанные за окно
+    SEMANTIC_INDEX_SETTLE_SECONDS до index.max_updated_at: так подхватываются и перезаписанные
+    векторы (id строки не меняется), и строки, закоммиченные позже соседей с большим id.
+    Известные индексу ассоциации обновляются на месте, новые добавляются в конец.
+    Без изменений возвращает тот же индекс.
+    """
+    settle = getattr(settings, 'SEMANTIC_INDEX_SETTLE_SECONDS', 60)
+    tail_matrix, tail_rows, max_embedding_id, max_updated_at = _fetch_embeddings(
+        index.model, min_embedding_id=index.max_embedding_id, updated_since=max(index.max_updated_at - settle, 0.0)
+    )
+    if not tail_rows:
+        return index
+    tail_ids = np.fromiter((r[0] for r in tail_rows), dtype=np.int64, count=len(tail_rows))
+    known_rows = index.rows_for_ids(tail_ids)
+    known = known_rows >= 0
+    fresh = ~known
+    style_codes = dict(index.style_codes)
+    tail_attributes, tail_created_at = _attribute_columns(tail_rows, style_codes)
+
+    matrix, attributes, created_at = index.matrix, index.attributes, index.created_at
+    if known.any():
+        # Копия вместо записи в mmap-выгрузку или в матрицу, которую читают текущие запросы
+        matrix = np.array(matrix, dtype=np.float32)
+        matrix[known_rows[known]] = tail_matrix[known]
+        attributes = {name: attributes[name].copy() for name in FILTER_FIELDS}
+        for name in FILTER_FIELDS:
+            attributes[name][known_rows[known]] = tail_attributes[name][known]
+        created_at = created_at.copy()
+        created_at[known_rows[known]] = tail_created_at[known]
+    extended = SemanticIndex(
+        index.model,
+        np.concatenate([index.ids, tail_ids[fresh]]),
+        np.vstack([matrix, tail_matrix[fresh]]),
+        {name: np.concatenate([attributes[name], tail_attributes[name][fresh]]) for name in FILTER_FIELDS},
+        np.concatenate([created_at, tail_created_at[fresh]]),
+        style_codes,
+        max_embedding_id,
+        max(index.max_updated_at, max_updated_at),
+    )
+    logger.info(
+        f"SemanticIndex: добавлено {int(fresh.sum())}, обновлено {int(known.sum())} векторов, всего {len(extended)}."
+    )
+    return extended
+
+
+# --- Процессный синглтон ---
+
+_index: Optional[SemanticIndex] = None
+_index_lock = threading.Lock()
+# Сериализует построение и догрузку индекса; поиск его не ждёт
+_build_lock = threading.Lock()
+_last_check = 0.0
+
+
+def _store_state(model) -> Tuple[int, int, float]:
+    """(число векторов, max id, max updated_at) модели в хранилище."""
+    from .models import AssociationEmbedding
+
+    state = AssociationEmbedding.objects.filter(model=model).aggregate(
+        count=Count('id'), max_id=Max('id'), max_updated=Max('updated_at')
+    )
+    max_updated = state['max_updated'].timestamp() if state['max_updated'] else 0.0
+    return state['count'], state['max_id'] or 0, max_updated
+
+
+def _refreshed(index: SemanticIndex, model) -> SemanticIndex:
+    count, max_id, max_updated = _store_state(model)
+    if (count, max_id, max_updated) == (len(index), index.max_embedding_id, index.max_updated_at):
+        return index
+    index = extend_index(index)
+    if len(index) != count:
+        logger.warning(
+            f"SemanticIndex: {len(index)} векторов в индексе против {count} в БД, полная перестройка."
+        )
+        index = build_index_from_database(model)
+    return index
+
+
+def get_semantic_index(force_rebuild: bool = False) -> SemanticIndex:
+    """
+    Индекс для активной модели. Не чаще раза в SEMANTIC_INDEX_CHECK_INTERVAL секунд
+    сверяет с хранилищем число векторов, max id и max updated_at и при расхождении
+    догружает изменения (extend_index). Если и после этого число векторов не сходится —
+    удаления или строки, закоммиченные позже окна SEMANTIC_INDEX_SETTLE_SECONDS, —
+    индекс перестраивается из БД целиком.
+
+    Построение идёт вне _index_lock, под ним только подменяется ссылка: пока один поток
+    догружает изменения, остальные ищут по текущему индексу. Ждут построения лишь
+    потоки без пригодного индекса (первый запрос, смена модели, force_rebuild).
+    """
+    global _index, _last_check
+    model = get_active_embedding_model()
+    check_interval = getattr(settings, 'SEMANTIC_INDEX_CHECK_INTERVAL', 10)
+    with _index_lock:
+        current = _index
+        now = time.monotonic()
+        rebuild = force_rebuild or current is None or current.model.id != model.id
+        if not rebuild:
+            if now - _last_check < check_interval:
+                return current
+            _last_check = now
+
+    if not rebuild:
+        if not _build_lock.acquire(blocking=False):
+            return current
+        try:
+            fresh = _refreshed(current, model)
+        finally:
+            _build_lock.release()
+        with _index_lock:
+            # reset_semantic_index или перестройка могли заменить индекс, пока шла догрузка
+            if _index is current:
+                _index = fresh
+            return _index
+
+    with _build_lock:
+        if not force_rebuild:
+            with _index_lock:
+                current = _index
+            if current is not None and current.model.id == model.id:
+                return current  # построил другой поток, пока этот ждал
+        fresh = (None if force_rebuild else build_index_from_store(model)) or build_index_from_database(model)
+        with _index_lock:
+            _index = fresh
+            _last_check = time.monotonic()
+        return fresh
+
+
+def reset_semantic_index() -> None:
+    global _index
+    with _index_lock:
+        _index = None
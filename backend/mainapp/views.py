@@ -1,15 +1,20 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.urls import reverse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
 from django.views import View
 from django.contrib.auth import get_user_model, authenticate
 from django.db.models import Count, Q, F, ExpressionWrapper, FloatField, Value, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser, BasePermission
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer
 
-from .models import Study, Cipher, Association, Administrator, Reaction
+from .models import Study, Cipher, Association, Administrator, Reaction, Graph, Edge
 from .serializers import RegisterSerializer, LoginSerializer, CipherSerializer, AssociationSerializer, CustomTokenObtainPairSerializer
 from .nlp_processor import (
     AdvancedTextProcessorBuilder,
@@ -19,22 +24,44 @@ from .nlp_processor import (
     SBERT_MODEL_NAME
 )
 from .gateway import AssociationFinder_ForRowData
+from .embeddings import association_content_hash, save_association_embedding, get_embeddings_for
+from .query_cache import query_embedding_cache, search_nlp_params, cached_search_analysis
+from .vector_index import get_semantic_index
+from .neighbors import get_neighbors
+from .font_similarity import get_font_profiles, variation_key, decode_variation_key, FONT_STYLE_VALUES, SIMILARITY_KINDS
+from .lemma_stats import get_contingency, METRICS as LEMMA_METRICS
+from .graph_builder import DEFAULT_GRAPH_NAME, cached_live_graph_data, pending_associations
+from .dataset_export import EXPORT_FORMATS, default_format, export_dataset
+from .pagination import AssociationKeysetPagination, KEYSET_ORDERING, estimate_count, encode_cursor, after_cursor
+from .metrics import metrics
+from .query_profiler import query_profiler
+from .inference_pool import EndpointBusy, run_in_pool
+from .admission import AdmissionRejected, ReleasingIterator, admit
+from .renderers import FastJSONRenderer, FastJsonResponse, dumps
+from .cache_warmup import readiness, ensure_warm_up_started
+from .sampling_profiler import PROFILE_MODES, ALL_ROUTES, active_session, start_session, stop_session, list_sessions, merged_profile
+from .cipher_catalogue import get_cipher_catalogue, resolve_cipher, attach_ciphers, iter_with_ciphers, invalidate_cipher_catalogue
+from .variation_space import (
+    FONT_WEIGHTS, FONT_STYLES, VARY_FLAGS,
+    get_seen_bitmap, pick_unseen_variations, decode_variation, variation_id,
+    get_reserved, reserve_variations, release_variations
+)
 
-import random
-import itertools
+import hmac
 import logging
+import os
+import tempfile
+from datetime import datetime, time as dt_time, timezone as dt_timezone
 from collections import Counter, defaultdict
+from dataclasses import asdict
 import numpy as np
-from sentence_transformers.util import cos_sim
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
-FONT_WEIGHTS = [fw[0] for fw in Association.FontWeight.choices]
-FONT_STYLES = [fs[0] for fs in Association.FontStyle.choices]
-LETTER_SPACINGS = [0, 10]
-FONT_SIZES = [12, 16, 20]
-LINE_HEIGHTS = [1.2, 1.5, 1.8]
+SEMANTIC_SEARCH_CANDIDATES = 200
+# Ответы на мегабайты (варианты NLP с эмбеддингами, группы, граф): orjson, ndarray без .tolist()
+LARGE_RESPONSE_RENDERERS = [FastJSONRenderer, BrowsableAPIRenderer]
 
 def get_nlp_params_from_request(request_data_dict):
     def _get_value(param_key, default_str_value):
@@ -75,6 +102,57 @@ def get_nlp_params_from_request(request_data_dict):
     }
     return params
 
+def parse_semantic_search_filters(raw_filters):
+    """
+    Фильтры семантического поиска из тела запроса -> словарь для SemanticIndex.build_mask.
+    Шрифт и пользователь принимаются по имени (cipher, user) или по id (cipher_id, user_id);
+    любое поле может быть списком значений. Некорректные значения -> ValueError.
+    """
+    if not raw_filters:
+        return None
+    if not isinstance(raw_filters, dict):
+        raise ValueError("Параметр 'filters' должен быть объектом.")
+
+    def as_list(value):
+        return list(value) if isinstance(value, (list, tuple)) else [value]
+
+    filters = {}
+    try:
+        for name, cast in (('font_weight', int), ('letter_spacing', int), ('font_size', int), ('line_height', float), ('font_style', str)):
+            if raw_filters.get(name) not in (None, ''):
+                filters[name] = [cast(v) for v in as_list(raw_filters[name])]
+        cipher_ids = [int(v) for v in as_list(raw_filters['cipher_id'])] if raw_filters.get('cipher_id') not in (None, '') else []
+        user_ids = [int(v) for v in as_list(raw_filters['user_id'])] if raw_filters.get('user_id') not in (None, '') else []
+    except (TypeError, ValueError):
+        raise ValueError("Некорректное значение в 'filters'.")
+
+    if raw_filters.get('cipher'):
+        catalogue = get_cipher_catalogue()
+        cipher_ids += [catalogue.id_by_name[name] for name in as_list(raw_filters['cipher']) if name in catalogue.id_by_name]
+        cipher_ids = cipher_ids or [-1]  # неизвестный шрифт -> пустой результат, а не поиск по всем
+    if raw_filters.get('user'):
+        user_ids += list(User.objects.filter(username__in=as_list(raw_filters['user'])).values_list('id', flat=True))
+        user_ids = user_ids or [-1]
+    if cipher_ids:
+        filters['cipher_id'] = cipher_ids
+    if user_ids:
+        filters['user_id'] = user_ids
+
+    for name in ('created_from', 'created_to'):
+        value = raw_filters.get(name)
+        if not value:
+            continue
+        parsed = parse_datetime(str(value))
+        if parsed is None:
+            parsed_date = parse_date(str(value))
+            if parsed_date is None:
+                raise ValueError(f"Некорректная дата в 'filters.{name}'.")
+            parsed = datetime.combine(parsed_date, dt_time.max if name == 'created_to' else dt_time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        filters[name] = parsed
+    return filters or None
+
 class UserView(APIView):
     def get_permissions(self):
         if self.kwargs.get('action') in ['register', 'login']: return [AllowAny()]
@@ -106,7 +184,7 @@ class UserView(APIView):
         if user_id: return Response({"error": "Метод GET для одного пользователя не реализован"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         if not request.user.is_staff and not hasattr(request.user, 'administrator'): return Response({"error": "Недостаточно прав для просмотра пользователей"}, status=status.HTTP_403_FORBIDDEN)
         users_data = []
-        for u in User.objects.all():
+        for u in User.objects.select_related('profile'):
             data = {"id": u.id, "username": u.username, "email": u.email, "first_name": u.first_name, "last_name": u.last_name}
             if hasattr(u, 'profile') and u.profile: data['profile'] = {'gender': u.profile.gender, 'age': u.profile.age, 'education_level': u.profile.education_level, 'specialty': u.profile.specialty}
             users_data.append(data)
@@ -126,27 +204,58 @@ class RandomCipherView(APIView):
     POPULAR_CIPHERS = ["Times New Roman", "Arial", "Helvetica", "Garamond", "Comic Sans", "Courier New", "Georgia", "Verdana", "Baskerville", "Sans Forgetica"]
     def _create_popular_ciphers(self):
         for font_name in self.POPULAR_CIPHERS: Cipher.objects.get_or_create(result=font_name)
-        return list(Cipher.objects.all())
+        invalidate_cipher_catalogue()
+        return get_cipher_catalogue().ciphers
+    @staticmethod
+    def _variation_payload(combo, cipher_name):
+        return {"cipher_id": combo[0], "result": cipher_name, "font_weight": combo[1], "font_style": combo[2], "letter_spacing": combo[3], "font_size": combo[4], "line_height": float(combo[5])}
+
+    def _pick(self, request, count):
+        """(список (вариация, шрифт), ошибка): непросмотренные и не зарезервированные другими вкладками вариации."""
+        variations_params = {key: request.data.get(key, True) for key in VARY_FLAGS}
+        all_ciphers = get_cipher_catalogue().ciphers or self._create_popular_ciphers()
+        if not all_ciphers: return None, Response({"error": "Не удалось создать или найти шрифты."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Просмотренные вариации — битовая карта по плотным id, выбор — случайные пробы по маске vary_*
+        seen = get_seen_bitmap(request.user)
+        picked = pick_unseen_variations([c.id for c in all_ciphers], seen, variations_params, count=count, exclude=get_reserved(request.user.id))
+        names = {c.id: c.result for c in all_ciphers}
+        result = []
+        for vid in picked:
+            combo = decode_variation(vid)
+            result.append((vid, self._variation_payload(combo, names[combo[0]])))
+        return result, None
+
     def post(self, request):
-        user = request.user
-        variations_params = {key: request.data.get(key, True) for key in ['vary_weight', 'vary_style', 'vary_spacing', 'vary_size', 'vary_leading']}
-        seen_combinations = set(Association.objects.filter(user=user).values_list('cipher_id', 'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height'))
-        all_ciphers = list(Cipher.objects.all()) or self._create_popular_ciphers()
-        if not all_ciphers: return Response({"error": "Не удалось создать или найти шрифты."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        random.shuffle(all_ciphers)
-        for base_cipher in all_ciphers:
-            weights_to_try = FONT_WEIGHTS if variations_params['vary_weight'] else [Association.FontWeight.REGULAR]
-            styles_to_try = FONT_STYLES if variations_params['vary_style'] else [Association.FontStyle.NORMAL]
-            spacings_to_try = LETTER_SPACINGS if variations_params['vary_spacing'] else [0]
-            sizes_to_try = FONT_SIZES if variations_params['vary_size'] else [16]
-            leadings_to_try = LINE_HEIGHTS if variations_params['vary_leading'] else [1.5]
-            possible_combinations = list(itertools.product([base_cipher.id], weights_to_try, styles_to_try, spacings_to_try, sizes_to_try, leadings_to_try))
-            random.shuffle(possible_combinations)
-            for combo in possible_combinations:
-                if combo not in seen_combinations:
-                    return Response({"cipher_id": combo[0], "result": base_cipher.result, "font_weight": combo[1], "font_style": combo[2], "letter_spacing": combo[3], "font_size": combo[4], "line_height": float(combo[5])}, status=status.HTTP_200_OK)
+        picked, error = self._pick(request, count=1)
+        if error: return error
+        if picked:
+            return Response(picked[0][1], status=status.HTTP_200_OK)
         return Response({"message": "Вы прошли все доступные вариации шрифтов для выбранных настроек!", "all_seen": True}, status=status.HTTP_200_OK)
 
+class RandomCipherBatchView(RandomCipherView):
+    """
+    Следующие count разных непросмотренных вариаций за один запрос (предзагрузка сессии теста).
+    reserve=true закрепляет их за пользователем на VARIATION_RESERVATION_TTL секунд, чтобы
+    другая вкладка их не получила; StudyView снимает резерв с сохранённых вариаций.
+    """
+    MAX_BATCH_SIZE = 50
+
+    def post(self, request):
+        try:
+            count = min(max(int(request.data.get('count', 10)), 1), self.MAX_BATCH_SIZE)
+        except (TypeError, ValueError):
+            return Response({"error": "Параметр count должен быть целым числом."}, status=status.HTTP_400_BAD_REQUEST)
+        reserve = str(request.data.get('reserve', 'false')).lower() == 'true'
+        picked, error = self._pick(request, count=count)
+        if error: return error
+        reserved_until = reserve_variations(request.user.id, [vid for vid, _ in picked]) if reserve and picked else None
+        return Response({
+            "variations": [payload for _, payload in picked],
+            "all_seen": not picked,
+            "exhausted": len(picked) < count,
+            "reserved_until": reserved_until,
+        }, status=status.HTTP_200_OK)
+
 class StudyView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request):
@@ -157,6 +266,8 @@ class StudyView(APIView):
             "preprocess": True, "remove_stops": True, "lemmatize_step": True,
             "group_syns": False, "grouping_strategy": "lemmas", "tokenize_step": True
         }
+        self._nlp_director = None
+        saved_variations = []
         for item in data:
             item_nlp_params_from_request = item.get("processing_options", {})
             actual_nlp_params = default_nlp_params.copy()
@@ -164,11 +275,24 @@ class StudyView(APIView):
 
             result = self._save_single_study(item, user, actual_nlp_params)
             if "error" in result: errors.append(result)
-            elif not result.get("skipped"): results.append(result)
+            elif not result.get("skipped"):
+                results.append(result)
+                saved_variations.append(variation_id(
+                    item.get("cipher_id"), item.get("font_weight", Association.FontWeight.REGULAR), item.get("font_style", Association.FontStyle.NORMAL),
+                    item.get("letter_spacing", 0), item.get("font_size", 16), item.get("line_height", 1.5)
+                ))
+        if saved_variations:
+            release_variations(user.id, [vid for vid in saved_variations if vid is not None])
         status_code = status.HTTP_207_MULTI_STATUS if errors and results else (status.HTTP_400_BAD_REQUEST if errors else status.HTTP_201_CREATED)
         message = "Сохранение завершено." if not errors or results else "Сохранение завершено с ошибками."
         return Response({"message": message, "saved": results, "errors": errors}, status=status_code)
 
+    def _get_nlp_director(self):
+        # Один builder/director на весь пакет: пропущенные элементы его не создают
+        if getattr(self, '_nlp_director', None) is None:
+            self._nlp_director = NLPProcessingDirector(builder=AdvancedTextProcessorBuilder())
+        return self._nlp_director
+
     def _save_single_study(self, study_data, user, nlp_params_for_save):
         cipher_id = study_data.get("cipher_id"); reaction_description = study_data.get("reaction_description")
         font_weight = study_data.get("font_weight", Association.FontWeight.REGULAR); font_style = study_data.get("font_style", Association.FontStyle.NORMAL)
@@ -178,9 +302,12 @@ class StudyView(APIView):
             return {"skipped": True, "cipher_id": cipher_id, "reason": "Empty or skipped reaction"}
         if not cipher_id: return {"error": "Поле 'cipher_id' (базовый шрифт) обязательно", "data": study_data}
         if font_weight not in FONT_WEIGHTS or font_style not in FONT_STYLES: return {"error": "Недопустимые значения weight или style", "data": study_data}
+        try: cipher_pk = int(cipher_id)
+        except (TypeError, ValueError): return {"error": f"Базовый шрифт с ID {cipher_id} не найден", "data": study_data}
         try:
-            cipher = Cipher.objects.get(id=cipher_id)
-            nlp_builder = AdvancedTextProcessorBuilder(); nlp_director = NLPProcessingDirector(builder=nlp_builder)
+            cipher = resolve_cipher(cipher_pk)
+            if cipher is None: raise Cipher.DoesNotExist
+            nlp_director = self._get_nlp_director()
             if (nlp_params_for_save.get("lemmatize_step") or nlp_params_for_save.get("group_syns")) and not nlp_params_for_save.get("tokenize_step"):
                 nlp_params_for_save["tokenize_step"] = True
 
@@ -205,11 +332,14 @@ class StudyView(APIView):
                     'reaction_description': reaction_description,
                     'reaction_lemmas': " ".join(nlp_result.lemmas),
                     'grouping_key_lemmas': nlp_result.grouping_key,
-                    'text_embedding_vector': nlp_result.text_embedding.tolist() if nlp_result.text_embedding is not None else None,
                 }
             )
             if not created:
                  return {"error": "Повторная реакция на ту же вариацию", "skipped": True, "data": study_data}
+            save_association_embedding(
+                association.id, nlp_result.text_embedding,
+                association_content_hash(association.reaction_description, association.reaction_lemmas)
+            )
             
             return {"association_id": association.id, "processed_key_saved": processed_reaction_key, "original_reaction": reaction_description}
         except Cipher.DoesNotExist: return {"error": f"Базовый шрифт с ID {cipher_id} не найден", "data": study_data}
@@ -219,43 +349,78 @@ class StudyView(APIView):
 
 class GraphView(View):
     def get(self, request):
+        if request.GET.get('prebuilt', 'false').lower() == 'true':
+            return self._prebuilt_response(request)
         nlp_params = get_nlp_params_from_request(request.GET)
         try:
-            qs = Association.objects.select_related('cipher').filter(
-                reaction_description__isnull=False
-            ).exclude(reaction_description__exact='').values_list(
-                'cipher__result', 'reaction_description'
-            )
+            # Результат для параметров по умолчанию заранее считает warm_caches
+            data = cached_live_graph_data(nlp_params)
         except Exception as e:
             logger.error(f"GraphView: Ошибка при получении данных: {e}")
             return JsonResponse({"error": "Не удалось получить данные об ассоциациях"}, status=500)
+        return FastJsonResponse(data)
 
-        nlp_builder = AdvancedTextProcessorBuilder()
-        nlp_director = NLPProcessingDirector(builder=nlp_builder)
-        nlp_cache = {}
-        frequency = Counter()
+    def _prebuilt_response(self, request):
+        # Рёбра шрифт — лемма из графа build_graph: description здесь лемма, а не ключ группировки
+        try:
+            min_weight = int(request.GET.get('min_weight', 1))
+        except ValueError:
+            return JsonResponse({"error": "Параметр min_weight должен быть целым числом."}, status=400)
+        edges = Edge.objects.filter(
+            node1__graph__name=request.GET.get('graph', DEFAULT_GRAPH_NAME),
+            connection_type=Edge.ConnectionType.FONT_LEMMA, weight__gte=min_weight
+        ).values_list('node1__name', 'node2__name', 'weight')
+        data = [{'name': name, 'description': desc, 'count': count} for name, desc, count in edges]
+        return FastJsonResponse(data)
+
+class GraphEdgesPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
 
-        for font_name, reaction_desc in qs:
-            if not font_name or not reaction_desc:
-                continue
-            if reaction_desc not in nlp_cache:
-                analysis_result = nlp_director.construct_custom_analysis(
-                    text=reaction_desc, **nlp_params
-                )
-                processed_desc = analysis_result.grouping_key or ""
-                nlp_cache[reaction_desc] = processed_desc
-            else:
-                processed_desc = nlp_cache[reaction_desc]
-            if not processed_desc:
-                processed_desc = reaction_desc[:50]
-            key = (font_name, processed_desc)
-            frequency[key] += 1
-
-        data = [
-            {'name': name, 'description': desc, 'count': count}
-            for (name, desc), count in frequency.items()
+class GraphEdgesView(APIView):
+    """Рёбра материализованного графа по убыванию веса с фильтрами по типу связи, весу и узлу."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        graph_name = request.query_params.get('graph', DEFAULT_GRAPH_NAME)
+        graph = Graph.objects.filter(name=graph_name).first()
+        if graph is None:
+            return Response({"error": f"Граф '{graph_name}' ещё не построен (manage.py build_graph)."}, status=status.HTTP_404_NOT_FOUND)
+        connection_type = request.query_params.get('type')
+        if connection_type and connection_type not in Edge.ConnectionType.values:
+            return Response({"error": f"Параметр type должен быть одним из: {', '.join(Edge.ConnectionType.values)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            min_weight = int(request.query_params.get('min_weight', 1))
+        except ValueError:
+            return Response({"error": "Параметр min_weight должен быть целым числом."}, status=status.HTTP_400_BAD_REQUEST)
+
+        edges = Edge.objects.filter(node1__graph=graph, weight__gte=min_weight)
+        if connection_type:
+            edges = edges.filter(connection_type=connection_type)
+        node_name = request.query_params.get('node')
+        if node_name:
+            edges = edges.filter(Q(node1__name=node_name) | Q(node2__name=node_name))
+        edges = edges.order_by('-weight', 'id').values(
+            'node1__name', 'node1__node_type', 'node2__name', 'node2__node_type', 'connection_type', 'weight'
+        )
+
+        paginator = GraphEdgesPagination()
+        page = paginator.paginate_queryset(edges, request, view=self)
+        results = [
+            {
+                'source': edge['node1__name'], 'source_type': edge['node1__node_type'],
+                'target': edge['node2__name'], 'target_type': edge['node2__node_type'],
+                'type': edge['connection_type'], 'weight': edge['weight'],
+            }
+            for edge in page
         ]
-        return JsonResponse(data, safe=False)
+        response = paginator.get_paginated_response(results)
+        response.data['graph'] = {
+            'name': graph.name, 'cipher_count': graph.cipher_count, 'updated_at': graph.updated_at,
+            'pending_associations': pending_associations().count(),
+        }
+        return response
 
 class AssociationSearchView(APIView):
     permission_classes = [IsAuthenticated]
@@ -277,80 +442,61 @@ class AssociationSearchView(APIView):
         if not search_query_original: 
             return Response([], status=status.HTTP_200_OK)
 
-        nlp_builder = AdvancedTextProcessorBuilder()
-        nlp_director = NLPProcessingDirector(builder=nlp_builder)
-
         if search_use_embeddings:
-            sbert_model = get_sentence_transformer()
-            if not sbert_model:
-                logger.error("AssociationSearchView: Модель SentenceTransformer не загружена.")
-                return Response({"error": "Модель для семантического поиска не загружена на сервере."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            nlp_params_for_embedding_search = {
-                "preprocess": nlp_params_from_req.get('preprocess', True),
-                "tokenize_step": True,
-                "remove_stops": nlp_params_from_req.get('remove_stops', True),
-                "lemmatize_step": nlp_params_from_req.get('lemmatize_step', True),
-                "group_syns": False,
-                "grouping_strategy": "lemmas",
-                "gen_text_emb": True
-            }
-            
-            query_analysis_result_emb: NLPAnalysisResult = nlp_director.construct_custom_analysis(
-                text=search_query_original, 
-                **nlp_params_for_embedding_search
+            nlp_params_for_embedding_search = search_nlp_params(
+                preprocess=nlp_params_from_req.get('preprocess', True),
+                remove_stops=nlp_params_from_req.get('remove_stops', True),
+                lemmatize_step=nlp_params_from_req.get('lemmatize_step', True),
             )
+            # Повторные запросы ("весёлый", "строгий", ...) берутся из кэша без инференса модели.
+            query_analysis = cached_search_analysis(search_query_original, nlp_params_for_embedding_search)
 
-            if query_analysis_result_emb.text_embedding is None:
+            if query_analysis.embedding is None:
+                if not get_sentence_transformer():
+                    logger.error("AssociationSearchView: Модель SentenceTransformer не загружена.")
+                    return Response({"error": "Модель для семантического поиска не загружена на сервере."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
                 logger.error(f"AssociationSearchView: Не удалось получить эмбеддинг для запроса '{search_query_original}'.")
                 return Response({"error": "Не удалось обработать поисковый запрос для семантического поиска."}, status=status.HTTP_400_BAD_REQUEST)
-            
-            query_embedding = query_analysis_result_emb.text_embedding
-            logger.info(f"AssociationSearchView: Вектор для запроса '{search_query_original}' получен, форма: {query_embedding.shape}.")
-
-            candidate_associations = Association.objects.select_related('cipher').filter(
-                reaction_description__isnull=False
-            ).exclude(reaction_description__exact='')
-            
-            if not candidate_associations.exists():
-                return Response([], status=status.HTTP_200_OK)
 
-            results_with_similarity = []
-            texts_to_embed_from_db = []
-            assoc_objects_map = []
-
-            for assoc in candidate_associations:
-                text_for_assoc_emb = assoc.reaction_lemmas
-                if not text_for_assoc_emb or not text_for_assoc_emb.strip():
-                    temp_nlp_params = nlp_params_for_embedding_search.copy()
-                    temp_nlp_params["gen_text_emb"] = False
-                    assoc_text_analysis: NLPAnalysisResult = nlp_director.construct_custom_analysis(
-                        text=assoc.reaction_description, **temp_nlp_params
-                    )
-                    text_for_assoc_emb = assoc_text_analysis.grouping_key
-                
-                if text_for_assoc_emb and text_for_assoc_emb.strip():
-                    texts_to_embed_from_db.append(text_for_assoc_emb)
-                    assoc_objects_map.append(assoc)
-                else:
-                    logger.warning(f"Пропуск ассоциации ID {assoc.id} из-за отсутствия текста для эмбеддинга.")
-
-            if not texts_to_embed_from_db:
-                logger.info("Нет текстов из БД для генерации эмбеддингов.")
-                return Response([], status=status.HTTP_200_OK)
+            query_embedding = np.asarray(query_analysis.embedding, dtype=np.float32)
+            logger.info(f"AssociationSearchView: Вектор для запроса '{search_query_original}' получен, форма: {query_embedding.shape}.")
 
             try:
-                document_embeddings = sbert_model.encode(texts_to_embed_from_db, convert_to_numpy=True, show_progress_bar=False)
-            except Exception as e:
-                logger.error(f"Ошибка при пакетном кодировании текстов из БД: {e}")
-                return Response({"error": "Ошибка при обработке данных для семантического поиска."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            for i, assoc_embedding_np in enumerate(document_embeddings):
-                assoc = assoc_objects_map[i]
-                similarity = cos_sim(query_embedding, assoc_embedding_np).item()
+                semantic_filters = parse_semantic_search_filters(request.data.get('filters'))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Фильтры применяются маской до выбора top-k; кандидатов берём с запасом под группировку.
+            index = get_semantic_index()
+            rows, similarities = index.search(
+                query_embedding, k=SEMANTIC_SEARCH_CANDIDATES, filters=semantic_filters, min_score=0.3
+            )
 
-                if similarity < 0.3:
-                    continue
+            # Лучшая реакция на вариацию (или на шрифт, если match_exact_variation=false).
+            variation_fields = ('cipher_id',)
+            if match_exact_variation:
+                variation_fields += ('font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height')
+            variation_groups = {}
+            for row, similarity in zip(rows, similarities):
+                attrs = index.attributes_of(row)
+                variation_key = tuple(attrs[name] for name in variation_fields)
+                if variation_key in variation_groups:
+                    variation_groups[variation_key]['count'] += 1
+                else:
+                    variation_groups[variation_key] = {'row': row, 'similarity': float(similarity), 'count': 1}
+            best_groups = list(variation_groups.values())[:20]
+
+            assoc_by_id = Association.objects.in_bulk([int(index.ids[g['row']]) for g in best_groups])
+            attach_ciphers(assoc_by_id.values())
+            max_frequency = max((g['count'] for g in best_groups), default=0)
+            # count — только среди кандидатов top-k; полный размер вариации берём из масок индекса
+            search_scope = index.build_mask(semantic_filters)
+            results_with_similarity = []
+            for group in best_groups:
+                assoc = assoc_by_id.get(int(index.ids[group['row']]))
+                if assoc is None:
+                    continue  # удалена после построения индекса
+                similarity = group['similarity']
 
                 serialized_assoc = AssociationSerializer(assoc).data
                 serialized_assoc['cipher_name'] = assoc.cipher.result 
@@ -359,17 +505,19 @@ class AssociationSearchView(APIView):
                     'details': serialized_assoc,
                     'best_reaction_text': assoc.reaction_description,
                     'best_reaction_relevance_percentage': round(similarity * 100, 2),
-                    'best_reaction_frequency': 1,
-                    'total_associations_in_variation': 1,
+                    'best_reaction_frequency': group['count'],
+                    'total_associations_in_variation': index.count_like(group['row'], variation_fields, search_scope),
                     'aggregated_by_font_only': not match_exact_variation, 
-                    'relative_frequency_percentage': 0,
+                    'relative_frequency_percentage': round(group['count'] / max_frequency * 100, 1) if max_frequency else 0,
                     'similarity_score_debug': similarity
                 })
             
-            results_with_similarity.sort(key=lambda x: x['best_reaction_relevance_percentage'], reverse=True)
-            return Response(results_with_similarity[:20], status=status.HTTP_200_OK) 
+            return Response(results_with_similarity, status=status.HTTP_200_OK) 
 
         else: 
+            nlp_builder = AdvancedTextProcessorBuilder()
+            nlp_director = NLPProcessingDirector(builder=nlp_builder)
+
             temp_nlp_params_for_tokenization = nlp_params_from_req.copy()
             if not temp_nlp_params_for_tokenization.get('tokenize_step', False) and \
                (temp_nlp_params_for_tokenization.get('remove_stops', False) or \
@@ -426,12 +574,13 @@ class AssociationSearchView(APIView):
             elif not q_objects: 
                  return Response({"error": "Не удалось сформировать условия поиска."}, status=status.HTTP_400_BAD_REQUEST)
 
-            candidate_associations = Association.objects.filter(q_objects).select_related('cipher').only(
-                'id', 'cipher_id', 'cipher__result', 'reaction_description', 'reaction_lemmas', 
+            # Шрифты берутся из справочника процесса, без JOIN на cipher
+            candidate_associations = attach_ciphers(Association.objects.filter(q_objects).only(
+                'id', 'cipher_id', 'reaction_description', 'reaction_lemmas', 
                 'font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height', 'created_at', 'user_id'
-            ) 
+            ))
 
-            if not candidate_associations.exists():
+            if not candidate_associations:
                 return Response([], status=status.HTTP_200_OK)
 
             variation_reaction_groups = defaultdict(lambda: defaultdict(lambda: {
@@ -551,8 +700,295 @@ class AssociationSearchView(APIView):
             
             return Response(final_results_payload[:20], status=status.HTTP_200_OK)
 
+class QueryCacheStatsView(APIView):
+    """Статистика кэша эмбеддингов поисковых запросов (hit rate) для текущего процесса."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(query_embedding_cache.stats(), status=status.HTTP_200_OK)
+
+class HasMetricsToken(BasePermission):
+    """Доступ сборщика метрик по заголовку X-Metrics-Token (settings.METRICS_TOKEN)."""
+
+    def has_permission(self, request, view):
+        expected = getattr(settings, 'METRICS_TOKEN', '')
+        provided = request.headers.get('X-Metrics-Token', '')
+        return bool(expected) and hmac.compare_digest(provided, expected)
+
+class MetricsView(APIView):
+    """
+    Метрики процесса в текстовом формате Prometheus: гистограммы этапов NLP и длительностей
+    запросов, счётчики текстов, токенов и обращений к кэшу запросов.
+    """
+    permission_classes = [HasMetricsToken | IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class ProfilingView(APIView):
+    """
+    Профилирование воркеров без передеплоя: POST включает сессию для маршрута (route — имя
+    из urls.py, '*' — все) на requests запросов или seconds секунд, DELETE выключает,
+    GET — активная сессия и сохранённые результаты.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        session = active_session()
+        return Response({
+            'active': asdict(session) if session else None,
+            'sessions': list_sessions(),
+            'modes': PROFILE_MODES,
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        try:
+            session = start_session(
+                route=str(request.data.get('route', ALL_ROUTES)),
+                mode=str(request.data.get('mode', 'sample')),
+                requests=int(request.data.get('requests', 100)),
+                seconds=int(request.data.get('seconds', 300)),
+                interval_ms=float(request.data.get('interval_ms', 5)),
+            )
+        except (TypeError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**asdict(session), 'download': reverse('profiling-download', args=[session.id])},
+                        status=status.HTTP_201_CREATED)
+
+    def delete(self, request):
+        return Response({'stopped': stop_session()}, status=status.HTTP_200_OK)
+
+class ProfilingDownloadView(APIView):
+    """Результаты сессии со всех воркеров: collapsed stacks (flamegraph.pl, speedscope) или .prof."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, session_id):
+        profile = merged_profile(session_id)
+        if profile is None:
+            return Response({"error": "Результатов профилирования для этой сессии нет."}, status=status.HTTP_404_NOT_FOUND)
+        content, filename, content_type = profile
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class ReadinessView(APIView):
+    """
+    Готовность воркера: модели NLP загружены, прогрев моделей и кэшей (cache_warmup) завершён — шаги кэшей
+    с ошибкой перечислены в caches.failed_steps, но готовность не снимают. 503, пока прогрев не завершён;
+    если воркер запущен без хуков gunicorn.conf.py, первый запрос запускает прогрев в фоне.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        state = readiness()
+        if not state['warm']:
+            ensure_warm_up_started()
+        return Response(state, status=status.HTTP_200_OK if state['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+class QueryProfileStatsView(APIView):
+    """Скользящая статистика SQL по маршрутам: число запросов, время в БД, повторы (N+1)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        if request.query_params.get('reset') == 'true':
+            query_profiler.reset()
+        return Response({
+            'sample_rate': query_profiler.config().get('SAMPLE_RATE', 0.0),
+            'routes': query_profiler.stats(),
+        }, status=status.HTTP_200_OK)
+
+class SimilarAssociationsView(APIView):
+    """Семантически ближайшие реакции к ассоциации из предвычисленной таблицы соседей (build_neighbors)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, association_id):
+        try:
+            k = min(max(int(request.query_params.get('k', 10)), 1), 100)
+        except ValueError:
+            return Response({"error": "Параметр k должен быть целым числом."}, status=status.HTTP_400_BAD_REQUEST)
+        if not Association.objects.filter(id=association_id).exists():
+            return Response({"error": "Ассоциация не найдена"}, status=status.HTTP_404_NOT_FOUND)
+
+        neighbors = get_neighbors(association_id, k=k)
+        if neighbors is None:
+            return Response({"error": "Для ассоциации ещё не построен эмбеддинг."}, status=status.HTTP_404_NOT_FOUND)
+
+        assoc_by_id = Association.objects.in_bulk([neighbor_id for neighbor_id, _ in neighbors])
+        attach_ciphers(assoc_by_id.values())
+        results = []
+        for neighbor_id, score in neighbors:
+            assoc = assoc_by_id.get(neighbor_id)
+            if assoc is None:
+                continue  # удалена после построения списка
+            serialized_assoc = AssociationSerializer(assoc).data
+            serialized_assoc['cipher_name'] = assoc.cipher.result
+            results.append({
+                'details': serialized_assoc,
+                'reaction_text': assoc.reaction_description,
+                'similarity': round(float(score), 4),
+            })
+        return Response({'association_id': association_id, 'results': results}, status=status.HTTP_200_OK)
+
+class FontSimilarityView(APIView):
+    """
+    Похожесть шрифтов по реакциям из предвычисленных профилей (build_font_similarity).
+    Без cipher_id — полная матрица шрифт x шрифт; с cipher_id — top_k похожих шрифтов,
+    а если переданы ещё и параметры вариации (font_weight, font_style, ...) — похожих вариаций.
+    """
+    permission_classes = [IsAuthenticated]
+    VARIATION_PARAMS = ('font_weight', 'font_style', 'letter_spacing', 'font_size', 'line_height')
+
+    def get(self, request):
+        kind = request.query_params.get('kind', 'embedding')
+        if kind not in SIMILARITY_KINDS:
+            return Response({"error": f"Параметр kind должен быть одним из: {', '.join(SIMILARITY_KINDS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            top_k = min(max(int(request.query_params.get('top_k', 5)), 1), 100)
+            cipher_id = request.query_params.get('cipher_id')
+            cipher_id = int(cipher_id) if cipher_id not in (None, '') else None
+        except ValueError:
+            return Response({"error": "Параметры cipher_id и top_k должны быть целыми числами."}, status=status.HTTP_400_BAD_REQUEST)
+
+        profiles = get_font_profiles()
+        names = get_cipher_catalogue().names()
+
+        if cipher_id is None:
+            matrix = profiles.similarity_matrix(kind)
+            return Response({
+                'kind': kind,
+                'ciphers': [
+                    {'cipher_id': int(c), 'name': names.get(int(c)), 'associations': int(n)}
+                    for c, n in zip(profiles.cipher_ids, profiles.cipher_counts)
+                ],
+                'matrix': np.round(matrix, 4).tolist(),
+            }, status=status.HTTP_200_OK)
+
+        if any(param in request.query_params for param in self.VARIATION_PARAMS):
+            if kind != 'embedding':
+                return Response({"error": "Похожесть вариаций считается только по эмбеддингам (kind=embedding)."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                params = {param: request.query_params[param] for param in self.VARIATION_PARAMS}
+                if params['font_style'] not in FONT_STYLE_VALUES:
+                    raise ValueError
+                key = variation_key(cipher_id, **params)
+            except (KeyError, ValueError):
+                return Response({"error": f"Для вариации нужны все параметры: {', '.join(self.VARIATION_PARAMS)}."}, status=status.HTTP_400_BAD_REQUEST)
+            similar = profiles.top_k_variations(key, k=top_k)
+            if similar is None:
+                return Response({"error": "Для этой вариации ещё нет эмбеддингов."}, status=status.HTTP_404_NOT_FOUND)
+            return Response({
+                'kind': kind,
+                'variation': decode_variation_key(key),
+                'similar': [
+                    {**decode_variation_key(other), 'name': names.get(other[0]), 'similarity': round(score, 4)}
+                    for other, score in similar
+                ],
+            }, status=status.HTTP_200_OK)
+
+        similar = profiles.top_k_ciphers(cipher_id, k=top_k, kind=kind)
+        if similar is None:
+            return Response({"error": "Для этого шрифта ещё нет реакций."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'kind': kind,
+            'cipher_id': cipher_id,
+            'name': names.get(cipher_id),
+            'similar': [
+                {'cipher_id': other_id, 'name': names.get(other_id), 'similarity': round(score, 4)}
+                for other_id, score in similar
+            ],
+        }, status=status.HTTP_200_OK)
+
+class CharacteristicLemmasView(APIView):
+    """
+    Характерные для шрифта (или его вариаций при level=variation) леммы реакций
+    по PMI / lift / chi2 из разреженной таблицы шрифт x лемма.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        level = request.query_params.get('level', 'cipher')
+        metric = request.query_params.get('metric', 'pmi')
+        if level not in ('cipher', 'variation'):
+            return Response({"error": "Параметр level должен быть 'cipher' или 'variation'."}, status=status.HTTP_400_BAD_REQUEST)
+        if metric not in LEMMA_METRICS:
+            return Response({"error": f"Параметр metric должен быть одним из: {', '.join(LEMMA_METRICS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            top_k = min(max(int(request.query_params.get('top_k', 10)), 1), 200)
+            min_count = max(int(request.query_params.get('min_count', 3)), 1)
+            cipher_id = request.query_params.get('cipher_id')
+            cipher_id = int(cipher_id) if cipher_id not in (None, '') else None
+        except ValueError:
+            return Response({"error": "Параметры cipher_id, top_k и min_count должны быть целыми числами."}, status=status.HTTP_400_BAD_REQUEST)
+        if level == 'variation' and cipher_id is None:
+            return Response({"error": "Для level=variation укажите cipher_id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        table = get_contingency()
+        if level == 'cipher':
+            rows = [(key, row) for key, row in table.cipher_rows.items() if cipher_id is None or key == cipher_id]
+        else:
+            rows = [(key, row) for key, row in table.variation_rows.items() if key[0] == cipher_id]
+        names = get_cipher_catalogue().names()
+
+        results = []
+        for key, row in sorted(rows, key=lambda item: item[0]):
+            item = {'cipher_id': key if level == 'cipher' else key[0]}
+            item['name'] = names.get(item['cipher_id'])
+            if level == 'variation':
+                item.update({
+                    'font_weight': key[1], 'font_style': FONT_STYLE_VALUES[key[2]] if key[2] >= 0 else None,
+                    'letter_spacing': key[3], 'font_size': key[4], 'line_height': key[5] / 10,
+                })
+            item['lemmas'] = table.top_lemmas(row, level=level, metric=metric, k=top_k, min_count=min_count)
+            results.append(item)
+        return Response({
+            'level': level, 'metric': metric,
+            'version': {
+                'max_association_id': table.max_association_id, 'associations': table.total_associations,
+                'lemmatized_associations': table.lemmatized_associations,
+            },
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+class DatasetExportView(APIView):
+    """
+    Колоночная выгрузка ассоциаций файлом (см. export_dataset): ?file_format=parquet|npz,
+    ?since=<ISO 8601> — водяной знак прошлой выгрузки (заголовок X-Export-Watermark). Окно перекрытия
+    DATASET_EXPORT_SETTLE_SECONDS выгружается повторно: строки, уже полученные раньше, отбрасываются по id.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        file_format = request.query_params.get('file_format') or default_format()
+        if file_format not in EXPORT_FORMATS:
+            return Response({"error": f"Параметр file_format должен быть одним из: {', '.join(EXPORT_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        since = None
+        if request.query_params.get('since'):
+            try:
+                since_at = parse_datetime(request.query_params['since'])
+            except ValueError:
+                since_at = None
+            if since_at is None or since_at.tzinfo is None:
+                return Response({"error": "Параметр since должен быть датой и временем ISO 8601 с часовым поясом."}, status=status.HTTP_400_BAD_REQUEST)
+            since = {'created_at': since_at.isoformat(), 'exported_ids': []}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, f"associations.{file_format}")
+            try:
+                meta = export_dataset(path, fmt=file_format, since=since)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            # Открытый файл остаётся читаемым после удаления каталога: отдаём его потоком с диска
+            handle = open(path, 'rb')
+        response = FileResponse(handle, as_attachment=True, filename=f"associations-{meta['max_association_id']}.{file_format}")
+        response['X-Export-Count'] = str(meta['count'])
+        response['X-Export-Max-Association-Id'] = str(meta['max_association_id'])
+        response['X-Export-Watermark'] = meta['created_at']
+        return response
+
 class NLPAnalysisView(APIView):
     permission_classes = [IsAuthenticated]
+    renderer_classes = LARGE_RESPONSE_RENDERERS
 
     def _get_processing_variants(self, text_to_analyze, nlp_director, nlp_builder):
         analysis_variants = []
@@ -572,7 +1008,7 @@ class NLPAnalysisView(APIView):
                 "lemmas": result_v1.lemmas,
                 "synonym_groups": result_v1.synonym_groups,
                 "grouping_key": result_v1.grouping_key,
-                "text_embedding_vector": result_v1.text_embedding.tolist() if result_v1.text_embedding is not None else None
+                "text_embedding_vector": result_v1.text_embedding
             }
         })
 
@@ -588,7 +1024,7 @@ class NLPAnalysisView(APIView):
                 "lemmas": result_v2.lemmas,
                 "synonym_groups": result_v2.synonym_groups,
                 "grouping_key": result_v2.grouping_key,
-                "text_embedding_vector": result_v2.text_embedding.tolist() if result_v2.text_embedding is not None else None
+                "text_embedding_vector": result_v2.text_embedding
             }
         })
 
@@ -604,7 +1040,7 @@ class NLPAnalysisView(APIView):
                 "lemmas": result_v3.lemmas,
                 "synonym_groups": result_v3.synonym_groups,
                 "grouping_key": result_v3.grouping_key,
-                "text_embedding_vector": result_v3.text_embedding.tolist() if result_v3.text_embedding is not None else None
+                "text_embedding_vector": result_v3.text_embedding
             }
         })
 
@@ -621,7 +1057,7 @@ class NLPAnalysisView(APIView):
                     "lemmas": result_v4.lemmas,
                     "synonym_groups": result_v4.synonym_groups,
                     "grouping_key": result_v4.grouping_key,
-                    "text_embedding_vector": result_v4.text_embedding.tolist() if result_v4.text_embedding is not None else None
+                    "text_embedding_vector": result_v4.text_embedding
                 }
             })
         else:
@@ -639,7 +1075,7 @@ class NLPAnalysisView(APIView):
             embedding_vector_list = None
             if result_v5.text_embedding is not None:
                 embedding_details_str = f"Generated (vector shape: {result_v5.text_embedding.shape}, model: {sbert_model_name_val})"
-                embedding_vector_list = result_v5.text_embedding.tolist()
+                embedding_vector_list = result_v5.text_embedding
 
             analysis_variants.append({
                 "name": f"Текстовый Эмбеддинг ({sbert_model_name_val})",
@@ -678,21 +1114,84 @@ class NLPAnalysisView(APIView):
             "processing_variants": processing_variants
         }, status=status.HTTP_200_OK)
 
+class PooledAsyncView(View):
+    """
+    Асинхронный вариант синхронного представления для ASGI-сервера: обработчик sync_view
+    целиком (аутентификация, ORM, инференс) выполняется в пуле inference_pool с ограничением
+    ASYNC_ENDPOINT_LIMITS[endpoint], а цикл событий тем временем обслуживает лёгкие запросы.
+    Ответ рендерится там же, в потоке пула. Если слот не освободился за ASYNC_QUEUE_TIMEOUT — 503.
+    """
+    sync_view = None
+    endpoint = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Как у APIView: аутентификация по JWT, не по сессии
+        view.csrf_exempt = True
+        return view
+
+    async def _offload(self, request, *args, **kwargs):
+        handler = self.sync_view.as_view()
+
+        def call():
+            response = handler(request, *args, **kwargs)
+            if callable(getattr(response, 'render', None)):
+                response.render()
+            return response
+
+        try:
+            return await run_in_pool(self.endpoint, call)
+        except EndpointBusy as e:
+            response = JsonResponse({"error": "Сервер занят, повторите запрос позже."}, status=503)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+
+class AsyncAssociationSearchView(PooledAsyncView):
+    sync_view = AssociationSearchView
+    endpoint = 'search'
+    http_method_names = ['post', 'options']
+
+    async def post(self, request, *args, **kwargs):
+        return await self._offload(request, *args, **kwargs)
+
+class AsyncNLPAnalysisView(PooledAsyncView):
+    sync_view = NLPAnalysisView
+    endpoint = 'nlp'
+    http_method_names = ['post', 'options']
+
+    async def post(self, request, *args, **kwargs):
+        return await self._offload(request, *args, **kwargs)
+
+class AsyncGraphView(PooledAsyncView):
+    sync_view = GraphView
+    endpoint = 'graph'
+    http_method_names = ['get', 'options']
+
+    async def get(self, request, *args, **kwargs):
+        return await self._offload(request, *args, **kwargs)
+
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
     max_page_size = 20
 
 class AllAssociationsNLPAnalysisView(APIView):
+    """
+    Ассоциации с вариантами NLP-обработки постранично. По умолчанию — курсор по (created_at, id)
+    (?cursor=...), с ?page=N — прежняя нумерация страниц с точным COUNT(*).
+    """
     permission_classes = [IsAuthenticated]
-    pagination_class = StandardResultsSetPagination
+    renderer_classes = LARGE_RESPONSE_RENDERERS
+    pagination_class = AssociationKeysetPagination
+    page_number_pagination_class = StandardResultsSetPagination
 
     def get(self, request):
-        associations_qs = Association.objects.select_related('cipher', 'user').filter(
+        associations_qs = Association.objects.select_related('user').filter(
             reaction_description__isnull=False
-        ).exclude(reaction_description__exact='').order_by('-created_at')
+        ).exclude(reaction_description__exact='').order_by(*KEYSET_ORDERING)
         
-        paginator = self.pagination_class()
+        paginator = self.page_number_pagination_class() if 'page' in request.query_params else self.pagination_class()
         page = paginator.paginate_queryset(associations_qs, request, view=self)
 
         if page is None:
@@ -701,9 +1200,10 @@ class AllAssociationsNLPAnalysisView(APIView):
         nlp_builder = AdvancedTextProcessorBuilder()
         nlp_director = NLPProcessingDirector(builder=nlp_builder)
         temp_nlp_analysis_view = NLPAnalysisView()
+        cipher_names = get_cipher_catalogue().names()
 
         results_on_page = []
-        for assoc in page:
+        for assoc in attach_ciphers(page):
             if not assoc.reaction_description or not assoc.reaction_description.strip():
                 continue
 
@@ -712,81 +1212,173 @@ class AllAssociationsNLPAnalysisView(APIView):
                 text_to_analyze, nlp_director, nlp_builder
             )
             
-            results_on_page.append({
-                "association_id": assoc.id,
-                "user_username": assoc.user.username if assoc.user else "N/A",
-                "cipher_name": assoc.cipher.result if assoc.cipher else "N/A",
-                "original_reaction_text": text_to_analyze,
-                "font_details": assoc.variation_details,
-                "processing_variants": processing_variants_for_assoc
-            })
+            results_on_page.append(association_nlp_record(assoc, processing_variants_for_assoc, cipher_names))
             
         return paginator.get_paginated_response(results_on_page)
 
+# Форматы потоковой выдачи: content-type и префикс записи (RS для application/json-seq, RFC 7464)
+STREAM_FORMATS = {
+    'ndjson': ('application/x-ndjson', ''),
+    'json-seq': ('application/json-seq', '\x1e'),
+}
+
+def admission_rejected_response(error: AdmissionRejected):
+    response = Response(
+        {"error": "Сервер занят обработкой тяжёлых запросов, повторите запрос позже.", "retry_after": error.retry_after},
+        status=error.status_code
+    )
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+def association_nlp_record(assoc, processing_variants, cipher_names):
+    return {
+        "association_id": assoc.id,
+        "user_username": assoc.user.username if assoc.user else "N/A",
+        "cipher_name": cipher_names.get(assoc.cipher_id, "N/A"),
+        "original_reaction_text": assoc.reaction_description,
+        "font_details": assoc.variation_details,
+        "processing_variants": processing_variants
+    }
+
 class AllAssociationsForNLPView(APIView):
+    """
+    Все ассоциации с вариантами NLP-обработки. ?stream=ndjson|json-seq — потоковая выдача:
+    записи читаются queryset.iterator() и отправляются по мере вычисления, память не растёт с таблицей.
+    """
     permission_classes = [IsAuthenticated]
+    renderer_classes = LARGE_RESPONSE_RENDERERS
+    STREAM_CHUNK_SIZE = 200
     
     def get(self, request):
-        nlp_builder = AdvancedTextProcessorBuilder()
-        nlp_director = NLPProcessingDirector(builder=nlp_builder)
-        temp_nlp_analysis_view = NLPAnalysisView()
-        
-        associations_qs = Association.objects.select_related('cipher', 'user').filter(
+        stream_format = request.query_params.get('stream')
+        if stream_format and stream_format not in STREAM_FORMATS:
+            return Response({"error": f"Параметр stream должен быть одним из: {', '.join(STREAM_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        associations_qs = Association.objects.select_related('user').filter(
             reaction_description__isnull=False
         ).exclude(reaction_description__exact='').order_by('-created_at')
-        
-        results = []
-        for assoc in associations_qs:
-            if not assoc.reaction_description or not assoc.reaction_description.strip():
-                continue
 
-            processing_variants = temp_nlp_analysis_view._get_processing_variants(
-                assoc.reaction_description, nlp_director, nlp_builder
-            )
-            
-            results.append({
-                "association_id": assoc.id,
-                "user_username": assoc.user.username if assoc.user else "N/A",
-                "cipher_name": assoc.cipher.result if assoc.cipher else "N/A",
-                "original_reaction_text": assoc.reaction_description,
-                "font_details": assoc.variation_details,
-                "processing_variants": processing_variants
-            })
-            
+        # Полная выгрузка занимает воркер на минуты: допуск по оценке числа строк (admission.py)
+        rows = estimate_count(associations_qs)
+        try:
+            ticket = admit('nlp-all', rows if rows is not None else associations_qs.count())
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+
+        if stream_format:
+            content_type, prefix = STREAM_FORMATS[stream_format]
+            records = ReleasingIterator(self._stream_records(associations_qs, prefix), ticket)
+            response = StreamingHttpResponse(records, content_type=content_type)
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # nginx не должен копить ответ целиком
+            return response
+
+        try:
+            nlp_builder = AdvancedTextProcessorBuilder()
+            nlp_director = NLPProcessingDirector(builder=nlp_builder)
+            temp_nlp_analysis_view = NLPAnalysisView()
+            cipher_names = get_cipher_catalogue().names()
+
+            results = []
+            for assoc in attach_ciphers(associations_qs):
+                if not assoc.reaction_description or not assoc.reaction_description.strip():
+                    continue
+
+                processing_variants = temp_nlp_analysis_view._get_processing_variants(
+                    assoc.reaction_description, nlp_director, nlp_builder
+                )
+                results.append(association_nlp_record(assoc, processing_variants, cipher_names))
+        finally:
+            ticket.release()
         return Response(results, status=status.HTTP_200_OK)
 
+    def _stream_records(self, associations_qs, prefix):
+        nlp_builder = AdvancedTextProcessorBuilder()
+        nlp_director = NLPProcessingDirector(builder=nlp_builder)
+        temp_nlp_analysis_view = NLPAnalysisView()
+        cipher_names = get_cipher_catalogue().names()
+        sent = 0
+        try:
+            rows = associations_qs.iterator(chunk_size=self.STREAM_CHUNK_SIZE)
+            for assoc in iter_with_ciphers(rows, chunk_size=self.STREAM_CHUNK_SIZE):
+                if not assoc.reaction_description or not assoc.reaction_description.strip():
+                    continue
+                processing_variants = temp_nlp_analysis_view._get_processing_variants(
+                    assoc.reaction_description, nlp_director, nlp_builder
+                )
+                record = association_nlp_record(assoc, processing_variants, cipher_names)
+                yield prefix.encode('utf-8') + dumps(record) + b'\n'
+                sent += 1
+        except Exception as e:
+            # Заголовки уже отправлены: сообщаем об обрыве последней записью
+            logger.error(f"AllAssociationsForNLPView: поток прерван после {sent} записей: {e}", exc_info=True)
+            yield prefix.encode('utf-8') + dumps({"error": "Выгрузка прервана из-за внутренней ошибки.", "sent": sent}) + b'\n'
+
 @api_view(['GET'])
+@renderer_classes(LARGE_RESPONSE_RENDERERS)
 def filtered_associations_for_nlp(request):
     font = request.GET.get('font')
     user = request.GET.get('user')
     search = request.GET.get('search')
-    limit = int(request.GET.get('limit', 200))
+    try:
+        limit = int(request.GET.get('limit', 200))
+    except ValueError:
+        return Response({"error": "Параметр limit должен быть целым числом."}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1:
+        return Response({"error": "Параметр limit должен быть положительным."}, status=status.HTTP_400_BAD_REQUEST)
     grouping_strategy = request.GET.get('grouping_strategy', 'lemmas')
+    cursor = request.GET.get('cursor')
 
-    qs = Association.objects.select_related('cipher', 'user').filter(
+    qs = Association.objects.select_related('user').filter(
         reaction_description__isnull=False
-    ).exclude(reaction_description__exact='').order_by('-created_at')
+    ).exclude(reaction_description__exact='').order_by(*KEYSET_ORDERING)
 
     if font:
-        qs = qs.filter(cipher__result=font)
+        cipher = resolve_cipher(name=font)
+        qs = qs.filter(cipher_id=cipher.id) if cipher else qs.none()
     if user:
         qs = qs.filter(user__username=user)
     if search:
         qs = qs.filter(reaction_description__icontains=search)
-
+    estimated_total = estimate_count(qs)
+    if cursor:
+        # Продолжение с места, где остановилась предыдущая порция (keyset по created_at, id)
+        try:
+            qs = after_cursor(qs, cursor)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Стоимость — до limit строк (меньше, если выборка меньше) на все варианты обработки
+    try:
+        ticket = admit('nlp-filtered', min(limit, estimated_total) if estimated_total is not None else limit)
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    with ticket:
+        return _filtered_associations_page(qs, limit, grouping_strategy, estimated_total)
+
+def _filtered_associations_page(qs, limit, grouping_strategy, estimated_total):
     nlp_builder = AdvancedTextProcessorBuilder()
     nlp_director = NLPProcessingDirector(builder=nlp_builder)
     temp_nlp_analysis_view = NLPAnalysisView()
+    cipher_names = get_cipher_catalogue().names()
 
     results = []
     count = 0
-    for assoc in qs:
+    next_cursor = None
+    last_assoc = None
+    # Строки читаются до первой после заполненной страницы: курсор отдаётся, только если она есть,
+    # иначе клиент сделал бы лишний запрос за пустой страницей
+    chunk_size = max(1, min(limit + 1, 500))
+    for assoc in iter_with_ciphers(qs.iterator(chunk_size=chunk_size), chunk_size=chunk_size):
+        if count >= limit:
+            next_cursor = encode_cursor(last_assoc.created_at, last_assoc.id)
+            break
         processing_variants = temp_nlp_analysis_view._get_processing_variants(
             assoc.reaction_description, nlp_director, nlp_builder
         )
         # ищем вариант с эмбеддингом
         has_embedding = any(
-            v.get('result', {}).get('text_embedding_vector')
+            v.get('result', {}).get('text_embedding_vector') is not None
             for v in processing_variants
         )
         if not has_embedding:
@@ -805,18 +1397,18 @@ def filtered_associations_for_nlp(request):
         results.append({
             "association_id": assoc.id,
             "user_username": assoc.user.username if assoc.user else "N/A",
-            "cipher_name": assoc.cipher.result if assoc.cipher else "N/A",
+            "cipher_name": cipher_names.get(assoc.cipher_id, "N/A"),
             "original_reaction_text": assoc.reaction_description,
             "font_details": assoc.variation_details,
             "processing_variants": processing_variants,
             "grouping_key": group_variant['result']['grouping_key'] if group_variant and 'result' in group_variant and 'grouping_key' in group_variant['result'] else assoc.reaction_description
         })
         count += 1
-        if count >= limit:
-            break
-    return Response({'results': results, 'count': count})
+        last_assoc = assoc
+    return Response({'results': results, 'count': count, 'next_cursor': next_cursor, 'estimated_total': estimated_total})
 
 @api_view(['GET'])
+@renderer_classes(LARGE_RESPONSE_RENDERERS)
 def fast_grouped_associations(request):
     font = request.GET.get('font')
     user = request.GET.get('user')
@@ -829,9 +1421,10 @@ def fast_grouped_associations(request):
         except Exception:
             limit = None
 
-    qs = Association.objects.select_related('user', 'cipher').all()
+    qs = Association.objects.select_related('user').all()
     if font:
-        qs = qs.filter(cipher__result=font)
+        cipher = resolve_cipher(name=font)
+        qs = qs.filter(cipher_id=cipher.id) if cipher else qs.none()
     if user:
         qs = qs.filter(user__username=user)
     if search:
@@ -848,10 +1441,11 @@ def fast_grouped_associations(request):
 
     # Получаем все ассоциации, попавшие в группы
     example_ids = [g['example_id'] for g in grouped]
-    assoc_qs = Association.objects.filter(id__in=example_ids)
-    id_to_embedding = {a.id: a.text_embedding_vector for a in assoc_qs}
+    assoc_qs = Association.objects.select_related('user').filter(id__in=example_ids)
+    id_to_embedding = get_embeddings_for(example_ids)
     id_to_user = {a.id: a.user.username if a.user else None for a in assoc_qs}
-    id_to_font = {a.id: a.cipher.result if a.cipher else None for a in assoc_qs}
+    cipher_names = get_cipher_catalogue().names()
+    id_to_font = {a.id: cipher_names.get(a.cipher_id) for a in assoc_qs}
 
     # Собираем все user_username и cipher_name с частотами по всем ассоциациям, попавшим в группы
     all_user_counts = {}
@@ -865,12 +1459,13 @@ def fast_grouped_associations(request):
         group_to_assocs[key].append({
             'user_username': a.user.username if a.user else None,
             'reaction_description': a.reaction_description,
-            'cipher_name': a.cipher.result if a.cipher else None,
+            'cipher_name': cipher_names.get(a.cipher_id),
         })
         if a.user and a.user.username:
             all_user_counts[a.user.username] = all_user_counts.get(a.user.username, 0) + 1
-        if a.cipher and a.cipher.result:
-            all_font_counts[a.cipher.result] = all_font_counts.get(a.cipher.result, 0) + 1
+        font_name = cipher_names.get(a.cipher_id)
+        if font_name:
+            all_font_counts[font_name] = all_font_counts.get(font_name, 0) + 1
 
     all_users = [
         {"user_username": username, "count": count}